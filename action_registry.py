@@ -0,0 +1,146 @@
+import time
+import logging
+import threading
+import metrics
+from http import HTTPStatus
+from incremental_sync import iter_pages
+from response_cache import response_cache
+from fast_validation import compile_validator, construct_url_data
+from single_flight import single_flight, normalize, SINGLE_FLIGHT_ENABLED
+from idempotency import idempotency_guard, IDEMPOTENCY_ENABLED
+
+'''
+Table driven dispatch of vendor actions.
+Every (vendor_id, action) pair is registered once at import with a handler that knows
+its params model, url model, header model and how to post process the vendor response.
+'''
+
+
+class ActionHandler:
+    def __init__(self, params_model, url_model, header_model, caller, post_processor=None, path_param=None,
+                 page_param=None, idempotency_param=None):
+        self.params_model = params_model
+        self.url_model = url_model
+        self.header_model = header_model
+        self.caller = caller
+        self.post_processor = post_processor
+        self.path_param = path_param
+        self.page_param = page_param
+        self.idempotency_param = idempotency_param
+        self.vendor_id = None
+        self.action = None
+        self.validate_params = compile_validator(params_model)
+        self.validate_header = compile_validator(header_model)
+        # constant for every call of this action, read them once from the url model defaults
+        self.verb = url_model.__fields__["verb"].default
+        self.call_method = url_model.__fields__["call_method"].default
+        self.calls = 0
+        self.errors = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+        self._lock = threading.Lock()
+
+    def handle(self, message_in_event):
+        with metrics.span("validation"):
+            request_params = self.validate_params(message_in_event["params"])
+            url_data = construct_url_data(self.url_model, message_in_event["base_url"])
+            header_data = self.validate_header(message_in_event["header"])
+        use_cache = message_in_event.get("cache")
+        if self.path_param:
+            response = response_cache.call(self.caller, url_data, None, header_data,
+                                           path=request_params[self.path_param], enabled=use_cache)
+        else:
+            response = response_cache.call(self.caller, url_data, request_params, header_data, enabled=use_cache)
+            if self.page_param and response["status_code"] == HTTPStatus.OK:
+                # data becomes a lazy iterator over the stations of every vendor page
+                response["data"] = iter_pages(
+                    response["data"],
+                    lambda page: response_cache.call(self.caller, url_data,
+                                                     dict(request_params, **{self.page_param: page}),
+                                                     header_data, enabled=use_cache))
+        if self.post_processor:
+            return self.post_processor(message_in_event, response)
+        return response
+
+    def single_flight_key(self, message_in_event) -> tuple:
+        return (self.vendor_id, self.action, str(message_in_event["base_url"]).rstrip("/"),
+                normalize(message_in_event["params"]), (message_in_event.get("header") or {}).get("key"),
+                bool(message_in_event.get("write")), bool(message_in_event.get("incremental")),
+                message_in_event.get("cache"))
+
+    def idempotency_key(self, message_in_event):
+        if not IDEMPOTENCY_ENABLED or not self.idempotency_param:
+            return None
+        value = (message_in_event.get("params") or {}).get(self.idempotency_param)
+        if value is None:
+            return None
+        return f"{self.vendor_id}:{self.action}:{value}"
+
+    def __call__(self, message_in_event):
+        start = time.perf_counter()
+        failed = True
+        response = None
+        try:
+            idempotency_key = self.idempotency_key(message_in_event)
+            if idempotency_key is not None:
+                # redelivered commands get the recorded result instead of a second vendor call
+                response = idempotency_guard.run(idempotency_key, lambda: self.handle(message_in_event))
+            elif SINGLE_FLIGHT_ENABLED and self.call_method == "GET":
+                # identical reads in flight share one vendor call, mapping and write
+                response = single_flight.do(self.single_flight_key(message_in_event),
+                                            lambda: self.handle(message_in_event))
+            else:
+                response = self.handle(message_in_event)
+            failed = False
+            return response
+        finally:
+            elapsed = time.perf_counter() - start
+            if failed:
+                status_code = HTTPStatus.INTERNAL_SERVER_ERROR
+            elif isinstance(response, dict):
+                status_code = response.get("status_code", HTTPStatus.OK)
+            else:
+                status_code = HTTPStatus.OK
+            metrics.count(self.vendor_id, self.action, status_code)
+            with self._lock:
+                self.calls += 1
+                self.errors += int(failed)
+                self.total_time += elapsed
+                self.max_time = max(self.max_time, elapsed)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"calls": self.calls, "errors": self.errors,
+                    "total_time": self.total_time, "max_time": self.max_time,
+                    "avg_time": self.total_time / self.calls if self.calls else 0.0}
+
+
+class ActionRegistry:
+    def __init__(self):
+        self._handlers = {}
+
+    def register(self, vendor_id: str, action: str, handler: ActionHandler):
+        handler.vendor_id = vendor_id.lower()
+        handler.action = action.lower()
+        self._handlers[(vendor_id.lower(), action.lower())] = handler
+
+    def get(self, vendor_id: str, action: str):
+        return self._handlers.get((vendor_id.lower(), action.lower()))
+
+    def is_retryable(self, vendor_id: str, action: str) -> bool:
+        """
+        Only reads can run again, a repeated start or stop could reach the vendor twice
+        """
+        handler = self.get(vendor_id, action)
+        return handler is not None and getattr(handler, "call_method", None) == "GET"
+
+    def dispatch(self, message_in_event):
+        handler = self.get(message_in_event["vendor_id"], message_in_event["action"])
+        if handler is None:
+            logging.warning("There is no match for this event. Here is the event dump %s",
+                            metrics.Redacted(message_in_event))
+            return None
+        return handler(message_in_event)
+
+    def stats(self) -> dict:
+        return {f"{vendor_id}.{action}": handler.stats() for (vendor_id, action), handler in self._handlers.items()}
@@ -0,0 +1,220 @@
+import os
+import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
+import metrics
+
+'''
+Adaptive polling of charging activities.
+Active sessions are tracked in one place and every poll round fetches the sessions that are due
+concurrently, on a bounded pool. A session that just changed is polled again after ACTIVITY_POLL_MIN_INTERVAL,
+every unchanged poll stretches its interval by ACTIVITY_POLL_BACKOFF up to ACTIVITY_POLL_MAX_INTERVAL,
+so vendor calls go to the sessions whose state is moving. Only state transitions are emitted,
+and sessions that reach a terminal status stop being polled.
+'''
+
+ACTIVITY_POLL_MAX_WORKERS = int(os.environ.get("ACTIVITY_POLL_MAX_WORKERS", 8))
+ACTIVITY_POLL_MIN_INTERVAL = float(os.environ.get("ACTIVITY_POLL_MIN_INTERVAL", 5))
+ACTIVITY_POLL_MAX_INTERVAL = float(os.environ.get("ACTIVITY_POLL_MAX_INTERVAL", 120))
+ACTIVITY_POLL_BACKOFF = float(os.environ.get("ACTIVITY_POLL_BACKOFF", 2))
+ACTIVITY_STATE_FIELDS = tuple(field.strip() for field in
+                              os.environ.get("ACTIVITY_STATE_FIELDS", "status").split(",") if field.strip())
+ACTIVITY_TERMINAL_STATUSES = frozenset(status.strip().lower() for status in
+                                       os.environ.get("ACTIVITY_TERMINAL_STATUSES",
+                                                      "completed,stopped,finished,failed,cancelled").split(",")
+                                       if status.strip())
+
+
+class TrackedSession:
+    __slots__ = ("session_id", "context", "state", "data", "interval", "next_poll_at", "changed_at", "polls",
+                 "in_flight")
+
+    def __init__(self, session_id: str, context, now: float, min_interval: float):
+        self.session_id = session_id
+        self.context = context
+        self.state = None
+        self.data = None
+        self.interval = min_interval
+        self.next_poll_at = now
+        self.changed_at = None
+        self.polls = 0
+        # taken by a poll round, concurrent rounds leave it alone
+        self.in_flight = False
+
+
+class ActivityPoller:
+    """
+    fetch(session_id, context) returns a handler response, {"status_code": ..., "data": activity}
+    """
+
+    def __init__(self, fetch, max_workers: int = None, min_interval: float = None, max_interval: float = None,
+                 backoff: float = None, state_fields: tuple = None, terminal_statuses=None, clock=time.monotonic):
+        self.fetch = fetch
+        self.max_workers = max_workers or ACTIVITY_POLL_MAX_WORKERS
+        self.min_interval = ACTIVITY_POLL_MIN_INTERVAL if min_interval is None else min_interval
+        self.max_interval = ACTIVITY_POLL_MAX_INTERVAL if max_interval is None else max_interval
+        self.backoff = backoff or ACTIVITY_POLL_BACKOFF
+        self.state_fields = state_fields or ACTIVITY_STATE_FIELDS
+        self.terminal_statuses = ACTIVITY_TERMINAL_STATUSES if terminal_statuses is None else terminal_statuses
+        self.clock = clock
+        self.polls = 0
+        self.errors = 0
+        self.transitions = 0
+        self._sessions = {}
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def track(self, session_ids, context=None):
+        now = self.clock()
+        with self._lock:
+            for session_id in session_ids:
+                session_id = str(session_id)
+                session = self._sessions.get(session_id)
+                if session is None:
+                    self._sessions[session_id] = TrackedSession(session_id, context, now, self.min_interval)
+                elif context is not None:
+                    session.context = context
+
+    def untrack(self, session_ids):
+        with self._lock:
+            for session_id in session_ids:
+                self._sessions.pop(str(session_id), None)
+
+    def next_due_in(self) -> float:
+        """
+        Seconds until the next session is due, None when nothing is waiting to be polled
+        """
+        with self._lock:
+            waiting = [session.next_poll_at for session in self._sessions.values() if not session.in_flight]
+            if not waiting:
+                return None
+            return max(0.0, min(waiting) - self.clock())
+
+    def _state_of(self, activity) -> tuple:
+        if not isinstance(activity, dict):
+            return activity,
+        return tuple(activity.get(field) for field in self.state_fields)
+
+    def _is_terminal(self, activity) -> bool:
+        return isinstance(activity, dict) and str(activity.get("status", "")).lower() in self.terminal_statuses
+
+    def _fetch(self, session: TrackedSession):
+        try:
+            return self.fetch(session.session_id, session.context)
+        except Exception:
+            logging.exception(f"Could not poll activity {session.session_id}")
+            return None
+
+    def _record(self, session: TrackedSession, response, now: float):
+        """
+        Updates the session from a poll and returns its transition, or None. Called with the lock held.
+        """
+        session.polls += 1
+        session.in_flight = False
+        if not isinstance(response, dict) or response.get("status_code") != HTTPStatus.OK:
+            # keep the last known state, back off like an unchanged poll
+            self.errors += 1
+            session.interval = min(self.max_interval, session.interval * self.backoff)
+            session.next_poll_at = now + session.interval
+            return None
+        activity = response.get("data")
+        state = self._state_of(activity)
+        terminal = self._is_terminal(activity)
+        if state == session.state:
+            session.interval = min(self.max_interval, session.interval * self.backoff)
+            session.next_poll_at = now + session.interval
+            return None
+        transition = {"id": session.session_id, "previous": session.data, "current": activity,
+                      "terminal": terminal}
+        session.state = state
+        session.data = activity
+        session.changed_at = now
+        session.interval = self.min_interval
+        session.next_poll_at = now + session.interval
+        if terminal and self._sessions.get(session.session_id) is session:
+            del self._sessions[session.session_id]
+        return transition
+
+    def poll_once(self) -> list:
+        """
+        Polls every due session concurrently and returns the transitions it saw
+        """
+        now = self.clock()
+        with self._lock:
+            due = [session for session in self._sessions.values()
+                   if session.next_poll_at <= now and not session.in_flight]
+            for session in due:
+                session.in_flight = True
+            if due and self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers,
+                                                    thread_name_prefix="activity-poller")
+        if not due:
+            return []
+        with metrics.span("activity_poll"):
+            responses = list(self._executor.map(self._fetch, due))
+        now = self.clock()
+        transitions = []
+        with self._lock:
+            for session, response in zip(due, responses):
+                transition = self._record(session, response, now)
+                if transition is not None:
+                    transitions.append(transition)
+            self.polls += len(due)
+            self.transitions += len(transitions)
+        return transitions
+
+    def run(self, on_transitions, stop_event: threading.Event, idle_seconds: float = 1.0):
+        """
+        Polls until stop_event is set, sleeping until the next session is due
+        """
+        while not stop_event.is_set():
+            transitions = self.poll_once()
+            if transitions:
+                on_transitions(transitions)
+            wait_seconds = self.next_due_in()
+            stop_event.wait(idle_seconds if wait_seconds is None else min(wait_seconds, idle_seconds))
+
+    def close(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"tracked": len(self._sessions), "polls": self.polls, "errors": self.errors,
+                    "transitions": self.transitions}
+
+
+class PollActivitiesHandler:
+    """
+    Action handler that tracks the session ids of the event and runs one poll round.
+    Sessions stay tracked in the container, later events (or a schedule) only need to trigger a round.
+    """
+    # only reads the vendor, safe to run again
+    call_method = "GET"
+
+    def __init__(self, params_model, poller: ActivityPoller):
+        self.params_model = params_model
+        self.poller = poller
+        self.vendor_id = None
+        self.action = None
+
+    def __call__(self, message_in_event):
+        with metrics.span("validation"):
+            params = self.params_model.parse_obj(message_in_event.get("params") or {})
+        context = {"base_url": message_in_event.get("base_url"), "header": message_in_event.get("header")}
+        self.poller.untrack(params.untrack or [])
+        self.poller.track(params.ids or [], context)
+        transitions = self.poller.poll_once()
+        metrics.count(self.vendor_id, self.action, HTTPStatus.OK)
+        return {"status_code": HTTPStatus.OK, "message": f"{len(transitions)} activity transitions",
+                "data": {"transitions": transitions, "tracked": len(self.poller)}}
+
+    def stats(self) -> dict:
+        return self.poller.stats()
@@ -0,0 +1,79 @@
+import os
+import json_codec
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
+
+'''
+Batch path of the url sender.
+All the records of an SNS batch are parsed and their actions are run on a bounded thread pool.
+Each vendor gets its own semaphore so a burst of commands can not flood a single vendor api.
+'''
+
+BATCH_MAX_WORKERS = int(os.environ.get("BATCH_MAX_WORKERS", 8))
+VENDOR_CONCURRENCY_LIMIT = int(os.environ.get("VENDOR_CONCURRENCY_LIMIT", 4))
+
+_vendor_semaphores = {}
+_vendor_semaphores_lock = threading.Lock()
+
+
+def vendor_semaphore(vendor_id: str) -> threading.BoundedSemaphore:
+    key = str(vendor_id).lower()
+    with _vendor_semaphores_lock:
+        if key not in _vendor_semaphores:
+            _vendor_semaphores[key] = threading.BoundedSemaphore(VENDOR_CONCURRENCY_LIMIT)
+        return _vendor_semaphores[key]
+
+
+def parse_records(event) -> list:
+    """
+    Returns one entry per record as (record_id, message, error).
+    A record that can not be decoded carries the error instead of a message.
+    """
+    parsed_records = []
+    for index, record in enumerate(event["Records"]):
+        sns = record.get("Sns", {})
+        record_id = sns.get("MessageId", str(index))
+        try:
+            parsed_records.append((record_id, json_codec.loads(sns["Message"]), None))
+        except (KeyError, TypeError, ValueError) as error:
+            logging.exception(f"Could not parse record {record_id}")
+            parsed_records.append((record_id, None, error))
+    return parsed_records
+
+
+def _run_record(process, record_id, message):
+    try:
+        with vendor_semaphore(message.get("vendor_id")):
+            response = process(message)
+    except Exception as error:
+        logging.exception(f"Record {record_id} failed")
+        return {"record_id": record_id, "success": False, "error": repr(error), "response": None}
+    else:
+        failed = isinstance(response, dict) and response.get("status_code", HTTPStatus.OK) != HTTPStatus.OK
+        return {"record_id": record_id, "success": not failed, "error": None, "response": response}
+
+
+def process_batch(parsed_records, process, max_workers: int = None) -> dict:
+    """
+    Run process on every parsed record concurrently.
+    Results keep the order of the records, failures are also listed separately for partial retry.
+    """
+    max_workers = max_workers or BATCH_MAX_WORKERS
+    results = [None] * len(parsed_records)
+    futures = {}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for index, (record_id, message, error) in enumerate(parsed_records):
+            if error is not None:
+                results[index] = {"record_id": record_id, "success": False, "error": repr(error),
+                                  "response": None}
+            else:
+                futures[index] = executor.submit(_run_record, process, record_id, message)
+        for index, future in futures.items():
+            results[index] = future.result()
+
+    failed_records = [result["record_id"] for result in results if not result["success"]]
+    return {"status_code": HTTPStatus.OK if not failed_records else HTTPStatus.MULTI_STATUS,
+            "results": results,
+            "failed_records": failed_records}
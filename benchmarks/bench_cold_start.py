@@ -0,0 +1,96 @@
+import os
+import sys
+import json
+import statistics
+import subprocess
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from benchmarks.synthetic_data import synthetic_stations
+
+'''
+Cold start benchmark of the url sender.
+Every run is a fresh interpreter, it reports the import time of lambda_function (from -X importtime),
+the heaviest imports, and the time of the first and second invocation against a local stand in vendor.
+Run with: python -m benchmarks.bench_cold_start [runs]
+'''
+
+REPOSITORY_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+INVOCATION_SCRIPT = '''
+import json, sys, time
+start = time.perf_counter()
+import lambda_function
+init = time.perf_counter() - start
+event = json.loads(sys.argv[1])
+timings = []
+for _ in range(2):
+    start = time.perf_counter()
+    lambda_function.lambda_handler(event, {})
+    timings.append(time.perf_counter() - start)
+print(json.dumps({"init": init, "first": timings[0], "second": timings[1]}))
+'''
+
+
+class StationsHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # buffer headers and body into one write, separate small writes hit delayed ack on keep alive connections
+    wbufsize = 64 * 1024
+    body = json.dumps({"success": True, "message": "ok", "data": synthetic_stations(20)}).encode()
+
+    def do_GET(self):
+        self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(self.body)))
+        self.end_headers()
+        self.wfile.write(self.body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def import_times(environment) -> (int, list):
+    output = subprocess.run([sys.executable, "-X", "importtime", "-c", "import lambda_function"],
+                            cwd=REPOSITORY_ROOT, env=environment, capture_output=True, text=True).stderr
+    cumulative = {}
+    for line in output.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative_us, module = line[len("import time:"):].split("|")
+        if cumulative_us.strip().isdigit():
+            cumulative[module.strip()] = int(cumulative_us)
+    top_level = sorted(((us, module) for module, us in cumulative.items()), reverse=True)[:8]
+    return cumulative.get("lambda_function", 0), top_level
+
+
+def invocation_times(environment, event) -> dict:
+    output = subprocess.run([sys.executable, "-c", INVOCATION_SCRIPT, json.dumps(event)],
+                            cwd=REPOSITORY_ROOT, env=environment, capture_output=True, text=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def run(runs: int = 5):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StationsHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    event = {"vendor_id": "chargemod", "action": "location", "write": False,
+             "base_url": f"http://127.0.0.1:{server.server_address[1]}", "params": {"q": "BB"},
+             "header": {"Accept": "application/json", "key": "k", "Authorization": "Bearer t"}}
+    try:
+        for warm_up in ("false", "true"):
+            environment = dict(os.environ, WARM_UP_ON_INIT=warm_up)
+            imports = [import_times(environment) for _ in range(runs)]
+            invocations = [invocation_times(environment, event) for _ in range(runs)]
+            print(f"WARM_UP_ON_INIT={warm_up}")
+            print(f"  import lambda_function  {statistics.median(i[0] for i in imports) / 1000:8.1f} ms (importtime)")
+            for key in ("init", "first", "second"):
+                print(f"  {key:<22}  {statistics.median(i[key] for i in invocations) * 1000:8.1f} ms")
+        print("heaviest imports (cumulative, last run)")
+        for us, module in imports[-1][1]:
+            print(f"  {us / 1000:8.1f} ms  {module}")
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+if __name__ == '__main__':
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 5)
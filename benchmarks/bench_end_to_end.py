@@ -0,0 +1,104 @@
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import tracemalloc
+from benchmarks.fake_chargemod import FakeChargeModServer
+
+'''
+End to end throughput of lambda_handler against the offline ChargeMod and DB_API stand in.
+Every action is driven with SNS batches and reported as events/sec, p50/p95/p99 latency of a batch
+and peak traced memory of one batch.
+Run with: python -m benchmarks.bench_end_to_end [--stations 2000 --latency 0.02 --error-rate 0.01]
+'''
+
+HEADER = {"Accept": "application/json", "key": "chargeMod_bench", "Authorization": "Bearer bench"}
+
+
+def action_messages(base_url: str) -> dict:
+    return {
+        "start_charge": lambda i: {"vendor_id": "chargemod", "action": "start_charge", "write": False,
+                                   "base_url": base_url, "header": HEADER,
+                                   "params": {"station_id": 1, "reference_transaction_id": i, "user_id": 12,
+                                              "relay_switch_number": 1}},
+        "stop_charge": lambda i: {"vendor_id": "chargemod", "action": "stop_charge", "write": False,
+                                  "base_url": base_url, "header": HEADER,
+                                  "params": {"reference_transaction_id": i}},
+        "activities": lambda i: {"vendor_id": "chargemod", "action": "activities", "write": False,
+                                 "base_url": base_url, "header": HEADER, "params": {"id": i}},
+        "location": lambda i: {"vendor_id": "chargemod", "action": "location", "write": False,
+                               "base_url": base_url, "header": HEADER, "params": {"q": f"BB{i}"}},
+        "location_write": lambda i: {"vendor_id": "chargemod", "action": "location", "write": True,
+                                     "base_url": base_url, "header": HEADER, "params": {"q": "BB"}},
+    }
+
+
+def sns_batch(build_message, first: int, size: int) -> dict:
+    return {"Records": [{"Sns": {"MessageId": str(first + i), "Message": json.dumps(build_message(first + i))}}
+                        for i in range(size)]}
+
+
+def percentile(values, fraction: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+def run_action(lambda_handler, build_message, batches: int, batch_size: int) -> dict:
+    latencies = []
+    start = time.perf_counter()
+    for batch in range(batches):
+        event = sns_batch(build_message, batch * batch_size, batch_size)
+        batch_start = time.perf_counter()
+        lambda_handler(event, {})
+        latencies.append(time.perf_counter() - batch_start)
+    elapsed = time.perf_counter() - start
+
+    tracemalloc.start()
+    lambda_handler(sns_batch(build_message, batches * batch_size, batch_size), {})
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {"events_per_second": batches * batch_size / elapsed,
+            "p50": percentile(latencies, 0.50), "p95": percentile(latencies, 0.95),
+            "p99": percentile(latencies, 0.99), "peak_memory": peak}
+
+
+def run(stations: int = 200, chargers: int = 2, connectors: int = 2, latency: float = 0.0,
+        error_rate: float = 0.0, batches: int = 20, batch_size: int = 10, write_batches: int = 3):
+    with FakeChargeModServer(latency=latency, error_rate=error_rate, stations=stations, chargers=chargers,
+                             connectors_per_charger=connectors) as fake:
+        os.environ["DB_API"] = fake.db_api_url
+        from lambda_function import lambda_handler
+        print(f"{stations} stations x {chargers * connectors} pins, latency {latency * 1000:.0f} ms, "
+              f"error rate {error_rate:.0%}, batches of {batch_size}")
+        print(f"{'action':<16}{'events/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'peak MiB':>10}")
+        for action, build_message in action_messages(fake.base_url).items():
+            action_batches, action_batch_size = (write_batches, 1) if action == "location_write" \
+                else (batches, batch_size)
+            result = run_action(lambda_handler, build_message, action_batches, action_batch_size)
+            print(f"{action:<16}{result['events_per_second']:>10.1f}{result['p50'] * 1000:>10.1f}"
+                  f"{result['p95'] * 1000:>10.1f}{result['p99'] * 1000:>10.1f}"
+                  f"{result['peak_memory'] / 2 ** 20:>10.1f}")
+        print(f"vendor requests {fake.requests}, stations written {fake.written_stations}")
+
+
+def main(arguments):
+    parser = argparse.ArgumentParser(description="End to end benchmark of lambda_handler against a local ChargeMod")
+    parser.add_argument("--stations", type=int, default=200)
+    parser.add_argument("--chargers", type=int, default=2)
+    parser.add_argument("--connectors", type=int, default=2)
+    parser.add_argument("--latency", type=float, default=0.0, help="vendor latency in seconds")
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--batches", type=int, default=20)
+    parser.add_argument("--batch-size", type=int, default=10)
+    parser.add_argument("--write-batches", type=int, default=3)
+    options = parser.parse_args(arguments)
+    run(options.stations, options.chargers, options.connectors, options.latency, options.error_rate,
+        options.batches, options.batch_size, options.write_batches)
+
+
+if __name__ == '__main__':
+    # the per event info logs would dominate the measurement
+    logging.disable(logging.INFO)
+    main(sys.argv[1:])
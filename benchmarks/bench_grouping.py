@@ -0,0 +1,62 @@
+import timeit
+from lambda_function import group_chargemod_charging_pins, translate_status_to_text
+from benchmarks.synthetic_data import synthetic_charging_pins
+
+'''
+Micro benchmark of the charging pin grouping used by the location sync.
+Run with: python -m benchmarks.bench_grouping
+'''
+
+
+def legacy_grouping(chargers):
+    # the previous implementation, a scan of the parsed list for every repeated charger id
+    # plus a second walk over the pins for the expanded list
+    parsed_list_of_chargers = []
+    charger_id = set()
+    for charger_point in chargers:
+        if charger_point["id"] not in charger_id:
+            charger_id.add(charger_point["id"])
+            parsed_list_of_chargers.append({"charger_point_id": charger_point["id"],
+                                            "charger_point_type": charger_point["type"],
+                                            "power_capacity": charger_point["battery"],
+                                            "charger_point_status": translate_status_to_text(charger_point["status"]),
+                                            "connectors": [
+                                                {"connector_point_id": charger_point["pivot"]["charging_pin_id"],
+                                                 "relay_number": charger_point["pivot"]["relay_switch_number"],
+                                                 "status": translate_status_to_text(charger_point["pivot"]["status"]),
+                                                 "tariff": 125
+                                                 }]
+                                            })
+        else:
+            for charger in parsed_list_of_chargers:
+                if charger["charger_point_id"] == charger_point["id"]:
+                    charger["connectors"].append({"connector_point_id": charger_point["pivot"]["charging_pin_id"],
+                                                  "relay_number": charger_point["pivot"]["relay_switch_number"],
+                                                  "status": charger_point["pivot"]["status"],
+                                                  "tariff": 125
+                                                  })
+    expanded_list_of_chargers = []
+    for charger_point in chargers:
+        expanded_list_of_chargers.append({"charger_point_id": charger_point["id"],
+                                          "charger_point_type": charger_point["type"],
+                                          "power_capacity": charger_point["battery"],
+                                          "charger_point_status": translate_status_to_text(charger_point["status"]),
+                                          "connector_point_id": charger_point["pivot"]["charging_pin_id"],
+                                          "tariff": 125
+                                          })
+    return parsed_list_of_chargers, expanded_list_of_chargers
+
+
+def run(sizes=((10, 2), (500, 2), (2000, 2), (1000, 8))):
+    for chargers, connectors in sizes:
+        pins = synthetic_charging_pins(1, chargers, connectors)
+        assert legacy_grouping(pins) == group_chargemod_charging_pins(pins)
+        repeat = 5
+        legacy = min(timeit.repeat(lambda: legacy_grouping(pins), number=1, repeat=repeat))
+        single_pass = min(timeit.repeat(lambda: group_chargemod_charging_pins(pins), number=1, repeat=repeat))
+        print(f"{len(pins):>6} pins  legacy {legacy * 1000:9.2f} ms  single pass {single_pass * 1000:7.2f} ms  "
+              f"speedup {legacy / single_pass:6.1f}x")
+
+
+if __name__ == '__main__':
+    run()
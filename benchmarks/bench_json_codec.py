@@ -0,0 +1,46 @@
+import sys
+import json
+import timeit
+import json_codec
+from bulk_mapping import BulkStationMapper, serialize_station
+from benchmarks.synthetic_data import synthetic_stations
+
+'''
+Json work of a large location sync per codec backend: decoding the vendor response, serializing the
+mapped stations and building the DB_API body, against the old body with every station encoded twice.
+Run with: python -m benchmarks.bench_json_codec [stations]
+'''
+
+
+def best_of(function) -> float:
+    return min(timeit.repeat(function, number=1, repeat=3)) * 1000
+
+
+def run(count: int = 5000):
+    response_body = json.dumps({"success": True, "message": "Stations",
+                                "data": synthetic_stations(count, chargers=4, connectors_per_charger=2)}).encode()
+    mapped = list(BulkStationMapper().map_stations(json.loads(response_body)["data"]))
+    print(f"{count} stations, vendor response {len(response_body) / 1024 / 1024:.1f} MiB")
+    for backend in ("stdlib", "orjson"):
+        if json_codec.use(backend).name != backend:
+            print(f"{backend:7} not installed")
+            continue
+        serialized = [serialize_station(station) for station in mapped]
+        decode_time = best_of(lambda: json_codec.loads(response_body))
+        serialize_time = best_of(lambda: [serialize_station(station) for station in mapped])
+        double_encoded_time = best_of(lambda: json_codec.dumps_bytes(
+            {"write_vendor_data_to_location_table": True, "data_to_write": serialized}))
+        raw_time = best_of(lambda: json_codec.object_with_raw_array(
+            {"write_vendor_data_to_location_table": True}, "data_to_write", serialized))
+        double_encoded_bytes = len(json_codec.dumps_bytes({"write_vendor_data_to_location_table": True,
+                                                           "data_to_write": serialized}))
+        raw_bytes = len(json_codec.object_with_raw_array({"write_vendor_data_to_location_table": True},
+                                                         "data_to_write", serialized))
+        print(f"{backend:7} decode {decode_time:8.1f} ms  serialize {serialize_time:8.1f} ms  "
+              f"db body double encoded {double_encoded_time:7.1f} ms {double_encoded_bytes} bytes  "
+              f"objects {raw_time:7.1f} ms {raw_bytes} bytes")
+    json_codec.use(json_codec.JSON_CODEC)
+
+
+if __name__ == '__main__':
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 5000)
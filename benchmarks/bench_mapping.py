@@ -0,0 +1,39 @@
+import sys
+import copy
+import json
+import timeit
+from lambda_function import map_chargemod_to_electrolite_structure
+from bulk_mapping import BulkStationMapper, serialize_station, to_ndjson, to_columns
+from benchmarks.synthetic_data import synthetic_stations
+
+'''
+Station mapping of a full network sync, one model per station against the bulk mapper.
+Run with: python -m benchmarks.bench_mapping [stations]
+'''
+
+
+def run(count: int = 2000):
+    stations = synthetic_stations(count, chargers=4, connectors_per_charger=2)
+
+    def per_station_model():
+        return [map_chargemod_to_electrolite_structure(station).json() for station in copy.copy(stations)]
+
+    def bulk():
+        mapper = BulkStationMapper()
+        return [serialize_station(mapped) for mapped in mapper.map_stations(stations)]
+
+    assert per_station_model() == bulk()
+    model_time = min(timeit.repeat(per_station_model, number=1, repeat=3))
+    bulk_time = min(timeit.repeat(bulk, number=1, repeat=3))
+    print(f"{count} stations  model {model_time * 1000:8.1f} ms  bulk {bulk_time * 1000:8.1f} ms  "
+          f"speedup {model_time / bulk_time:4.1f}x")
+
+    mapped = list(BulkStationMapper().map_stations(stations))
+    list_bytes = len(json.dumps([json.loads(line) for line in to_ndjson(mapped)]))
+    ndjson_bytes = sum(len(line) for line in to_ndjson(mapped))
+    columns_bytes = len(serialize_station(to_columns(mapped)))
+    print(f"json list {list_bytes} bytes  ndjson {ndjson_bytes} bytes  columns {columns_bytes} bytes")
+
+
+if __name__ == '__main__':
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 2000)
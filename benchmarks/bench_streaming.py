@@ -0,0 +1,45 @@
+import os
+import sys
+import time
+import tracemalloc
+import requests
+import lambda_function
+from benchmarks.fake_chargemod import FakeChargeModServer
+
+'''
+Peak memory of a full location sync with the stations response streamed and parsed as a whole,
+for growing network sizes against the offline ChargeMod stand in.
+Run with: python -m benchmarks.bench_streaming [stations ...]
+'''
+
+
+def sync_peak(stations: int, streamed: bool) -> tuple:
+    lambda_function.STREAMED_VERBS = frozenset({"stations"} if streamed else ())
+    with FakeChargeModServer(stations=stations, chargers=4) as fake:
+        os.environ["DB_API"] = fake.db_api_url
+        # let the fake build and compress its response before measuring
+        body_bytes = len(requests.get(fake.base_url + "/stations", headers={"Accept-Encoding": "gzip"}).content)
+        tracemalloc.start()
+        start = time.perf_counter()
+        lambda_function.lambda_handler({"vendor_id": "chargemod", "action": "location", "write": True,
+                                        "base_url": fake.base_url, "params": {"q": f"bench-{stations}-{streamed}"},
+                                        "header": {"Accept": "application/json", "key": "k",
+                                                   "Authorization": "Bearer t"}}, {})
+        elapsed = time.perf_counter() - start
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return body_bytes, peak, elapsed
+
+
+def run(sizes=(500, 2000, 6000)):
+    streamed_verbs = lambda_function.STREAMED_VERBS
+    print(f"{'stations':>8} {'body MiB':>9} {'streamed peak MiB':>18} {'parsed peak MiB':>16}")
+    for stations in sizes:
+        body_bytes, streamed_peak, _ = sync_peak(stations, True)
+        _, parsed_peak, _ = sync_peak(stations, False)
+        print(f"{stations:8} {body_bytes / 2 ** 20:9.1f} {streamed_peak / 2 ** 20:18.1f} {parsed_peak / 2 ** 20:16.1f}")
+    lambda_function.STREAMED_VERBS = streamed_verbs
+
+
+if __name__ == '__main__':
+    run([int(size) for size in sys.argv[1:]] or (500, 2000, 6000))
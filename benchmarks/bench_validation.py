@@ -0,0 +1,44 @@
+import timeit
+import data_schemas
+from lambda_function import action_registry
+
+'''
+Per event validation cost of the hot actions, pydantic round trips against the compiled validators.
+Run with: python -m benchmarks.bench_validation
+'''
+
+HEADER = {"Accept": "application/json", "key": "chargeMod_key", "Authorization": "Bearer token"}
+EVENTS = {
+    "start_charge": {"base_url": "https://apitest.chargemod.com", "header": HEADER,
+                     "params": {"station_id": 113, "reference_transaction_id": 404112718119, "user_id": 12,
+                                "relay_switch_number": 111, "max_energy_consumption": 10}},
+    "stop_charge": {"base_url": "https://apitest.chargemod.com", "header": HEADER,
+                    "params": {"reference_transaction_id": 404112718119}},
+    "activities": {"base_url": "https://apitest.chargemod.com", "header": HEADER, "params": {"id": 1}},
+}
+
+
+def pydantic_round_trip(handler, event):
+    # what every action did before the compiled validators
+    dict(handler.params_model.parse_obj(event["params"]))
+    handler.url_model.parse_obj({"base_url": event["base_url"]})
+    dict(data_schemas.ChargeModHeader.parse_obj(event["header"]))
+
+
+def compiled(handler, event):
+    handler.validate_params(event["params"])
+    handler.url_model.construct(base_url=event["base_url"])
+    handler.validate_header(event["header"])
+
+
+def run(number: int = 20000):
+    for action, event in EVENTS.items():
+        handler = action_registry.get("chargemod", action)
+        before = min(timeit.repeat(lambda: pydantic_round_trip(handler, event), number=number, repeat=3)) / number
+        after = min(timeit.repeat(lambda: compiled(handler, event), number=number, repeat=3)) / number
+        print(f"{action:<14} pydantic {before * 1e6:7.2f} us  compiled {after * 1e6:7.2f} us  "
+              f"speedup {before / after:5.1f}x")
+
+
+if __name__ == '__main__':
+    run()
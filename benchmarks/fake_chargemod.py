@@ -0,0 +1,190 @@
+import re
+import gzip
+import json
+import time
+import random
+import threading
+from urllib.parse import urlsplit, parse_qs
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from benchmarks.synthetic_data import synthetic_stations
+
+'''
+Offline stand in for ChargeMod and DB_API.
+It answers the calls the url sender makes (stations, charging/start, charging/stop, charging/activities)
+and accepts DB_API writes, with configurable latency, error rate and payload size, so tests and
+benchmarks run repeatably without network access.
+'''
+
+ACTIVITY_PATH = re.compile(r"^/charging/activities/(?P<id>[^/]+)$")
+
+
+class FakeChargeModHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # headers and body in one write, separate small writes hit delayed ack on keep alive connections
+    wbufsize = 64 * 1024
+
+    def _read_body(self) -> bytes:
+        body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        if self.headers.get("Content-Encoding") == "gzip":
+            self.server.fake.record_compressed_request()
+            body = gzip.decompress(body)
+        return body
+
+    def _send(self, status: int, body: bytes, truncate: bool = False):
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        if self.server.fake.gzip_responses and "gzip" in self.headers.get("Accept-Encoding", ""):
+            body = self.server.fake.gzipped(body)
+            self.send_header("Content-Encoding", "gzip")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if truncate:
+            # the connection drops halfway through the announced body
+            self.wfile.write(body[:len(body) // 2])
+            self.wfile.flush()
+            self.close_connection = True
+            return
+        self.wfile.write(body)
+
+    def _handle(self, method: str):
+        fake = self.server.fake
+        request_body = self._read_body()
+        path = urlsplit(self.path).path
+        fake.record(method, ACTIVITY_PATH.sub("/charging/activities/{id}", path))
+        if fake.latency:
+            time.sleep(fake.latency)
+        if path == fake.db_path:
+            self._send(200, fake.db_write(request_body))
+        elif fake.should_fail():
+            self._send(503, json.dumps({"success": False, "message": "fake vendor error", "data": {}}).encode())
+        elif method == "GET" and path == "/stations":
+            self._send(200, fake.stations_page(request_body, self.path), truncate=fake.truncate_stations)
+        elif method == "POST" and path in ("/charging/start", "/charging/stop"):
+            self._send(200, fake.charging_response(path))
+        elif method == "GET" and ACTIVITY_PATH.match(path):
+            self._send(200, fake.activity_response(ACTIVITY_PATH.match(path).group("id")))
+        else:
+            self._send(404, json.dumps({"success": False, "message": "not found"}).encode())
+
+    def do_GET(self):
+        self._handle("GET")
+
+    def do_POST(self):
+        self._handle("POST")
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FakeChargeModServer:
+    def __init__(self, latency: float = 0.0, error_rate: float = 0.0, stations: int = 20, chargers: int = 2,
+                 connectors_per_charger: int = 2, page_size: int = None, seed: int = 0,
+                 gzip_responses: bool = True):
+        self.latency = latency
+        self.gzip_responses = gzip_responses
+        self.error_rate = error_rate
+        self.page_size = page_size
+        self.db_path = "/db"
+        self.stations = synthetic_stations(stations, chargers, connectors_per_charger)
+        self.requests = {}
+        self.written_stations = 0
+        self.db_writes = 0
+        self.last_written_station = None
+        self.compressed_requests = 0
+        self._gzipped = {}
+        # status reported by charging/activities per activity id, "charging" when not set
+        self.activity_statuses = {}
+        # cut the stations body off halfway while Content-Length still announces all of it
+        self.truncate_stations = False
+        self._pages = {}
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server = None
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self._server.server_address[1]}"
+
+    @property
+    def db_api_url(self) -> str:
+        return self.base_url + self.db_path
+
+    def start(self):
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), FakeChargeModHandler)
+        self._server.daemon_threads = True
+        self._server.fake = self
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def record(self, method: str, path: str):
+        key = f"{method} {path}"
+        with self._lock:
+            self.requests[key] = self.requests.get(key, 0) + 1
+
+    def record_compressed_request(self):
+        with self._lock:
+            self.compressed_requests += 1
+
+    def gzipped(self, body: bytes) -> bytes:
+        # station pages are the same bytes every time, compress them once
+        with self._lock:
+            compressed = self._gzipped.get(body)
+        if compressed is None:
+            compressed = gzip.compress(body, compresslevel=5, mtime=0)
+            if len(body) > 1024:
+                with self._lock:
+                    self._gzipped[body] = compressed
+        return compressed
+
+    def should_fail(self) -> bool:
+        if not self.error_rate:
+            return False
+        with self._lock:
+            return self._random.random() < self.error_rate
+
+    def stations_page(self, request_body: bytes, raw_path: str) -> bytes:
+        params = parse_qs(request_body.decode()) or parse_qs(urlsplit(raw_path).query)
+        page = int(params.get("page", ["1"])[0])
+        with self._lock:
+            body = self._pages.get(page)
+        if body is not None:
+            return body
+        if self.page_size:
+            last_page = max(1, -(-len(self.stations) // self.page_size))
+            start = (page - 1) * self.page_size
+            data = {"current_page": page, "last_page": last_page,
+                    "data": self.stations[start:start + self.page_size]}
+        else:
+            data = self.stations
+        body = json.dumps({"success": True, "message": "Stations", "data": data}).encode()
+        with self._lock:
+            self._pages[page] = body
+        return body
+
+    def charging_response(self, path: str) -> bytes:
+        return json.dumps({"success": True, "message": f"{path} accepted",
+                           "data": {"transaction_id": self._random.randint(1, 10 ** 9)}}).encode()
+
+    def activity_response(self, activity_id: str) -> bytes:
+        return json.dumps({"success": True, "message": "Activity",
+                           "data": {"id": activity_id, "status": self.activity_statuses.get(activity_id, "charging"),
+                                    "energy_consumed": 1.5}}).encode()
+
+    def db_write(self, request_body: bytes) -> bytes:
+        stations = json.loads(request_body or b"{}").get("data_to_write", [])
+        written = len(stations)
+        with self._lock:
+            self.last_written_station = stations[-1] if stations else self.last_written_station
+            self.db_writes += 1
+            self.written_stations += written
+        return json.dumps({"written": written}).encode()
@@ -0,0 +1,52 @@
+'''
+Synthetic ChargeMod payloads used by the benchmarks and the offline tests
+'''
+
+
+def synthetic_charging_pins(station_id: int, chargers: int, connectors_per_charger: int) -> list:
+    charging_pins = []
+    for charger in range(chargers):
+        for connector in range(connectors_per_charger):
+            charging_pins.append({
+                "id": charger,
+                "name": "BlackBox",
+                "battery": "240VAC, 15A",
+                "type": "AC",
+                "status": 1 if connector % 2 == 0 else 2,
+                "image": "pin.png",
+                "image_url": "https://testnet.chargemod.com//storage/charging-pins/pin.png",
+                "pivot": {
+                    "station_id": station_id,
+                    "charging_pin_id": charger * connectors_per_charger + connector,
+                    "id": charger * connectors_per_charger + connector,
+                    "available": 1,
+                    "status": 1 if connector % 2 == 0 else 2,
+                    "relay_switch_number": connector + 1,
+                    "step_size": "null"
+                }
+            })
+    return charging_pins
+
+
+def synthetic_station(station_id: int, chargers: int = 2, connectors_per_charger: int = 2) -> dict:
+    return {
+        "id": station_id,
+        "station_type_id": 1,
+        "name": f"Station {station_id}",
+        "street1": "chargemod",
+        "city": "Pune",
+        "state": "Maharashtra",
+        "country": "India",
+        "zip": "411014",
+        "latitude": 18.5 + (station_id % 1000) / 10000,
+        "longitude": 73.8 + (station_id % 997) / 10000,
+        "image": "https://testnet.chargemod.com//storage/stations/station.jpg",
+        "status": 1,
+        "device_status": "Healthy",
+        "qr_code": f"CM-S{station_id:05d}",
+        "charging_pins": synthetic_charging_pins(station_id, chargers, connectors_per_charger),
+    }
+
+
+def synthetic_stations(count: int, chargers: int = 2, connectors_per_charger: int = 2) -> list:
+    return [synthetic_station(station_id, chargers, connectors_per_charger) for station_id in range(1, count + 1)]
@@ -0,0 +1,140 @@
+import os
+import json_codec
+import logging
+from pydantic import AnyHttpUrl, parse_obj_as
+from pydantic.json import pydantic_encoder, decimal_encoder
+from pydantic.validators import str_validator, decimal_validator
+import data_schemas
+from data_structure import ChargeModDeviceStatus
+from station_mapping import group_chargemod_charging_pins, map_chargemod_to_electrolite_structure
+
+'''
+Bulk mapping of vendor stations for full network syncs.
+Stations are mapped straight to json ready dicts in the field order of ChargingStationStaticData,
+without building a model per station. Values shared across stations (status enum, station images)
+are validated once per distinct value. A station the fast path can not map exactly like the model
+goes through map_chargemod_to_electrolite_structure, so output and errors are the same.
+Mapped stations can be emitted as newline delimited json or as columns of fields.
+'''
+
+LOCATION_BULK_MAPPING = os.environ.get("LOCATION_BULK_MAPPING", "true").lower() == "true"
+
+STATION_FIELDS = tuple(data_schemas.ChargingStationStaticData.__fields__)
+_STATION_STATUSES = frozenset(status.value for status in ChargeModDeviceStatus)
+_UID_DEFAULT = data_schemas.ChargingStationStaticData.__fields__["uid"].default
+_RATING_DEFAULT = data_schemas.ChargingStationStaticData.__fields__["rating"].default
+
+
+def serialize_station(mapped_station: dict) -> str:
+    return json_codec.dumps(mapped_station, default=pydantic_encoder)
+
+
+def _optional_str(value):
+    return None if value is None else str_validator(value)
+
+
+class MappedStation:
+    """
+    Same interface as the model for location_sync: station_id and json()
+    """
+    __slots__ = ("station_id", "data")
+
+    def __init__(self, data: dict):
+        self.station_id = data["station_id"]
+        self.data = data
+
+    def json(self) -> str:
+        return serialize_station(self.data)
+
+
+class BulkStationMapper:
+    def __init__(self):
+        self._image_urls = {}
+        self.fast_path = 0
+        self.slow_path = 0
+
+    def _image(self, image):
+        if image is None:
+            return None
+        url = self._image_urls.get(image)
+        if url is None:
+            url = str(parse_obj_as(AnyHttpUrl, image))
+            self._image_urls[image] = url
+        return url
+
+    def _map_fast(self, station) -> dict:
+        total_charger_data, expanded_total_charger_data = group_chargemod_charging_pins(station["charging_pins"])
+        station_status = station["device_status"].lower()
+        if station_status not in _STATION_STATUSES:
+            raise ValueError(f"unknown device status {station_status}")
+        latitude = station["latitude"]
+        longitude = station["longitude"]
+        return {
+            "station_id": str_validator(station["id"]),
+            "vendor_id": "chargemod",
+            "name": str_validator(station["name"]),
+            "address_line": str_validator(station["street1"]),
+            "town": str_validator(station["city"]),
+            "state": str_validator(station["state"]),
+            "postal_code": str_validator(station["zip"]),
+            "latitude": decimal_encoder(decimal_validator(latitude)),
+            "longitude": decimal_encoder(decimal_validator(longitude)),
+            "country": str_validator(station["country"]),
+            "qr_code": _optional_str(station["qr_code"]),
+            "total_connectors_available": len(total_charger_data),
+            "station_status": station_status,
+            "station_time": {"start_time": "12:00 AM", "end_time": "11:59 PM"},
+            "distance_unit": None,
+            "is_ocpp": False,
+            "total_charger_data": total_charger_data,
+            "expanded_total_charger_data": expanded_total_charger_data,
+            "image": self._image(station["image"]),
+            "geo_address": [latitude, longitude],
+            "uid": _UID_DEFAULT,
+            "rating": dict(_RATING_DEFAULT),
+        }
+
+    def map_station(self, station) -> dict:
+        try:
+            mapped_station = self._map_fast(station)
+        except Exception:
+            # let the model produce the result, or raise the same error it always did
+            self.slow_path += 1
+            return json_codec.loads(map_chargemod_to_electrolite_structure(station).json())
+        self.fast_path += 1
+        return mapped_station
+
+    def __call__(self, station) -> MappedStation:
+        return MappedStation(self.map_station(station))
+
+    def map_stations(self, stations, failed: list = None):
+        """
+        Yields every mapped station, ids of stations that can not be mapped are added to failed
+        """
+        for station in stations:
+            try:
+                yield self.map_station(station)
+            except Exception:
+                logging.exception(f"Could not map station {station.get('id') if isinstance(station, dict) else station}")
+                if failed is not None:
+                    failed.append(station.get("id") if isinstance(station, dict) else None)
+
+
+def to_ndjson(mapped_stations):
+    for mapped_station in mapped_stations:
+        yield serialize_station(mapped_station) + "\n"
+
+
+def to_columns(mapped_stations) -> dict:
+    """
+    Column form of the mapped stations, every field name maps to the list of its values
+    """
+    columns = {field: [] for field in STATION_FIELDS}
+    appenders = [(field, columns[field].append) for field in STATION_FIELDS]
+    for mapped_station in mapped_stations:
+        for field, append in appenders:
+            append(mapped_station[field])
+    return columns
+
+
+station_mapper = BulkStationMapper()
@@ -0,0 +1,184 @@
+import os
+import time
+import uuid
+import threading
+from collections import deque, namedtuple
+import json_codec
+
+'''
+Queues the long running worker consumes commands from.
+A received message stays in flight until it is acked, a nack (or a worker that never acks) hands it out again.
+InMemoryCommandQueue is for tests, FileCommandQueue keeps one file per message in a directory for local runs,
+SqsCommandQueue is for production (boto3 is only imported when it is used).
+WORKER_QUEUE is "memory" (default), "file:<directory>" or "sqs:<queue url>".
+'''
+
+QueuedMessage = namedtuple("QueuedMessage", ("message_id", "body", "attempts"))
+
+
+class CommandQueue:
+    def send(self, body: str) -> str:
+        raise NotImplementedError
+
+    def receive(self, max_messages: int, wait_seconds: float) -> list:
+        """
+        Up to max_messages QueuedMessage, waits at most wait_seconds for the first one
+        """
+        raise NotImplementedError
+
+    def ack(self, message_id: str):
+        raise NotImplementedError
+
+    def nack(self, message_id: str):
+        raise NotImplementedError
+
+
+class InMemoryCommandQueue(CommandQueue):
+    def __init__(self):
+        self._pending = deque()
+        self._in_flight = {}
+        self._attempts = {}
+        self._condition = threading.Condition()
+
+    def __len__(self):
+        with self._condition:
+            return len(self._pending) + len(self._in_flight)
+
+    def send(self, body: str) -> str:
+        message_id = uuid.uuid4().hex
+        with self._condition:
+            self._pending.append((message_id, body))
+            self._condition.notify()
+        return message_id
+
+    def receive(self, max_messages: int, wait_seconds: float) -> list:
+        with self._condition:
+            if not self._pending:
+                self._condition.wait(wait_seconds)
+            messages = []
+            while self._pending and len(messages) < max_messages:
+                message_id, body = self._pending.popleft()
+                self._in_flight[message_id] = body
+                self._attempts[message_id] = self._attempts.get(message_id, 0) + 1
+                messages.append(QueuedMessage(message_id, body, self._attempts[message_id]))
+            return messages
+
+    def ack(self, message_id: str):
+        with self._condition:
+            self._in_flight.pop(message_id, None)
+            self._attempts.pop(message_id, None)
+
+    def nack(self, message_id: str):
+        with self._condition:
+            body = self._in_flight.pop(message_id, None)
+            if body is not None:
+                self._pending.append((message_id, body))
+                self._condition.notify()
+
+
+class FileCommandQueue(CommandQueue):
+    """
+    pending/ and in_flight/ directories, a rename moves a message between them so several workers can share one
+    queue directory. Messages left in flight by a stopped worker are handed out again by recover(), queue_from_env
+    does that at start unless WORKER_RECOVER_IN_FLIGHT is false (set it when workers share the directory).
+    """
+
+    def __init__(self, directory: str, poll_seconds: float = 0.05):
+        self.pending = os.path.join(directory, "pending")
+        self.in_flight = os.path.join(directory, "in_flight")
+        self.poll_seconds = poll_seconds
+        os.makedirs(self.pending, exist_ok=True)
+        os.makedirs(self.in_flight, exist_ok=True)
+
+    def send(self, body: str) -> str:
+        # names sort in send order
+        message_id = f"{time.time_ns():020d}-{uuid.uuid4().hex}"
+        temporary_path = os.path.join(self.pending, f".{message_id}")
+        with open(temporary_path, "w") as message_file:
+            message_file.write(json_codec.dumps({"body": body, "attempts": 0}))
+        os.replace(temporary_path, os.path.join(self.pending, message_id))
+        return message_id
+
+    def _claim(self, max_messages: int) -> list:
+        messages = []
+        for message_id in sorted(name for name in os.listdir(self.pending) if not name.startswith(".")):
+            if len(messages) >= max_messages:
+                break
+            path = os.path.join(self.in_flight, message_id)
+            try:
+                os.rename(os.path.join(self.pending, message_id), path)
+            except FileNotFoundError:
+                # another worker got it first
+                continue
+            with open(path) as message_file:
+                stored = json_codec.loads(message_file.read())
+            stored["attempts"] += 1
+            with open(path, "w") as message_file:
+                message_file.write(json_codec.dumps(stored))
+            messages.append(QueuedMessage(message_id, stored["body"], stored["attempts"]))
+        return messages
+
+    def receive(self, max_messages: int, wait_seconds: float) -> list:
+        deadline = time.monotonic() + wait_seconds
+        while True:
+            messages = self._claim(max_messages)
+            if messages or time.monotonic() >= deadline:
+                return messages
+            time.sleep(self.poll_seconds)
+
+    def ack(self, message_id: str):
+        try:
+            os.remove(os.path.join(self.in_flight, message_id))
+        except FileNotFoundError:
+            pass
+
+    def nack(self, message_id: str):
+        try:
+            os.rename(os.path.join(self.in_flight, message_id), os.path.join(self.pending, message_id))
+        except FileNotFoundError:
+            pass
+
+    def recover(self):
+        for message_id in os.listdir(self.in_flight):
+            self.nack(message_id)
+
+
+class SqsCommandQueue(CommandQueue):
+    """
+    Message ids are receipt handles. A nack makes the message visible again right away.
+    """
+
+    def __init__(self, queue_url: str):
+        import boto3
+        self.queue_url = queue_url
+        self.client = boto3.client("sqs")
+
+    def send(self, body: str) -> str:
+        return self.client.send_message(QueueUrl=self.queue_url, MessageBody=body)["MessageId"]
+
+    def receive(self, max_messages: int, wait_seconds: float) -> list:
+        response = self.client.receive_message(QueueUrl=self.queue_url, MaxNumberOfMessages=min(10, max_messages),
+                                               WaitTimeSeconds=min(20, int(wait_seconds)),
+                                               AttributeNames=["ApproximateReceiveCount"])
+        return [QueuedMessage(message["ReceiptHandle"], message["Body"],
+                              int(message["Attributes"]["ApproximateReceiveCount"]))
+                for message in response.get("Messages", [])]
+
+    def ack(self, message_id: str):
+        self.client.delete_message(QueueUrl=self.queue_url, ReceiptHandle=message_id)
+
+    def nack(self, message_id: str):
+        self.client.change_message_visibility(QueueUrl=self.queue_url, ReceiptHandle=message_id,
+                                              VisibilityTimeout=0)
+
+
+def queue_from_env(queue: str = None) -> CommandQueue:
+    queue = queue or os.environ.get("WORKER_QUEUE", "memory")
+    if queue.startswith("file:"):
+        file_queue = FileCommandQueue(queue[len("file:"):])
+        if os.environ.get("WORKER_RECOVER_IN_FLIGHT", "true").lower() == "true":
+            file_queue.recover()
+        return file_queue
+    if queue.startswith("sqs:"):
+        return SqsCommandQueue(queue[len("sqs:"):])
+    return InMemoryCommandQueue()
@@ -0,0 +1,140 @@
+import os
+import zlib
+import gzip
+import threading
+
+'''
+Compressed transport.
+Vendor calls ask for gzip/deflate and the body is decompressed here chunk by chunk while it is read,
+with a cap on the decoded size, instead of letting urllib3 hand over the whole body at once.
+DB_API bodies above DB_API_COMPRESSION_MIN_BYTES can be sent gzip encoded (DB_API_COMPRESSION=gzip).
+Wire and decoded bytes of both directions are counted per invocation so the savings show up in the metrics.
+'''
+
+VENDOR_ACCEPT_ENCODING = os.environ.get("VENDOR_ACCEPT_ENCODING", "gzip, deflate")
+HTTP_MAX_DECODED_BYTES = int(os.environ.get("HTTP_MAX_DECODED_BYTES", 256 * 1024 * 1024))
+HTTP_READ_CHUNK_BYTES = int(os.environ.get("HTTP_READ_CHUNK_BYTES", 64 * 1024))
+DB_API_COMPRESSION = os.environ.get("DB_API_COMPRESSION", "none").lower()
+DB_API_COMPRESSION_MIN_BYTES = int(os.environ.get("DB_API_COMPRESSION_MIN_BYTES", 8 * 1024))
+DB_API_COMPRESSION_LEVEL = int(os.environ.get("DB_API_COMPRESSION_LEVEL", 5))
+
+_metrics_lock = threading.Lock()
+_invocation_metrics = {"response_wire_bytes": 0, "response_bytes": 0, "request_wire_bytes": 0,
+                       "request_bytes": 0}
+
+
+class BodyTooLargeError(ValueError):
+    pass
+
+
+def reset_invocation_metrics():
+    with _metrics_lock:
+        for metric in _invocation_metrics:
+            _invocation_metrics[metric] = 0
+
+
+def get_invocation_metrics() -> dict:
+    with _metrics_lock:
+        result = dict(_invocation_metrics)
+    result["bytes_saved"] = result["response_bytes"] - result["response_wire_bytes"] + \
+        result["request_bytes"] - result["request_wire_bytes"]
+    return result
+
+
+def _record(direction: str, wire_bytes: int, decoded_bytes: int):
+    with _metrics_lock:
+        _invocation_metrics[f"{direction}_wire_bytes"] += wire_bytes
+        _invocation_metrics[f"{direction}_bytes"] += decoded_bytes
+
+
+class _Deflate:
+    """
+    Deflate is zlib wrapped in theory and raw deflate from some servers, decide on the first bytes
+    """
+
+    def __init__(self):
+        self._decompressor = None
+        self._buffered = b""
+
+    def decompress(self, data: bytes, max_length: int) -> bytes:
+        if self._decompressor is None:
+            self._buffered += data
+            if len(self._buffered) < 2:
+                return b""
+            data, self._buffered = self._buffered, b""
+            try:
+                self._decompressor = zlib.decompressobj()
+                return self._decompressor.decompress(data, max_length)
+            except zlib.error:
+                self._decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+        return self._decompressor.decompress(data, max_length)
+
+    @property
+    def unconsumed_tail(self) -> bytes:
+        return self._decompressor.unconsumed_tail if self._decompressor is not None else b""
+
+    def flush(self) -> bytes:
+        return self._decompressor.flush() if self._decompressor is not None else b""
+
+
+def _decompressor(content_encoding: str):
+    encoding = (content_encoding or "").strip().lower()
+    if encoding in ("gzip", "x-gzip"):
+        return zlib.decompressobj(16 + zlib.MAX_WBITS)
+    if encoding == "deflate":
+        return _Deflate()
+    return None
+
+
+def iter_body(response, max_bytes: int = None, chunk_bytes: int = None):
+    """
+    Yields the decoded body of a response sent with stream=True, chunk by chunk.
+    Raises BodyTooLargeError once more than max_bytes are decoded.
+    """
+    max_bytes = max_bytes or HTTP_MAX_DECODED_BYTES
+    chunk_bytes = chunk_bytes or HTTP_READ_CHUNK_BYTES
+    decompressor = _decompressor(response.headers.get("Content-Encoding"))
+    wire_bytes = 0
+    decoded_bytes = 0
+    try:
+        for data in response.raw.stream(chunk_bytes, decode_content=False):
+            wire_bytes += len(data)
+            while data:
+                if decompressor is not None:
+                    # bounded output per step, a small compressed chunk can expand a lot
+                    decoded = decompressor.decompress(data, chunk_bytes)
+                    data = decompressor.unconsumed_tail
+                else:
+                    decoded, data = data, b""
+                decoded_bytes += len(decoded)
+                if decoded_bytes > max_bytes:
+                    raise BodyTooLargeError(f"Response body is larger than {max_bytes} bytes")
+                if decoded:
+                    yield decoded
+        if decompressor is not None:
+            decoded = decompressor.flush()
+            decoded_bytes += len(decoded)
+            if decoded:
+                yield decoded
+    finally:
+        _record("response", wire_bytes, decoded_bytes)
+        response.close()
+
+
+def read_body(response, max_bytes: int = None) -> bytes:
+    return b"".join(iter_body(response, max_bytes))
+
+
+def compress_body(body: bytes, headers: dict = None, encoding: str = None, min_bytes: int = None):
+    """
+    Returns (body, headers), gzip encoded when the body is large enough and compression is on
+    """
+    encoding = (encoding or DB_API_COMPRESSION).lower()
+    min_bytes = DB_API_COMPRESSION_MIN_BYTES if min_bytes is None else min_bytes
+    headers = dict(headers or {})
+    decoded_bytes = len(body)
+    if encoding == "gzip" and decoded_bytes >= min_bytes:
+        body = gzip.compress(body, compresslevel=DB_API_COMPRESSION_LEVEL, mtime=0)
+        headers["Content-Encoding"] = "gzip"
+    _record("request", len(body), decoded_bytes)
+    return body, headers
@@ -0,0 +1,107 @@
+import os
+import logging
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from urllib.parse import urlsplit
+import compression
+
+'''
+Module scoped http sessions, one per base url (scheme + host).
+They live as long as the lambda container, so warm invocations reuse
+the already open TCP/TLS connections to the vendor and to the DB api.
+Pool size, keep alive and timeouts can be tuned with environment variables.
+'''
+
+POOL_CONNECTIONS = int(os.environ.get("HTTP_POOL_CONNECTIONS", 4))
+POOL_MAXSIZE = int(os.environ.get("HTTP_POOL_MAXSIZE", 10))
+KEEP_ALIVE = os.environ.get("HTTP_KEEP_ALIVE", "true").lower() == "true"
+CONNECT_TIMEOUT = float(os.environ.get("HTTP_CONNECT_TIMEOUT", 3.05))
+READ_TIMEOUT = float(os.environ.get("HTTP_READ_TIMEOUT", 27))
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+_metrics_lock = threading.Lock()
+_invocation_metrics = {"requests": 0, "new_connections": 0, "reused_connections": 0}
+
+
+def origin_of(url: str) -> str:
+    parts = urlsplit(url)
+    return f"{parts.scheme}://{parts.netloc}"
+
+
+def _build_session() -> requests.Session:
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=POOL_CONNECTIONS, pool_maxsize=POOL_MAXSIZE)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    session.headers["Accept-Encoding"] = compression.VENDOR_ACCEPT_ENCODING
+    if not KEEP_ALIVE:
+        session.headers["Connection"] = "close"
+    return session
+
+
+def get_session(base_url: str) -> requests.Session:
+    key = origin_of(base_url)
+    session = _sessions.get(key)
+    if session is None:
+        with _sessions_lock:
+            session = _sessions.get(key)
+            if session is None:
+                logging.info(f"Opening new http session for {key}")
+                session = _build_session()
+                _sessions[key] = session
+    return session
+
+
+def close_sessions():
+    with _sessions_lock:
+        for session in _sessions.values():
+            session.close()
+        _sessions.clear()
+
+
+def _opened_connections(session: requests.Session, url: str) -> int:
+    # urllib3 keys pools by host and tls context, so sum over every pool the adapter holds
+    pools = session.get_adapter(url).poolmanager.pools
+    total = 0
+    for key in pools.keys():
+        pool = pools.get(key)
+        if pool is not None:
+            total += pool.num_connections
+    return total
+
+
+def reset_invocation_metrics():
+    with _metrics_lock:
+        for metric in _invocation_metrics:
+            _invocation_metrics[metric] = 0
+
+
+def get_invocation_metrics() -> dict:
+    with _metrics_lock:
+        return dict(_invocation_metrics)
+
+
+def _record_connection_use(reused: bool):
+    with _metrics_lock:
+        _invocation_metrics["requests"] += 1
+        if reused:
+            _invocation_metrics["reused_connections"] += 1
+        else:
+            _invocation_metrics["new_connections"] += 1
+
+
+def send_request(method: str, url: str, timeout=None, **kwargs) -> requests.Response:
+    """
+    Send the request on the pooled session of the url origin.
+    A connection is counted as reused when the pool did not have to open a new one for this call.
+    """
+    session = get_session(url)
+    if timeout is None:
+        timeout = (CONNECT_TIMEOUT, READ_TIMEOUT)
+    connections_before = _opened_connections(session, url)
+    try:
+        return session.request(method=method, url=url, timeout=timeout, **kwargs)
+    finally:
+        _record_connection_use(reused=_opened_connections(session, url) == connections_before)
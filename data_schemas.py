@@ -2,6 +2,7 @@ from data_structure import ChargeModFixedData, ChargeModDeviceStatus
 from pydantic import BaseModel, AnyHttpUrl
 from typing import Optional, Dict, List
 from decimal import Decimal
+import json_codec
 
 
 class ChargeModLocationsUrls(BaseModel):
@@ -38,6 +39,7 @@ class ChargeModLocationsParams(BaseModel):
     state: Optional[str] = None
     device_status: Optional[ChargeModDeviceStatus] = None
     station_id: Optional[str] = None
+    page: Optional[int] = None
 
     class Config:
         use_enum_values = True
@@ -103,6 +105,23 @@ class ChargeModChargeActivityParams(BaseModel):
     id: Optional[str] = None
 
 
+class ChargeModPollActivitiesParams(BaseModel):
+    ids: Optional[List[str]] = None
+    untrack: Optional[List[str]] = None
+
+
+class NearbyStationsParams(BaseModel):
+    latitude: float
+    longitude: float
+    radius_km: Optional[float] = 5
+    k: Optional[int] = 10
+    station_status: Optional[ChargeModDeviceStatus] = None
+    available_only: Optional[bool] = False
+
+    class Config:
+        use_enum_values = True
+
+
 class ChargingStationStaticData(BaseModel):
     station_id: str
     vendor_id: str
@@ -135,6 +154,8 @@ class ChargingStationStaticData(BaseModel):
 
     class Config:
         use_enum_values = True
+        json_dumps = json_codec.dumps
+        json_loads = json_codec.loads
 
 
 
@@ -0,0 +1,70 @@
+from decimal import Decimal
+from pydantic import Extra
+
+'''
+Compiled validation of flat string schemas.
+Most params and headers are plain str fields, for those a validator is generated once at import
+that checks and coerces the fields without building a throwaway model instance.
+Anything it does not handle exactly like pydantic (missing required field, unexpected type,
+models with enums or custom validators) falls back to parse_obj, so errors stay identical.
+'''
+
+_DEFAULT_CONFIG_FIELDS = {"anystr_strip_whitespace": False, "anystr_lower": False,
+                          "min_anystr_length": 0, "max_anystr_length": None, "extra": Extra.ignore}
+
+
+def _is_flat_str_model(model) -> bool:
+    if model.__validators__ or model.__pre_root_validators__ or model.__post_root_validators__:
+        return False
+    for name, expected in _DEFAULT_CONFIG_FIELDS.items():
+        if getattr(model.__config__, name, expected) != expected:
+            return False
+    return all(field.outer_type_ is str and field.sub_fields is None for field in model.__fields__.values())
+
+
+class CompiledValidator:
+    def __init__(self, model):
+        self.model = model
+        self.compiled = _is_flat_str_model(model)
+        self.fields = tuple((name, field.alias, field.required, field.allow_none, field.default)
+                            for name, field in model.__fields__.items())
+
+    def slow_path(self, data) -> dict:
+        return dict(self.model.parse_obj(data))
+
+    def __call__(self, data) -> dict:
+        if not self.compiled or type(data) is not dict:
+            return self.slow_path(data)
+        validated = {}
+        for name, alias, required, allow_none, default in self.fields:
+            try:
+                value = data[alias]
+            except KeyError:
+                if required:
+                    return self.slow_path(data)
+                validated[name] = default
+                continue
+            value_type = type(value)
+            if value_type is str:
+                validated[name] = value
+            elif value_type in (int, float, bool, Decimal):
+                # pydantic coerces numbers to str the same way
+                validated[name] = str(value)
+            elif value is None and allow_none:
+                validated[name] = None
+            else:
+                return self.slow_path(data)
+        return validated
+
+
+def compile_validator(model) -> CompiledValidator:
+    return CompiledValidator(model)
+
+
+def construct_url_data(url_model, base_url):
+    """
+    The url models only hold constants next to base_url, build them without running validation
+    """
+    if type(base_url) is not str:
+        return url_model.parse_obj({"base_url": base_url})
+    return url_model.construct(base_url=base_url)
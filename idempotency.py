@@ -0,0 +1,250 @@
+import os
+import json_codec
+import time
+import logging
+import threading
+from collections import OrderedDict
+from http import HTTPStatus
+
+'''
+Idempotency of start_charge and stop_charge.
+SNS delivers at least once, so the same command can arrive several times. The first delivery claims its
+reference_transaction_id in a store and records the vendor result, redeliveries get that result back
+without calling the vendor, and concurrent duplicates wait for the first one to finish.
+Stores: in memory LRU (default), sqlite file for local runs and tests, DynamoDB for production.
+'''
+
+IDEMPOTENCY_ENABLED = os.environ.get("IDEMPOTENCY_ENABLED", "true").lower() == "true"
+IDEMPOTENCY_TTL_SECONDS = float(os.environ.get("IDEMPOTENCY_TTL_SECONDS", 24 * 60 * 60))
+IDEMPOTENCY_IN_PROGRESS_SECONDS = float(os.environ.get("IDEMPOTENCY_IN_PROGRESS_SECONDS", 60))
+IDEMPOTENCY_WAIT_SECONDS = float(os.environ.get("IDEMPOTENCY_WAIT_SECONDS", 10))
+IDEMPOTENCY_MAX_ENTRIES = int(os.environ.get("IDEMPOTENCY_MAX_ENTRIES", 10000))
+IDEMPOTENCY_POLL_SECONDS = 0.05
+
+IN_PROGRESS = "in_progress"
+COMPLETED = "completed"
+
+
+class IdempotencyStore:
+    """
+    Records are (status, result). Times are wall clock seconds so they can be shared between containers.
+    """
+
+    def claim(self, key: str, ttl: float) -> bool:
+        """
+        Mark key in progress, False when there is already a live record for it
+        """
+        raise NotImplementedError
+
+    def complete(self, key: str, result: dict, ttl: float):
+        raise NotImplementedError
+
+    def release(self, key: str):
+        raise NotImplementedError
+
+    def get(self, key: str):
+        """
+        Returns (status, result) or None
+        """
+        raise NotImplementedError
+
+
+class InMemoryIdempotencyStore(IdempotencyStore):
+    def __init__(self, max_entries: int = None):
+        self.max_entries = max_entries or IDEMPOTENCY_MAX_ENTRIES
+        self._records = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _live(self, key: str, now: float):
+        record = self._records.get(key)
+        if record is not None and record[2] <= now:
+            del self._records[key]
+            return None
+        return record
+
+    def claim(self, key: str, ttl: float) -> bool:
+        now = time.time()
+        with self._lock:
+            if self._live(key, now) is not None:
+                return False
+            self._records[key] = (IN_PROGRESS, None, now + ttl)
+            while len(self._records) > self.max_entries:
+                self._records.popitem(last=False)
+            return True
+
+    def complete(self, key: str, result: dict, ttl: float):
+        with self._lock:
+            self._records[key] = (COMPLETED, result, time.time() + ttl)
+            self._records.move_to_end(key)
+
+    def release(self, key: str):
+        with self._lock:
+            self._records.pop(key, None)
+
+    def get(self, key: str):
+        with self._lock:
+            record = self._live(key, time.time())
+            if record is None:
+                return None
+            self._records.move_to_end(key)
+            return record[0], record[1]
+
+
+class SqliteIdempotencyStore(IdempotencyStore):
+    def __init__(self, path: str):
+        # only loaded when this store is configured, the default memory store does not pay for it on cold start
+        import sqlite3
+        self._sqlite3 = sqlite3
+        self.path = path
+        self._local = threading.local()
+        with self._connection() as connection:
+            connection.execute("CREATE TABLE IF NOT EXISTS idempotency "
+                               "(key TEXT PRIMARY KEY, status TEXT, result TEXT, expires_at REAL)")
+
+    def _connection(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = self._sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            self._local.connection = connection
+        return connection
+
+    def claim(self, key: str, ttl: float) -> bool:
+        now = time.time()
+        connection = self._connection()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            connection.execute("DELETE FROM idempotency WHERE key = ? AND expires_at <= ?", (key, now))
+            cursor = connection.execute("INSERT OR IGNORE INTO idempotency VALUES (?, ?, NULL, ?)",
+                                        (key, IN_PROGRESS, now + ttl))
+            connection.execute("COMMIT")
+        except Exception:
+            connection.execute("ROLLBACK")
+            raise
+        return cursor.rowcount == 1
+
+    def complete(self, key: str, result: dict, ttl: float):
+        self._connection().execute("INSERT OR REPLACE INTO idempotency VALUES (?, ?, ?, ?)",
+                                   (key, COMPLETED, json_codec.dumps(result), time.time() + ttl))
+
+    def release(self, key: str):
+        self._connection().execute("DELETE FROM idempotency WHERE key = ?", (key,))
+
+    def get(self, key: str):
+        row = self._connection().execute("SELECT status, result FROM idempotency WHERE key = ? AND expires_at > ?",
+                                         (key, time.time())).fetchone()
+        if row is None:
+            return None
+        return row[0], json_codec.loads(row[1]) if row[1] is not None else None
+
+
+class DynamoDbIdempotencyStore(IdempotencyStore):
+    """
+    Table with a string partition key "key" and "expires_at" as its TTL attribute
+    """
+
+    def __init__(self, table_name: str):
+        # boto3 is only imported when this store is configured, it is heavy on cold start
+        import boto3
+        from botocore.exceptions import ClientError
+        self._client_error = ClientError
+        self.table = boto3.resource("dynamodb").Table(table_name)
+
+    def claim(self, key: str, ttl: float) -> bool:
+        now = int(time.time())
+        try:
+            self.table.put_item(Item={"key": key, "status": IN_PROGRESS, "expires_at": now + int(ttl)},
+                                ConditionExpression="attribute_not_exists(#key) OR expires_at <= :now",
+                                ExpressionAttributeNames={"#key": "key"},
+                                ExpressionAttributeValues={":now": now})
+        except self._client_error as error:
+            if error.response["Error"]["Code"] == "ConditionalCheckFailedException":
+                return False
+            raise
+        return True
+
+    def complete(self, key: str, result: dict, ttl: float):
+        self.table.put_item(Item={"key": key, "status": COMPLETED, "result": json_codec.dumps(result),
+                                  "expires_at": int(time.time() + ttl)})
+
+    def release(self, key: str):
+        self.table.delete_item(Key={"key": key})
+
+    def get(self, key: str):
+        item = self.table.get_item(Key={"key": key}, ConsistentRead=True).get("Item")
+        if item is None or int(item["expires_at"]) <= time.time():
+            return None
+        return item["status"], json_codec.loads(item["result"]) if item.get("result") else None
+
+
+def store_from_env() -> IdempotencyStore:
+    """
+    IDEMPOTENCY_STORE is "memory" (default), "sqlite:<path>" or "dynamodb:<table name>"
+    """
+    store = os.environ.get("IDEMPOTENCY_STORE", "memory")
+    if store.startswith("sqlite:"):
+        return SqliteIdempotencyStore(store[len("sqlite:"):])
+    if store.startswith("dynamodb:"):
+        return DynamoDbIdempotencyStore(store[len("dynamodb:"):])
+    return InMemoryIdempotencyStore()
+
+
+def _restore_status(result):
+    # stores keep json, hand back the HTTPStatus the handlers return
+    if isinstance(result, dict) and isinstance(result.get("status_code"), int):
+        result = dict(result, status_code=HTTPStatus(result["status_code"]))
+    return result
+
+
+class IdempotencyGuard:
+    def __init__(self, store: IdempotencyStore = None):
+        self._store = store
+        self.duplicates = 0
+        self.executed = 0
+        self._lock = threading.Lock()
+
+    @property
+    def store(self) -> IdempotencyStore:
+        if self._store is None:
+            self._store = store_from_env()
+        return self._store
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"executed": self.executed, "duplicates": self.duplicates}
+
+    def _duplicate(self, result):
+        with self._lock:
+            self.duplicates += 1
+        return _restore_status(result)
+
+    def run(self, key: str, function):
+        deadline = time.monotonic() + IDEMPOTENCY_WAIT_SECONDS
+        while not self.store.claim(key, IDEMPOTENCY_IN_PROGRESS_SECONDS):
+            record = self.store.get(key)
+            if record is not None and record[0] == COMPLETED:
+                logging.info(f"Duplicate of {key}, returning the recorded result")
+                return self._duplicate(record[1])
+            if time.monotonic() >= deadline:
+                logging.warning(f"Duplicate of {key} is still in progress")
+                return {"status_code": HTTPStatus.CONFLICT,
+                        "message": "Request with this reference_transaction_id is already in progress", "data": {}}
+            # the first delivery is still talking to the vendor, or released its claim after failing
+            time.sleep(IDEMPOTENCY_POLL_SECONDS)
+
+        with self._lock:
+            self.executed += 1
+        try:
+            result = function()
+        except Exception:
+            self.store.release(key)
+            raise
+        if isinstance(result, dict) and result.get("status_code") == HTTPStatus.OK:
+            self.store.complete(key, json_codec.loads(json_codec.dumps(result, default=str)),
+                                IDEMPOTENCY_TTL_SECONDS)
+        else:
+            # let a redelivery try again
+            self.store.release(key)
+        return result
+
+
+idempotency_guard = IdempotencyGuard()
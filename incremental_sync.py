@@ -0,0 +1,133 @@
+import os
+import json
+import logging
+import hashlib
+import threading
+from http import HTTPStatus
+from collections.abc import Mapping
+from streaming_json import StreamedArray, StreamingJsonError
+
+'''
+Incremental location sync.
+Vendor pages are followed when the response is paginated, and a content hash of every mapped
+station is kept per station_id so only new or changed stations are written to the location table.
+'''
+
+
+class PageFetchError(StreamingJsonError):
+    """
+    A later page could not be fetched, the stations are incomplete like a body that broke off
+    """
+
+
+def station_hash(serialized_station: str) -> str:
+    return hashlib.blake2b(serialized_station.encode(), digest_size=16).hexdigest()
+
+
+class StationHashStore:
+    """
+    Base of the hash stores, keeps the last written hash of every station
+    """
+
+    def get(self, station_id: str):
+        raise NotImplementedError
+
+    def put_many(self, hashes: dict):
+        raise NotImplementedError
+
+
+class InMemoryStationHashStore(StationHashStore):
+    def __init__(self):
+        self._hashes = {}
+        self._lock = threading.Lock()
+
+    def get(self, station_id: str):
+        return self._hashes.get(str(station_id))
+
+    def put_many(self, hashes: dict):
+        with self._lock:
+            self._hashes.update({str(station_id): digest for station_id, digest in hashes.items()})
+
+
+class FileStationHashStore(InMemoryStationHashStore):
+    """
+    Same as the in memory store, persisted in a json file. In lambda /tmp survives warm invocations.
+    """
+
+    def __init__(self, path: str):
+        super().__init__()
+        self.path = path
+        try:
+            with open(path) as hash_file:
+                self._hashes = json.load(hash_file)
+        except FileNotFoundError:
+            pass
+        except ValueError:
+            logging.exception(f"Station hash file {path} is corrupt, starting a full sync")
+
+    def put_many(self, hashes: dict):
+        super().put_many(hashes)
+        with self._lock:
+            temporary_path = f"{self.path}.tmp"
+            with open(temporary_path, "w") as hash_file:
+                json.dump(self._hashes, hash_file)
+            os.replace(temporary_path, self.path)
+
+
+def hash_store_from_env():
+    """
+    STATION_HASH_STORE is either "memory" or "file:<path>"
+    """
+    store = os.environ.get("STATION_HASH_STORE", "memory")
+    if store.startswith("file:"):
+        return FileStationHashStore(store[len("file:"):])
+    return InMemoryStationHashStore()
+
+
+station_hash_store = hash_store_from_env()
+
+
+def _is_paginated(data) -> bool:
+    return isinstance(data, Mapping) and isinstance(data.get("data"), (list, StreamedArray))
+
+
+def _next_page(data):
+    current_page = data.get("current_page")
+    last_page = data.get("last_page")
+    if current_page is not None and last_page is not None and current_page < last_page:
+        return current_page + 1
+    if current_page is not None and data.get("next_page_url"):
+        return current_page + 1
+    return None
+
+
+def split_page(data):
+    """
+    Returns the stations of a page and the number of the next page, None when this is the last page.
+    A paginated chargemod response nests the stations as data.data next to current_page and last_page.
+    """
+    if _is_paginated(data):
+        return data["data"], _next_page(data)
+    return data, None
+
+
+def iter_pages(first_page_data, fetch_page):
+    """
+    Yields the stations of every page, fetch_page(page) returns the handled vendor response of that page.
+    The next page is only looked up once the stations of a page are consumed, a streamed page has
+    last_page after its stations. Raises PageFetchError when a page cannot be fetched.
+    """
+    data = first_page_data
+    while True:
+        if not _is_paginated(data):
+            yield from data
+            return
+        yield from data["data"]
+        next_page = _next_page(data)
+        if next_page is None:
+            return
+        response = fetch_page(next_page)
+        if response["status_code"] != HTTPStatus.OK:
+            logging.error(f"Could not fetch page {next_page}: {response['message']}")
+            raise PageFetchError(f"Page {next_page} answered {response['status_code']}")
+        data = response["data"]
@@ -0,0 +1,96 @@
+import os
+import json
+import logging
+
+'''
+One JSON codec for every place json crosses a boundary: vendor responses, SNS messages, station
+serialization, DB_API bodies, stores and metrics.
+JSON_CODEC picks the backend: "auto" (default) uses orjson when it is installed and the standard library
+otherwise, "orjson" and "stdlib" force one. Values orjson can not encode go through the standard library,
+so both backends accept the same input.
+'''
+
+JSON_CODEC = os.environ.get("JSON_CODEC", "auto").lower()
+
+
+class StdlibBackend:
+    name = "stdlib"
+
+    @staticmethod
+    def loads(data):
+        return json.loads(data)
+
+    @staticmethod
+    def dumps(value, default=None) -> str:
+        return json.dumps(value, default=default)
+
+
+class OrjsonBackend:
+    name = "orjson"
+
+    def __init__(self):
+        import orjson
+        self._orjson = orjson
+        self._options = orjson.OPT_NON_STR_KEYS
+
+    def loads(self, data):
+        return self._orjson.loads(data)
+
+    def dumps(self, value, default=None) -> str:
+        try:
+            return self._orjson.dumps(value, default=default, option=self._options).decode()
+        except TypeError:
+            # integers over 64 bit, unsupported key types and the like
+            return json.dumps(value, default=default)
+
+
+def backend_from_name(name: str):
+    if name in ("auto", "orjson"):
+        try:
+            return OrjsonBackend()
+        except ImportError:
+            if name == "orjson":
+                logging.warning("JSON_CODEC is orjson but orjson is not installed, using the standard library")
+    return StdlibBackend()
+
+
+_backend = backend_from_name(JSON_CODEC)
+
+
+def use(name: str):
+    """
+    Switch the backend at runtime, used by the benchmarks
+    """
+    global _backend
+    _backend = backend_from_name(name)
+    return _backend
+
+
+def backend_name() -> str:
+    return _backend.name
+
+
+def loads(data):
+    """
+    Decode str or bytes, raises ValueError on invalid json
+    """
+    return _backend.loads(data)
+
+
+def dumps(value, default=None, **_) -> str:
+    # extra keyword arguments are accepted so it can be a pydantic json_dumps
+    return _backend.dumps(value, default)
+
+
+def dumps_bytes(value, default=None) -> bytes:
+    return _backend.dumps(value, default).encode()
+
+
+def object_with_raw_array(fields: dict, name: str, serialized_items) -> bytes:
+    """
+    Encodes fields plus a name: [...] array of already serialized json values,
+    so the items are embedded as they are instead of being encoded again
+    """
+    head = dumps(fields)[:-1]
+    separator = "," if fields else ""
+    return f'{head}{separator}{dumps(name)}:[{",".join(serialized_items)}]}}'.encode()
@@ -1,14 +1,23 @@
-import json
-import boto3
+import json_codec
 import logging
-import requests
-import string
-import secrets
 import os
-from botocore.exceptions import ClientError
-from boto3.dynamodb.conditions import Key, Attr, BeginsWith, Contains
+import requests
 import data_schemas
-from data_structure import ChargerStatus
+import connection_pool
+import batch_processor
+import location_sync
+import incremental_sync
+import bulk_mapping
+import metrics
+import resilience
+import compression
+import write_sinks
+import streaming_json
+import station_index
+import activity_poller
+from action_registry import ActionRegistry, ActionHandler
+from station_mapping import group_chargemod_charging_pins, parse_expanded_chargemod_total_chargers, \
+    parse_chargemod_total_chargers, translate_status_to_text, map_chargemod_to_electrolite_structure
 from urllib.parse import urljoin
 from http import HTTPStatus
 
@@ -22,106 +31,46 @@ It will return the response accordingly
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(message)s', datefmt='%d-%b-%y %H:%M:%S')
 
+# verbs whose responses are parsed while they arrive, their "data" array is handed on one station at a time
+STREAMED_VERBS = frozenset(verb.strip() for verb in os.environ.get("STREAMED_VERBS", "stations").split(",")
+                           if verb.strip())
+
 
 def third_party_caller(url_data, request_params, header, path: str):
     try:
-        final_url = urljoin(url_data.base_url, url_data.verb)
-        if path:
-            final_url = final_url + f"/{path}"
-        logging.info(f"final url is {final_url}")
-        logging.info(f"{request_params}")
-        logging.info(f"{header}")
-        response = requests.request(method=url_data.call_method, url=final_url,
-                                    data=request_params, headers=header, verify=False)
-        logging.info(f"Response after call is {response}")
-    except AttributeError:
+        with metrics.span("url_build"):
+            final_url = urljoin(url_data.base_url, url_data.verb)
+            if path:
+                final_url = final_url + f"/{path}"
+        metrics.log_payload("final url is %s params %s header %s", final_url, request_params,
+                            metrics.Redacted(header))
+        with metrics.span("vendor_round_trip"):
+            response = resilience.send_request(url_data.call_method, final_url,
+                                               timeout=resilience.timeout_for(url_data.verb),
+                                               data=request_params, headers=header, verify=False, stream=True)
+        logging.debug("Response after call is %s", response)
+    except resilience.CircuitOpenError:
+        logging.warning(f"Circuit open for {url_data.base_url}, not calling the vendor")
+        # same shape as a vendor refusal so the caller answers SERVICE_UNAVAILABLE
+        return {"success": False, "message": "Vendor unavailable", "data": {}}
+    except (AttributeError, requests.RequestException):
         logging.exception("error in sending request")
         return False
     else:
         try:
-            return response.json()
+            if str(url_data.verb) in STREAMED_VERBS:
+                # reads up to the first key only, the rest is parsed as the stations are mapped
+                with metrics.span("json_decode"):
+                    return streaming_json.StreamingJsonObject(compression.iter_body(response))
+            with metrics.span("vendor_round_trip"):
+                # decompressed while it is read, gzip and deflate are negotiated by the session
+                body = compression.read_body(response)
+            with metrics.span("json_decode"):
+                return json_codec.loads(body)
         except Exception:
+            logging.exception(f"Could not read the response of {final_url}")
             return False
 
-def parse_expanded_chargemod_total_chargers(chargers) -> []:
-    parsed_list_of_chargers = []
-    for charger_point in chargers:
-        parsed_list_of_chargers.append({"charger_point_id": charger_point["id"],
-                                        "charger_point_type": charger_point["type"],
-                                        "power_capacity": charger_point["battery"],
-                                        "charger_point_status": translate_status_to_text(charger_point["status"]),
-                                        "connector_point_id": charger_point["pivot"]["charging_pin_id"],
-                                        "tariff": 125
-                                        })
-
-    return parsed_list_of_chargers
-
-def parse_chargemod_total_chargers(chargers) -> []:
-    parsed_list_of_chargers = []
-    charger_id = set()
-    for charger_point in chargers:
-        if charger_point["id"] not in charger_id:
-            # first insert logic
-            charger_id.add(charger_point["id"])
-            parsed_list_of_chargers.append({"charger_point_id": charger_point["id"],
-                                            "charger_point_type": charger_point["type"],
-                                            "power_capacity": charger_point["battery"],
-                                            "charger_point_status": translate_status_to_text(charger_point["status"]),
-                                            "connectors": [
-                                                {"connector_point_id": charger_point["pivot"]["charging_pin_id"],
-                                                 "relay_number": charger_point["pivot"]["relay_switch_number"],
-                                                 "status": translate_status_to_text(charger_point["pivot"]["status"]),
-                                                 "tariff": 125
-                                                 }]
-                                            })
-        else:
-            # append logic if evse id already exist
-            for charger in parsed_list_of_chargers:
-                if charger["charger_point_id"] == charger_point["id"]:
-                    charger["connectors"].append({"connector_point_id": charger_point["pivot"]["charging_pin_id"],
-                                                  "relay_number": charger_point["pivot"]["relay_switch_number"],
-                                                  "status": charger_point["pivot"]["status"],
-                                                  "tariff": 125
-                                                  })
-    return parsed_list_of_chargers
-
-
-def translate_status_to_text(status):
-    if status == 1:
-        return ChargerStatus.CHARGER_AVAILABLE
-    else:
-        return ChargerStatus.CHARGER_BUSY
-
-def map_chargemod_to_electrolite_structure(station):
-    try:
-        parsed_total_chargemod_data = parse_chargemod_total_chargers(station["charging_pins"])
-        count_of_chargers = len(parsed_total_chargemod_data)
-
-        mapper = {
-            "station_id": station["id"],
-            "vendor_id": "chargemod",
-            "name": station["name"],
-            "address_line": station["street1"],
-            "town": station["city"],
-            "state": station["state"],
-            "postal_code": station["zip"],
-            "latitude": station["latitude"],
-            "longitude": station["longitude"],
-            "country": station["country"],
-            "qr_code": station["qr_code"],
-            "total_connectors_available": count_of_chargers,
-            "station_status": station["device_status"].lower(),
-            "station_time": {"start_time": "12:00 AM", "end_time": "11:59 PM"},
-            "geo_address": [station["latitude"], station["longitude"]],
-            "image": station["image"],
-            "total_charger_data": parsed_total_chargemod_data,
-            "expanded_total_charger_data": parse_expanded_chargemod_total_chargers(station["charging_pins"])
-        }
-    except KeyError:
-        raise
-    else:
-        return data_schemas.ChargingStationStaticData.parse_obj(mapper)
-
 
 def call_handle_chargemod_exception(url_data, request_params, header_data, path=None):
     response = third_party_caller(url_data, request_params, header_data, path)
@@ -149,64 +98,115 @@ def call_handle_chargemod_exception(url_data, request_params, header_data, path=
                         "data": response["data"]}
 
 
-def parse_sns_message_process(message_in_event):
-    logging.info(f"message in event is {message_in_event}")
-    requests_params = None
-    url_data = None
-    parsed_station_data = []
-    if message_in_event["vendor_id"].lower() == "chargemod" and message_in_event["action"].lower() == "location":
-        # Parse params with chargemod location pydantic class
-        request_params = dict(data_schemas.ChargeModLocationsParams.parse_obj(message_in_event["params"]))
-        url_data = data_schemas.ChargeModLocationsUrls.parse_obj({"base_url": message_in_event["base_url"]})
-        header_data = dict(data_schemas.ChargeModHeader.parse_obj(message_in_event["header"]))
-        logging.info(f"Got request params {request_params}")
-        logging.info(f"Got url dat {url_data}")
-        if url_data:
-            response = call_handle_chargemod_exception(url_data, request_params, header_data)
-            if response["status_code"] == HTTPStatus.OK and message_in_event["write"]:
-                # Renaming id to station id as this is more readable in db. it's a primary key
-                data_to_write = response["data"]
-                for station in data_to_write:
-                    # ----------- adding vendor sort key here ----------------------
-                    station["vendor_id"] = message_in_event["vendor_id"]
-                    parsed_station_data.append(map_chargemod_to_electrolite_structure(station).json())
-                requests.post(os.environ['DB_API'],
-                              json={"write_vendor_data_to_location_table": True,
-                                    "data_to_write": parsed_station_data})
-            elif response["status_code"] == HTTPStatus.OK:
-                return response
-            else:
-                return {"status_code": HTTPStatus.INTERNAL_SERVER_ERROR, "message": "Unknown Error",
-                        "data": {}}
-
-    elif message_in_event["vendor_id"].lower() == "chargemod" and message_in_event["action"].lower() == "start_charge":
-        request_params = dict(data_schemas.ChargeModStartChargeParams.parse_obj(message_in_event["params"]))
-        url_data = data_schemas.ChargeModStartChargeUrls.parse_obj({"base_url": message_in_event["base_url"]})
-        header_data = dict(data_schemas.ChargeModHeader.parse_obj(message_in_event["header"]))
-        return call_handle_chargemod_exception(url_data, request_params, header_data)
-
-    elif message_in_event["vendor_id"].lower() == "chargemod" and message_in_event["action"].lower() == "stop_charge":
-        request_params = dict(data_schemas.ChargeModStopChargeParams.parse_obj(message_in_event["params"]))
-        url_data = data_schemas.ChargeModStopChargeUrls.parse_obj({"base_url": message_in_event["base_url"]})
-        header_data = dict(data_schemas.ChargeModHeader.parse_obj(message_in_event["header"]))
-        return call_handle_chargemod_exception(url_data, request_params, header_data)
-
-    elif message_in_event["vendor_id"].lower() == "chargemod" and message_in_event["action"].lower() == "activities":
-        path = dict(data_schemas.ChargeModChargeActivityParams.parse_obj(message_in_event["params"]))["id"]
-        url_data = data_schemas.ChargeModChargingActivityUrls.parse_obj({"base_url": message_in_event["base_url"]})
-        header_data = dict(data_schemas.ChargeModHeader.parse_obj(message_in_event["header"]))
-        return call_handle_chargemod_exception(url_data, request_params=None, header_data=header_data, path=path)
+def post_process_location(message_in_event, response):
+    if response["status_code"] == HTTPStatus.OK and message_in_event["write"]:
+        # Renaming id to station id as this is more readable in db. it's a primary key
+        hash_store = incremental_sync.station_hash_store if message_in_event.get("incremental") else None
+        mapper = bulk_mapping.station_mapper if bulk_mapping.LOCATION_BULK_MAPPING \
+            else map_chargemod_to_electrolite_structure
+        index = station_index.station_index if station_index.STATION_INDEX_ENABLED else None
+        result = location_sync.sync_stations(response["data"], message_in_event["vendor_id"], mapper,
+                                             writer=write_sinks.location_sink, hash_store=hash_store,
+                                             station_index=index)
+        if index is not None:
+            station_index.save_snapshot()
+        return result
+    elif response["status_code"] == HTTPStatus.OK:
+        try:
+            response["data"] = list(response["data"])
+        except streaming_json.StreamingJsonError:
+            logging.exception("Station response broke off")
+            return {"status_code": HTTPStatus.BAD_GATEWAY, "message": "Incomplete response from station",
+                    "data": {}}
+        return response
     else:
-        logging.warning(f"There is no match for this event. Here is the event dump {message_in_event}")
+        return {"status_code": HTTPStatus.INTERNAL_SERVER_ERROR, "message": "Unknown Error",
+                "data": {}}
+
+
+action_registry = ActionRegistry()
+action_registry.register("chargemod", "location",
+                         ActionHandler(data_schemas.ChargeModLocationsParams, data_schemas.ChargeModLocationsUrls,
+                                       data_schemas.ChargeModHeader, call_handle_chargemod_exception,
+                                       post_processor=post_process_location, page_param="page"))
+action_registry.register("chargemod", "start_charge",
+                         ActionHandler(data_schemas.ChargeModStartChargeParams, data_schemas.ChargeModStartChargeUrls,
+                                       data_schemas.ChargeModHeader, call_handle_chargemod_exception,
+                                       idempotency_param="reference_transaction_id"))
+action_registry.register("chargemod", "stop_charge",
+                         ActionHandler(data_schemas.ChargeModStopChargeParams, data_schemas.ChargeModStopChargeUrls,
+                                       data_schemas.ChargeModHeader, call_handle_chargemod_exception,
+                                       idempotency_param="reference_transaction_id"))
+action_registry.register("chargemod", "activities",
+                         ActionHandler(data_schemas.ChargeModChargeActivityParams,
+                                       data_schemas.ChargeModChargingActivityUrls,
+                                       data_schemas.ChargeModHeader, call_handle_chargemod_exception,
+                                       path_param="id"))
+
+
+def fetch_chargemod_activity(session_id, context):
+    # through the activities handler, so retries, circuit breaker and single flight apply
+    return action_registry.dispatch({"vendor_id": "chargemod", "action": "activities", "write": False,
+                                     "cache": False, "base_url": context["base_url"], "header": context["header"],
+                                     "params": {"id": session_id}})
+
+
+action_registry.register("chargemod", "poll_activities",
+                         activity_poller.PollActivitiesHandler(data_schemas.ChargeModPollActivitiesParams,
+                                                               activity_poller.ActivityPoller(
+                                                                   fetch_chargemod_activity)))
+action_registry.register("chargemod", "nearby",
+                         station_index.NearbyStationsHandler(data_schemas.NearbyStationsParams))
+
+
+WARM_UP_ON_INIT = os.environ.get("WARM_UP_ON_INIT", "true").lower() == "true"
+WARM_UP_STATION = {"id": 0, "name": "warm up", "street1": "", "city": "", "state": "", "zip": "",
+                   "latitude": 0.0, "longitude": 0.0, "country": "", "qr_code": None,
+                   "device_status": "Healthy", "image": "https://warm.up/station.jpg", "vendor_id": "chargemod",
+                   "charging_pins": [{"id": 0, "type": "AC", "battery": "", "status": 1,
+                                      "pivot": {"charging_pin_id": 0, "relay_switch_number": 1, "status": 1}}]}
+
+
+def warm_up():
+    """
+    Runs every schema once during init so lazily built validators (url regex, decimal and enum coercion)
+    are ready before the first invocation instead of adding to its latency.
+    """
+    map_chargemod_to_electrolite_structure(dict(WARM_UP_STATION)).json()
+    data_schemas.ChargeModHeader.parse_obj({"Accept": "", "key": "", "Authorization": ""})
+    data_schemas.ChargeModLocationsParams.parse_obj({"q": "", "device_status": "healthy"})
+    data_schemas.ChargeModStartChargeParams.parse_obj({"station_id": 0, "reference_transaction_id": 0,
+                                                       "user_id": 0, "relay_switch_number": 0})
+    data_schemas.ChargeModStopChargeParams.parse_obj({"reference_transaction_id": 0})
+    data_schemas.ChargeModChargeActivityParams.parse_obj({"id": 0})
+
+
+if WARM_UP_ON_INIT:
+    warm_up()
+
+
+def parse_sns_message_process(message_in_event):
+    metrics.log_payload("message in event is %s", metrics.Redacted(message_in_event))
+    return action_registry.dispatch(message_in_event)
 
 
 def lambda_handler(event, context):
-    logging.info(f"here is the event {event}")
+    metrics.log_payload("here is the event %s", metrics.Redacted(event))
+    connection_pool.reset_invocation_metrics()
+    compression.reset_invocation_metrics()
+    metrics.reset()
     try:
-        event["vendor_id"]
-    except KeyError:
-        message_in_event = json.loads(event['Records'][0]['Sns']['Message'])
-    else:
-        message_in_event = event
+        try:
+            event["vendor_id"]
+        except KeyError:
+            if len(event['Records']) > 1:
+                # more than one record in the sns batch, run all of them concurrently
+                return batch_processor.process_batch(batch_processor.parse_records(event),
+                                                     parse_sns_message_process)
+            message_in_event = json_codec.loads(event['Records'][0]['Sns']['Message'])
+        else:
+            message_in_event = event
 
-    return parse_sns_message_process(message_in_event)
+        return parse_sns_message_process(message_in_event)
+    finally:
+        metrics.flush({**connection_pool.get_invocation_metrics(), **compression.get_invocation_metrics()})
@@ -0,0 +1,165 @@
+import os
+import logging
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from http import HTTPStatus
+import connection_pool
+import metrics
+import json_codec
+import compression
+from streaming_json import StreamingJsonError
+from incremental_sync import station_hash
+from station_index import index_record
+
+'''
+Streaming write of vendor stations to the location table.
+Stations are mapped one at a time and flushed to DB_API in chunks bounded by count and size,
+so a full network sync never holds every mapped station in memory and one bad station
+only drops itself instead of the whole write.
+'''
+
+LOCATION_WRITE_CHUNK_SIZE = int(os.environ.get("LOCATION_WRITE_CHUNK_SIZE", 100))
+LOCATION_WRITE_CHUNK_BYTES = int(os.environ.get("LOCATION_WRITE_CHUNK_BYTES", 4 * 1024 * 1024))
+LOCATION_WRITE_PARALLEL_CHUNKS = int(os.environ.get("LOCATION_WRITE_PARALLEL_CHUNKS", 1))
+
+
+class SyncReport:
+    def __init__(self):
+        self.written = 0
+        self.unchanged = 0
+        self.failed = 0
+        self.chunks = 0
+        self.failed_chunks = 0
+
+    def as_dict(self) -> dict:
+        return {"written": self.written, "unchanged": self.unchanged, "failed": self.failed,
+                "chunks": self.chunks, "failed_chunks": self.failed_chunks}
+
+
+def iter_mapped_stations(stations, vendor_id: str, mapper, report: SyncReport, hash_store=None,
+                         station_index=None):
+    """
+    Yields (station_id, serialized station, content hash, index record) for every station.
+    Stations that fail mapping are logged and counted, with a hash store unchanged stations are skipped.
+    The index record is only built when there is a station index to update.
+    """
+    for station in stations:
+        try:
+            # ----------- adding vendor sort key here ----------------------
+            station["vendor_id"] = vendor_id
+            with metrics.span("mapping"):
+                mapped_station = mapper(station)
+                serialized_station = mapped_station.json()
+        except Exception:
+            logging.exception(f"Could not map station {station.get('id') if isinstance(station, dict) else station}")
+            report.failed += 1
+            continue
+        digest = station_hash(serialized_station) if hash_store is not None else None
+        record = index_record(mapped_station) if station_index is not None else None
+        if digest is not None and hash_store.get(mapped_station.station_id) == digest:
+            report.unchanged += 1
+            if record is not None:
+                # the db already has it, a fresh container still needs it in its index
+                station_index.upsert(record)
+            continue
+        yield mapped_station.station_id, serialized_station, digest, record
+
+
+def chunk_stations(mapped_stations, max_count: int = None, max_bytes: int = None):
+    max_count = max_count or LOCATION_WRITE_CHUNK_SIZE
+    max_bytes = max_bytes or LOCATION_WRITE_CHUNK_BYTES
+    chunk = []
+    chunk_bytes = 0
+    for mapped_station in mapped_stations:
+        station_bytes = len(mapped_station[1])
+        if chunk and (len(chunk) >= max_count or chunk_bytes + station_bytes > max_bytes):
+            yield chunk
+            chunk = []
+            chunk_bytes = 0
+        chunk.append(mapped_station)
+        chunk_bytes += station_bytes
+    if chunk:
+        yield chunk
+
+
+def post_chunk_to_db_api(chunk) -> bool:
+    """
+    Posts serialized stations, they are embedded in the body as json objects without being encoded again
+    """
+    try:
+        body = json_codec.object_with_raw_array({"write_vendor_data_to_location_table": True}, "data_to_write",
+                                                chunk)
+        body, headers = compression.compress_body(body, {"Content-Type": "application/json"})
+        response = connection_pool.send_request("POST", os.environ['DB_API'], data=body, headers=headers)
+    except Exception:
+        logging.exception(f"Could not write chunk of {len(chunk)} stations")
+        return False
+    if not response.ok:
+        logging.error(f"DB api refused chunk of {len(chunk)} stations with {response.status_code}")
+    return response.ok
+
+
+def _record_chunk(report: SyncReport, written: bool, size: int):
+    report.chunks += 1
+    if written:
+        report.written += size
+    else:
+        report.failed += size
+        report.failed_chunks += 1
+
+
+def write_chunks(chunks, report: SyncReport, writer=post_chunk_to_db_api, parallel_chunks: int = None,
+                 hash_store=None, station_index=None):
+    parallel_chunks = parallel_chunks or LOCATION_WRITE_PARALLEL_CHUNKS
+
+    def write(chunk):
+        with metrics.span("db_write"):
+            written = writer([serialized_station for _, serialized_station, _, _ in chunk])
+        # only remember hashes and index stations the db actually has
+        if written and hash_store is not None:
+            hash_store.put_many({station_id: digest for station_id, _, digest, _ in chunk})
+        if written and station_index is not None:
+            for _, _, _, record in chunk:
+                station_index.upsert(record)
+        return written, len(chunk)
+
+    if parallel_chunks <= 1:
+        for chunk in chunks:
+            _record_chunk(report, *write(chunk))
+        return report
+
+    with ThreadPoolExecutor(max_workers=parallel_chunks) as executor:
+        pending = set()
+        for chunk in chunks:
+            # keep at most parallel_chunks chunks in memory at once
+            if len(pending) >= parallel_chunks:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    _record_chunk(report, *future.result())
+            pending.add(executor.submit(write, chunk))
+        for future in pending:
+            _record_chunk(report, *future.result())
+    return report
+
+
+def sync_stations(stations, vendor_id: str, mapper, writer=post_chunk_to_db_api,
+                  max_count: int = None, max_bytes: int = None, parallel_chunks: int = None,
+                  hash_store=None, station_index=None) -> dict:
+    """
+    Map and write stations, with a hash store only new or changed stations are written.
+    Written stations are added to station_index when one is given.
+    """
+    report = SyncReport()
+    chunks = chunk_stations(iter_mapped_stations(stations, vendor_id, mapper, report, hash_store, station_index),
+                            max_count, max_bytes)
+    try:
+        write_chunks(chunks, report, writer, parallel_chunks, hash_store, station_index)
+    except StreamingJsonError:
+        # the stations streamed so far are written, the rest of the network is not known
+        logging.exception(f"Station response broke off, partial sync report {report.as_dict()}")
+        return {"status_code": HTTPStatus.BAD_GATEWAY,
+                "message": f"Incomplete response from station after writing {report.written} stations",
+                "data": report.as_dict()}
+    logging.info(f"Location sync report {report.as_dict()}")
+    return {"status_code": HTTPStatus.OK if not report.failed else HTTPStatus.MULTI_STATUS,
+            "message": f"Wrote {report.written} stations, {report.unchanged} unchanged, {report.failed} failed",
+            "data": report.as_dict()}
@@ -0,0 +1,139 @@
+import os
+import sys
+import json_codec
+import time
+import random
+import logging
+import threading
+from contextlib import contextmanager
+
+'''
+Cheap per invocation instrumentation.
+Timing spans are summed per stage (validation, url_build, vendor_round_trip, json_decode, mapping, db_write),
+requests are counted per vendor, action and status code, and at the end of an invocation everything is
+written as one CloudWatch embedded metric format (EMF) record on stdout.
+Payload logs are formatted lazily and only a sample of them is written at INFO.
+'''
+
+METRICS_ENABLED = os.environ.get("METRICS_ENABLED", "true").lower() == "true"
+METRICS_NAMESPACE = os.environ.get("METRICS_NAMESPACE", "ElectroUrlSender")
+LOG_SAMPLE_RATE = float(os.environ.get("LOG_SAMPLE_RATE", 0.01))
+REDACTED_HEADERS = ("authorization", "key")
+
+_lock = threading.Lock()
+_spans = {}
+_counters = {}
+
+
+def reset():
+    with _lock:
+        _spans.clear()
+        _counters.clear()
+
+
+def add_span(stage: str, elapsed: float):
+    with _lock:
+        total, count = _spans.get(stage, (0.0, 0))
+        _spans[stage] = (total + elapsed, count + 1)
+
+
+@contextmanager
+def span(stage: str):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        add_span(stage, time.perf_counter() - start)
+
+
+def count(vendor_id, action, status_code):
+    key = (str(vendor_id).lower(), str(action).lower(), int(status_code) if status_code is not None else 0)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + 1
+
+
+def snapshot() -> dict:
+    with _lock:
+        return {"spans": {stage: {"ms": total * 1000, "count": calls} for stage, (total, calls) in _spans.items()},
+                "counters": dict(_counters)}
+
+
+def _unit(name: str, spans: dict) -> str:
+    if name in spans:
+        return "Milliseconds"
+    return "Bytes" if name.endswith("bytes") or name == "bytes_saved" else "Count"
+
+
+def emf_records(extra_metrics: dict = None) -> list:
+    """
+    One record with the stage timings and extra metrics, and one per vendor/action/status counter
+    """
+    state = snapshot()
+    timestamp = int(time.time() * 1000)
+    stage_record = {stage: round(values["ms"], 3) for stage, values in state["spans"].items()}
+    stage_record.update(extra_metrics or {})
+    records = [{
+        "_aws": {"Timestamp": timestamp, "CloudWatchMetrics": [{
+            "Namespace": METRICS_NAMESPACE, "Dimensions": [[]],
+            "Metrics": [{"Name": name, "Unit": _unit(name, state["spans"])} for name in stage_record]}]},
+        **stage_record}]
+    for (vendor_id, action, status_code), calls in state["counters"].items():
+        records.append({
+            "_aws": {"Timestamp": timestamp, "CloudWatchMetrics": [{
+                "Namespace": METRICS_NAMESPACE, "Dimensions": [["vendor_id", "action", "status_code"]],
+                "Metrics": [{"Name": "requests", "Unit": "Count"}]}]},
+            "vendor_id": vendor_id, "action": action, "status_code": str(status_code), "requests": calls})
+    return records
+
+
+def flush(extra_metrics: dict = None, stream=None):
+    if not METRICS_ENABLED:
+        return
+    stream = stream or sys.stdout
+    for record in emf_records(extra_metrics):
+        stream.write(json_codec.dumps(record) + "\n")
+    stream.flush()
+
+
+def sampled() -> bool:
+    return LOG_SAMPLE_RATE >= 1 or (LOG_SAMPLE_RATE > 0 and random.random() < LOG_SAMPLE_RATE)
+
+
+def log_payload(message: str, *args):
+    """
+    Full payloads go to DEBUG, and to INFO for a sample of the calls.
+    Arguments are only formatted when the record is actually emitted.
+    """
+    if logging.getLogger().isEnabledFor(logging.INFO) and sampled():
+        logging.info(message, *args)
+    else:
+        logging.debug(message, *args)
+
+
+def redact(value):
+    if isinstance(value, dict):
+        return {name: "***" if str(name).lower() in REDACTED_HEADERS else redact(item)
+                for name, item in value.items()}
+    if isinstance(value, list):
+        return [redact(item) for item in value]
+    if isinstance(value, str) and value[:1] in ("{", "["):
+        # sns records carry the command as a json string
+        try:
+            decoded = json_codec.loads(value)
+        except ValueError:
+            return value
+        return json_codec.dumps(redact(decoded), default=str)
+    return value
+
+
+class Redacted:
+    """
+    Lazily formatted payload with the credentials (Authorization, key) masked at any depth
+    """
+    __slots__ = ("payload",)
+
+    def __init__(self, payload):
+        self.payload = payload
+
+    def __str__(self):
+        return str(redact(self.payload))
@@ -0,0 +1,139 @@
+import os
+import time
+import random
+import logging
+import threading
+import requests
+import connection_pool
+
+'''
+Timeouts, retries and circuit breaking for vendor calls.
+Every verb has its own connect/read timeout. Idempotent GET calls are retried on connection errors,
+timeouts and 5xx/429 answers with jittered exponential backoff inside a total time budget.
+Each base url has a circuit breaker, once it is open calls fail fast until the vendor gets a trial call through.
+'''
+
+ACTION_READ_TIMEOUTS = {
+    "stations": float(os.environ.get("HTTP_READ_TIMEOUT_LOCATION", 27)),
+    "charging/start": float(os.environ.get("HTTP_READ_TIMEOUT_START_CHARGE", 10)),
+    "charging/stop": float(os.environ.get("HTTP_READ_TIMEOUT_STOP_CHARGE", 10)),
+    "charging/activities": float(os.environ.get("HTTP_READ_TIMEOUT_ACTIVITIES", 5)),
+}
+RETRY_MAX_ATTEMPTS = int(os.environ.get("RETRY_MAX_ATTEMPTS", 3))
+RETRY_BASE_DELAY = float(os.environ.get("RETRY_BASE_DELAY", 0.1))
+RETRY_MAX_DELAY = float(os.environ.get("RETRY_MAX_DELAY", 1.0))
+RETRY_BUDGET_SECONDS = float(os.environ.get("RETRY_BUDGET_SECONDS", 10))
+CIRCUIT_FAILURE_THRESHOLD = int(os.environ.get("CIRCUIT_FAILURE_THRESHOLD", 5))
+CIRCUIT_RESET_SECONDS = float(os.environ.get("CIRCUIT_RESET_SECONDS", 30))
+
+RETRYABLE_EXCEPTIONS = (requests.ConnectionError, requests.Timeout)
+
+
+class CircuitOpenError(Exception):
+    pass
+
+
+class CircuitBreaker:
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold: int = None, reset_seconds: float = None):
+        self.failure_threshold = failure_threshold or CIRCUIT_FAILURE_THRESHOLD
+        self.reset_seconds = CIRCUIT_RESET_SECONDS if reset_seconds is None else reset_seconds
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._lock = threading.Lock()
+
+    def before_call(self):
+        with self._lock:
+            if self.state == self.CLOSED:
+                return
+            if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.reset_seconds:
+                # let a single trial call through
+                self.state = self.HALF_OPEN
+                return
+            raise CircuitOpenError()
+
+    def record_success(self):
+        with self._lock:
+            self.state = self.CLOSED
+            self.failures = 0
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def circuit_breaker(url: str) -> CircuitBreaker:
+    key = connection_pool.origin_of(url)
+    with _breakers_lock:
+        if key not in _breakers:
+            _breakers[key] = CircuitBreaker()
+        return _breakers[key]
+
+
+def timeout_for(verb) -> tuple:
+    return connection_pool.CONNECT_TIMEOUT, ACTION_READ_TIMEOUTS.get(str(verb), connection_pool.READ_TIMEOUT)
+
+
+def backoff_delay(attempt: int) -> float:
+    # full jitter
+    return random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** attempt))
+
+
+def is_server_failure(response) -> bool:
+    return response.status_code >= 500 or response.status_code == 429
+
+
+def send_request(method: str, url: str, timeout: tuple, **kwargs) -> requests.Response:
+    """
+    Send through the pooled session, retrying idempotent GETs within the time budget.
+    The first attempt gets the full read timeout of its action, the budget covers the retries after it.
+    Raises CircuitOpenError while the vendor circuit is open, and the last error once retries are spent.
+    """
+    breaker = circuit_breaker(url)
+    breaker.before_call()
+    attempts = RETRY_MAX_ATTEMPTS if method.upper() == "GET" else 1
+    deadline = None
+    connect_timeout, read_timeout = timeout
+    for attempt in range(attempts):
+        attempt_read_timeout = read_timeout if deadline is None else \
+            max(0.001, min(read_timeout, deadline - time.monotonic()))
+        error = None
+        response = None
+        try:
+            response = connection_pool.send_request(method, url, timeout=(connect_timeout, attempt_read_timeout),
+                                                    **kwargs)
+        except RETRYABLE_EXCEPTIONS as request_error:
+            error = request_error
+        except Exception:
+            # not worth a retry, but a half open circuit still needs the outcome of its trial call
+            breaker.record_failure()
+            raise
+        if response is not None and not is_server_failure(response):
+            breaker.record_success()
+            return response
+        breaker.record_failure()
+        if deadline is None:
+            deadline = time.monotonic() + RETRY_BUDGET_SECONDS
+
+        delay = backoff_delay(attempt)
+        if attempt == attempts - 1 or time.monotonic() + delay >= deadline:
+            if error is not None:
+                raise error
+            return response
+        if response is not None:
+            # give the connection of a streamed response back to the pool
+            response.close()
+        logging.warning(f"Retrying {method} {url} after attempt {attempt + 1} failed")
+        time.sleep(delay)
+        breaker.before_call()
@@ -0,0 +1,142 @@
+import os
+import json_codec
+import time
+import logging
+import threading
+from collections import OrderedDict
+from http import HTTPStatus
+from streaming_json import is_streamed, materialize, StreamingJsonError
+
+'''
+Opt in TTL cache for read only vendor actions (location, activities).
+Entries are keyed on vendor, verb, path and normalized params, evicted least recently used
+once the entry count or the approximate memory bound is reached.
+An expired entry is still served for a short stale window while it is refreshed in the background.
+Only GET calls are cached, start_charge and stop_charge always go to the vendor.
+'''
+
+RESPONSE_CACHE_ENABLED = os.environ.get("RESPONSE_CACHE_ENABLED", "false").lower() == "true"
+RESPONSE_CACHE_MAX_ENTRIES = int(os.environ.get("RESPONSE_CACHE_MAX_ENTRIES", 256))
+RESPONSE_CACHE_MAX_BYTES = int(os.environ.get("RESPONSE_CACHE_MAX_BYTES", 32 * 1024 * 1024))
+RESPONSE_CACHE_STALE_SECONDS = float(os.environ.get("RESPONSE_CACHE_STALE_SECONDS", 30))
+RESPONSE_CACHE_TTLS = {
+    "stations": float(os.environ.get("RESPONSE_CACHE_TTL_LOCATION", 30)),
+    "charging/activities": float(os.environ.get("RESPONSE_CACHE_TTL_ACTIVITIES", 5)),
+}
+
+
+def cache_key(url_data, request_params, header_data, path) -> tuple:
+    params = tuple(sorted((str(name), str(value)) for name, value in (request_params or {}).items()
+                          if value is not None))
+    return (url_data.base_url.rstrip("/"), str(url_data.verb), str(path) if path is not None else None,
+            (header_data or {}).get("key"), params)
+
+
+class ResponseCache:
+    def __init__(self, max_entries: int = None, max_bytes: int = None, stale_seconds: float = None):
+        self.max_entries = max_entries or RESPONSE_CACHE_MAX_ENTRIES
+        self.max_bytes = max_bytes or RESPONSE_CACHE_MAX_BYTES
+        self.stale_seconds = RESPONSE_CACHE_STALE_SECONDS if stale_seconds is None else stale_seconds
+        self.hits = 0
+        self.misses = 0
+        self.stale_hits = 0
+        self.bypassed = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._refreshing = set()
+        self._lock = threading.Lock()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "stale_hits": self.stale_hits,
+                    "bypassed": self.bypassed, "evictions": self.evictions,
+                    "entries": len(self._entries), "bytes": self._bytes}
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def _store(self, key, response, ttl: float):
+        try:
+            size = len(json_codec.dumps(response, default=str))
+        except (TypeError, ValueError):
+            return
+        if size > self.max_bytes:
+            return
+        now = time.monotonic()
+        with self._lock:
+            if key in self._entries:
+                self._bytes -= self._entries.pop(key)[3]
+            self._entries[key] = (response, now + ttl, now + ttl + self.stale_seconds, size)
+            self._bytes += size
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= evicted[3]
+                self.evictions += 1
+
+    def _fetch_and_store(self, key, ttl: float, fetch):
+        response = fetch()
+        if isinstance(response, dict) and response.get("status_code") == HTTPStatus.OK:
+            if is_streamed(response.get("data")):
+                # a streamed body can only be read once, a cached response keeps the parsed stations
+                try:
+                    response = dict(response, data=materialize(response["data"]))
+                except StreamingJsonError:
+                    logging.exception(f"Response of {key[:3]} broke off, not caching it")
+                    return {"status_code": HTTPStatus.BAD_GATEWAY, "message": "Incomplete response from station",
+                            "data": {}}
+            self._store(key, response, ttl)
+            # callers replace data with page iterators, the stored dict must not be the one handed out
+            return dict(response)
+        return response
+
+    def _refresh(self, key, ttl: float, fetch):
+        try:
+            self._fetch_and_store(key, ttl, fetch)
+        except Exception:
+            logging.exception(f"Background refresh of {key[:3]} failed")
+        finally:
+            with self._lock:
+                self._refreshing.discard(key)
+
+    def get_or_fetch(self, key, ttl: float, fetch):
+        now = time.monotonic()
+        start_refresh = False
+        with self._lock:
+            entry = self._entries.get(key)
+            fresh = entry is not None and now < entry[1]
+            stale = entry is not None and not fresh and now < entry[2]
+            if fresh:
+                self._entries.move_to_end(key)
+                self.hits += 1
+            elif stale:
+                self._entries.move_to_end(key)
+                self.stale_hits += 1
+                start_refresh = key not in self._refreshing
+                self._refreshing.add(key)
+            else:
+                self.misses += 1
+        if not fresh and not stale:
+            return self._fetch_and_store(key, ttl, fetch)
+        if start_refresh:
+            threading.Thread(target=self._refresh, args=(key, ttl, fetch), daemon=True).start()
+        # callers may replace top level keys, never hand out the cached dict itself
+        return dict(entry[0])
+
+    def call(self, caller, url_data, request_params, header_data, path=None, enabled: bool = None):
+        """
+        Cached version of caller(url_data, request_params, header_data, path)
+        """
+        ttl = RESPONSE_CACHE_TTLS.get(str(url_data.verb))
+        enabled = RESPONSE_CACHE_ENABLED if enabled is None else enabled
+        if not enabled or ttl is None or str(url_data.call_method).upper() != "GET":
+            with self._lock:
+                self.bypassed += 1
+            return caller(url_data, request_params, header_data, path)
+        return self.get_or_fetch(cache_key(url_data, request_params, header_data, path), ttl,
+                                 lambda: caller(url_data, request_params, header_data, path))
+
+
+response_cache = ResponseCache()
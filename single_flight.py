@@ -0,0 +1,166 @@
+import os
+import time
+import threading
+
+'''
+Single flight coalescing of identical read requests.
+While a location or activities request is in flight, identical requests wait for it and share its
+result instead of calling the vendor (and with write set, mapping and writing the stations) again.
+Within a process followers wait on the leader directly. An optional store extends this across invocations:
+the leader takes a lock in the store and publishes its result there for followers in other containers.
+'''
+
+SINGLE_FLIGHT_ENABLED = os.environ.get("SINGLE_FLIGHT_ENABLED", "true").lower() == "true"
+SINGLE_FLIGHT_LOCK_SECONDS = float(os.environ.get("SINGLE_FLIGHT_LOCK_SECONDS", 30))
+SINGLE_FLIGHT_RESULT_SECONDS = float(os.environ.get("SINGLE_FLIGHT_RESULT_SECONDS", 5))
+SINGLE_FLIGHT_WAIT_SECONDS = float(os.environ.get("SINGLE_FLIGHT_WAIT_SECONDS", 10))
+SINGLE_FLIGHT_POLL_SECONDS = 0.05
+
+
+def normalize(value):
+    if isinstance(value, dict):
+        return tuple(sorted((str(name), normalize(item)) for name, item in value.items() if item is not None))
+    if isinstance(value, (list, tuple)):
+        return tuple(normalize(item) for item in value)
+    return str(value)
+
+
+class SingleFlightStore:
+    """
+    Base of the cross invocation stores. Keys are strings, results must be json serializable.
+    """
+
+    def acquire(self, key: str, ttl: float) -> bool:
+        raise NotImplementedError
+
+    def release(self, key: str):
+        raise NotImplementedError
+
+    def publish(self, key: str, result, ttl: float):
+        raise NotImplementedError
+
+    def result(self, key: str):
+        """
+        The published result, None when there is none
+        """
+        raise NotImplementedError
+
+
+class InMemorySingleFlightStore(SingleFlightStore):
+    def __init__(self):
+        self._locks = {}
+        self._results = {}
+        self._lock = threading.Lock()
+
+    def acquire(self, key: str, ttl: float) -> bool:
+        now = time.monotonic()
+        with self._lock:
+            if self._locks.get(key, 0) > now:
+                return False
+            self._locks[key] = now + ttl
+            return True
+
+    def release(self, key: str):
+        with self._lock:
+            self._locks.pop(key, None)
+
+    def publish(self, key: str, result, ttl: float):
+        with self._lock:
+            self._results[key] = (result, time.monotonic() + ttl)
+
+    def result(self, key: str):
+        with self._lock:
+            result, expires_at = self._results.get(key, (None, 0))
+        return result if expires_at > time.monotonic() else None
+
+
+class _Call:
+    __slots__ = ("done", "result", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    def __init__(self, store: SingleFlightStore = None):
+        self.store = store
+        self.leaders = 0
+        self.coalesced = 0
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"leaders": self.leaders, "coalesced": self.coalesced, "in_flight": len(self._calls)}
+
+    @staticmethod
+    def _shared(result):
+        # followers may replace top level keys, every caller gets its own dict
+        return dict(result) if isinstance(result, dict) else result
+
+    def do(self, key, function):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = _Call()
+                self._calls[key] = call
+                self.leaders += 1
+            else:
+                self.coalesced += 1
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return self._shared(call.result)
+        try:
+            call.result = self._run_across_invocations(str(key), function)
+            return self._shared(call.result)
+        except Exception as error:
+            call.error = error
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.done.set()
+
+    def _run_across_invocations(self, key: str, function):
+        if self.store is None:
+            return function()
+        deadline = time.monotonic() + SINGLE_FLIGHT_WAIT_SECONDS
+        waited = False
+        while True:
+            if waited:
+                # the leader publishes before releasing its lock, look for its result first
+                result = self.store.result(key)
+                if result is not None:
+                    with self._lock:
+                        self.coalesced += 1
+                    return result
+            if self.store.acquire(key, SINGLE_FLIGHT_LOCK_SECONDS):
+                break
+            if time.monotonic() >= deadline:
+                # the other leader is too slow, do the call ourselves
+                return function()
+            time.sleep(SINGLE_FLIGHT_POLL_SECONDS)
+            waited = True
+        try:
+            result = function()
+            self.store.publish(key, result, SINGLE_FLIGHT_RESULT_SECONDS)
+            return result
+        finally:
+            self.store.release(key)
+
+
+def store_from_env():
+    """
+    SINGLE_FLIGHT_STORE is empty (in process only) or "memory"
+    """
+    if os.environ.get("SINGLE_FLIGHT_STORE", "") == "memory":
+        return InMemorySingleFlightStore()
+    return None
+
+
+single_flight = SingleFlight(store_from_env())
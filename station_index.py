@@ -0,0 +1,212 @@
+import os
+import json
+import math
+import logging
+import threading
+from http import HTTPStatus
+import metrics
+from data_structure import ChargerStatus
+
+'''
+In process spatial index of the synced stations.
+Stations are bucketed in a lat/long grid so radius and nearest station queries only look at nearby cells.
+The location sync keeps it up to date station by station, and it can be saved to and loaded from a
+snapshot file so a new container answers nearby queries without waiting for a sync.
+'''
+
+STATION_INDEX_ENABLED = os.environ.get("STATION_INDEX_ENABLED", "true").lower() == "true"
+STATION_INDEX_CELL_DEGREES = float(os.environ.get("STATION_INDEX_CELL_DEGREES", 0.05))
+STATION_INDEX_SNAPSHOT = os.environ.get("STATION_INDEX_SNAPSHOT", "")
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE = math.pi * EARTH_RADIUS_KM / 180
+
+
+def haversine_km(latitude_1: float, longitude_1: float, latitude_2: float, longitude_2: float) -> float:
+    latitude_1, longitude_1, latitude_2, longitude_2 = map(math.radians,
+                                                           (latitude_1, longitude_1, latitude_2, longitude_2))
+    a = math.sin((latitude_2 - latitude_1) / 2) ** 2 + \
+        math.cos(latitude_1) * math.cos(latitude_2) * math.sin((longitude_2 - longitude_1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+# repeated connectors of a charger keep the vendor pivot status, 1 is available there
+_AVAILABLE_STATUSES = (ChargerStatus.CHARGER_AVAILABLE, ChargerStatus.CHARGER_AVAILABLE.value, 1)
+
+
+def _available_connectors(total_charger_data) -> int:
+    available = 0
+    for charger in total_charger_data or []:
+        for connector in charger.get("connectors", []):
+            if connector.get("status") in _AVAILABLE_STATUSES:
+                available += 1
+    return available
+
+
+def index_record(mapped_station) -> dict:
+    """
+    The few fields the index keeps of a mapped station, a ChargingStationStaticData or a bulk MappedStation
+    """
+    fields = getattr(mapped_station, "data", None) or vars(mapped_station)
+    return {"station_id": str(fields["station_id"]),
+            "name": fields["name"],
+            "latitude": float(fields["latitude"]),
+            "longitude": float(fields["longitude"]),
+            "station_status": str(fields["station_status"]),
+            "available_connectors": _available_connectors(fields["total_charger_data"])}
+
+
+class StationIndex:
+    def __init__(self, cell_degrees: float = None):
+        self.cell_degrees = cell_degrees or STATION_INDEX_CELL_DEGREES
+        self._stations = {}
+        self._cells = {}
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._stations)
+
+    def _cell(self, latitude: float, longitude: float) -> tuple:
+        return int(math.floor(latitude / self.cell_degrees)), int(math.floor(longitude / self.cell_degrees))
+
+    def upsert(self, record: dict):
+        with self._lock:
+            self.remove(record["station_id"])
+            cell = self._cell(record["latitude"], record["longitude"])
+            self._stations[record["station_id"]] = (cell, record)
+            self._cells.setdefault(cell, set()).add(record["station_id"])
+
+    def remove(self, station_id: str):
+        with self._lock:
+            existing = self._stations.pop(station_id, None)
+            if existing is None:
+                return
+            members = self._cells.get(existing[0])
+            members.discard(station_id)
+            if not members:
+                del self._cells[existing[0]]
+
+    @staticmethod
+    def _matches(record: dict, station_status, available_only: bool) -> bool:
+        if station_status is not None and record["station_status"] != station_status:
+            return False
+        return not available_only or record["available_connectors"] > 0
+
+    def _ring(self, center: tuple, ring: int):
+        if ring == 0:
+            yield center
+            return
+        latitude_cell, longitude_cell = center
+        for offset in range(-ring, ring + 1):
+            yield latitude_cell - ring, longitude_cell + offset
+            yield latitude_cell + ring, longitude_cell + offset
+        for offset in range(-ring + 1, ring):
+            yield latitude_cell + offset, longitude_cell - ring
+            yield latitude_cell + offset, longitude_cell + ring
+
+    def _ring_distance_km(self, latitude: float, ring: int) -> float:
+        # closest any cell of this ring can be, longitude cells shrink towards the poles
+        if ring == 0:
+            return 0.0
+        shrink = max(math.cos(math.radians(min(89.0, abs(latitude) + ring * self.cell_degrees))), 0.01)
+        return (ring - 1) * self.cell_degrees * KM_PER_DEGREE * shrink
+
+    def _search(self, latitude: float, longitude: float, radius_km, k, station_status, available_only) -> list:
+        center = self._cell(latitude, longitude)
+        found = []
+        with self._lock:
+            if not self._cells:
+                return found
+            max_ring = max(max(abs(cell[0] - center[0]), abs(cell[1] - center[1])) for cell in self._cells)
+            for ring in range(max_ring + 1):
+                ring_distance = self._ring_distance_km(latitude, ring)
+                if radius_km is not None and ring_distance > radius_km:
+                    break
+                if k is not None and len(found) >= k and ring_distance > found[k - 1][0]:
+                    break
+                for cell in self._ring(center, ring):
+                    for station_id in self._cells.get(cell, ()):
+                        record = self._stations[station_id][1]
+                        if not self._matches(record, station_status, available_only):
+                            continue
+                        distance = haversine_km(latitude, longitude, record["latitude"], record["longitude"])
+                        if radius_km is None or distance <= radius_km:
+                            found.append((distance, record))
+                found.sort(key=lambda item: item[0])
+        return found[:k] if k is not None else found
+
+    def within_radius(self, latitude: float, longitude: float, radius_km: float, station_status=None,
+                      available_only: bool = False) -> list:
+        return [dict(record, distance_km=distance) for distance, record in
+                self._search(latitude, longitude, radius_km, None, station_status, available_only)]
+
+    def nearest(self, latitude: float, longitude: float, k: int, radius_km: float = None, station_status=None,
+                available_only: bool = False) -> list:
+        return [dict(record, distance_km=distance) for distance, record in
+                self._search(latitude, longitude, radius_km, k, station_status, available_only)]
+
+    def save(self, path: str):
+        with self._lock:
+            records = [record for _, record in self._stations.values()]
+        temporary_path = f"{path}.tmp"
+        with open(temporary_path, "w") as snapshot:
+            json.dump({"cell_degrees": self.cell_degrees, "stations": records}, snapshot)
+        os.replace(temporary_path, path)
+
+    @classmethod
+    def load(cls, path: str):
+        with open(path) as snapshot:
+            data = json.load(snapshot)
+        index = cls(data["cell_degrees"])
+        for record in data["stations"]:
+            index.upsert(record)
+        return index
+
+
+def index_from_snapshot() -> StationIndex:
+    if STATION_INDEX_SNAPSHOT and os.path.exists(STATION_INDEX_SNAPSHOT):
+        try:
+            return StationIndex.load(STATION_INDEX_SNAPSHOT)
+        except (OSError, ValueError, KeyError):
+            logging.exception(f"Could not load station index snapshot {STATION_INDEX_SNAPSHOT}")
+    return StationIndex()
+
+
+def save_snapshot():
+    if STATION_INDEX_SNAPSHOT:
+        station_index.save(STATION_INDEX_SNAPSHOT)
+
+
+class NearbyStationsHandler:
+    """
+    Answers nearby station queries from the index, without calling the vendor
+    """
+    call_method = "GET"
+
+    def __init__(self, params_model, index=None):
+        self.params_model = params_model
+        self.index = index
+        self.vendor_id = None
+        self.action = None
+        self.calls = 0
+
+    def __call__(self, message_in_event):
+        with metrics.span("validation"):
+            params = self.params_model.parse_obj(message_in_event["params"])
+        index = self.index if self.index is not None else station_index
+        self.calls += 1
+        with metrics.span("index_query"):
+            if params.k:
+                stations = index.nearest(params.latitude, params.longitude, params.k, params.radius_km,
+                                         params.station_status, params.available_only)
+            else:
+                stations = index.within_radius(params.latitude, params.longitude, params.radius_km,
+                                               params.station_status, params.available_only)
+        metrics.count(self.vendor_id, self.action, HTTPStatus.OK)
+        return {"status_code": HTTPStatus.OK, "message": f"{len(stations)} stations nearby", "data": stations}
+
+    def stats(self) -> dict:
+        return {"calls": self.calls,
+                "indexed_stations": len(self.index if self.index is not None else station_index)}
+
+
+station_index = index_from_snapshot()
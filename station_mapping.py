@@ -0,0 +1,96 @@
+import data_schemas
+from data_structure import ChargerStatus
+
+'''
+Mapping of vendor station payloads to the electrolite location structure
+'''
+
+
+def group_chargemod_charging_pins(chargers) -> ([], []):
+    """
+    Single pass over the charging pins of a station.
+    Returns the pins grouped by charger id (total_charger_data) and the flat list (expanded_total_charger_data).
+    """
+    parsed_list_of_chargers = []
+    expanded_list_of_chargers = []
+    chargers_by_id = {}
+    for charger_point in chargers:
+        pivot = charger_point["pivot"]
+        charger_point_status = translate_status_to_text(charger_point["status"])
+        expanded_list_of_chargers.append({"charger_point_id": charger_point["id"],
+                                          "charger_point_type": charger_point["type"],
+                                          "power_capacity": charger_point["battery"],
+                                          "charger_point_status": charger_point_status,
+                                          "connector_point_id": pivot["charging_pin_id"],
+                                          "tariff": 125
+                                          })
+        charger = chargers_by_id.get(charger_point["id"])
+        if charger is None:
+            # first insert logic
+            charger = {"charger_point_id": charger_point["id"],
+                       "charger_point_type": charger_point["type"],
+                       "power_capacity": charger_point["battery"],
+                       "charger_point_status": charger_point_status,
+                       "connectors": [
+                           {"connector_point_id": pivot["charging_pin_id"],
+                            "relay_number": pivot["relay_switch_number"],
+                            "status": translate_status_to_text(pivot["status"]),
+                            "tariff": 125
+                            }]
+                       }
+            chargers_by_id[charger_point["id"]] = charger
+            parsed_list_of_chargers.append(charger)
+        else:
+            # append logic if evse id already exist
+            charger["connectors"].append({"connector_point_id": pivot["charging_pin_id"],
+                                          "relay_number": pivot["relay_switch_number"],
+                                          "status": pivot["status"],
+                                          "tariff": 125
+                                          })
+    return parsed_list_of_chargers, expanded_list_of_chargers
+
+
+def parse_expanded_chargemod_total_chargers(chargers) -> []:
+    return group_chargemod_charging_pins(chargers)[1]
+
+
+def parse_chargemod_total_chargers(chargers) -> []:
+    return group_chargemod_charging_pins(chargers)[0]
+
+
+def translate_status_to_text(status):
+    if status == 1:
+        return ChargerStatus.CHARGER_AVAILABLE
+    else:
+        return ChargerStatus.CHARGER_BUSY
+
+def map_chargemod_to_electrolite_structure(station):
+    try:
+        parsed_total_chargemod_data, expanded_total_chargemod_data = \
+            group_chargemod_charging_pins(station["charging_pins"])
+        count_of_chargers = len(parsed_total_chargemod_data)
+
+        mapper = {
+            "station_id": station["id"],
+            "vendor_id": "chargemod",
+            "name": station["name"],
+            "address_line": station["street1"],
+            "town": station["city"],
+            "state": station["state"],
+            "postal_code": station["zip"],
+            "latitude": station["latitude"],
+            "longitude": station["longitude"],
+            "country": station["country"],
+            "qr_code": station["qr_code"],
+            "total_connectors_available": count_of_chargers,
+            "station_status": station["device_status"].lower(),
+            "station_time": {"start_time": "12:00 AM", "end_time": "11:59 PM"},
+            "geo_address": [station["latitude"], station["longitude"]],
+            "image": station["image"],
+            "total_charger_data": parsed_total_chargemod_data,
+            "expanded_total_charger_data": expanded_total_chargemod_data
+        }
+    except KeyError:
+        raise
+    else:
+        return data_schemas.ChargingStationStaticData.parse_obj(mapper)
@@ -0,0 +1,228 @@
+import json
+import codecs
+from collections import deque
+from collections.abc import Mapping
+
+'''
+Incremental parse of large json objects such as the chargemod stations response.
+The body is read chunk by chunk. Values of an object are parsed when they are reached, except the arrays
+under stream_keys, which are handed out as iterators that parse one element at a time. Memory then stays
+around one element plus one read chunk instead of the whole body and all of its objects.
+Keys are read in body order, asking for a key that comes after a streamed array buffers the rest of the array.
+Errors of the chunk source (connection, decompression, size cap) are raised as StreamingJsonError.
+'''
+
+STREAM_BUFFER_COMPACT_CHARS = 64 * 1024
+_WHITESPACE = " \t\n\r"
+_DELIMITERS = _WHITESPACE + ",:]}"
+_decoder = json.JSONDecoder()
+
+
+class StreamingJsonError(ValueError):
+    pass
+
+
+class _Reader:
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._decoder = codecs.getincrementaldecoder("utf-8")()
+        self._buffer = ""
+        self._position = 0
+        self._eof = False
+
+    def _fill(self) -> bool:
+        if self._eof:
+            return False
+        if self._position > STREAM_BUFFER_COMPACT_CHARS:
+            self._buffer = self._buffer[self._position:]
+            self._position = 0
+        try:
+            for chunk in self._chunks:
+                text = self._decoder.decode(chunk) if isinstance(chunk, bytes) else chunk
+                if text:
+                    self._buffer += text
+                    return True
+            self._buffer += self._decoder.decode(b"", final=True)
+        except StreamingJsonError:
+            raise
+        except Exception as error:
+            # the body is read lazily, a broken connection, timeout or bad encoding shows up here
+            raise StreamingJsonError(f"Reading the json body failed: {error!r}") from error
+        self._eof = True
+        return False
+
+    def peek(self) -> str:
+        """
+        Next character after whitespace, without consuming it
+        """
+        while True:
+            while self._position < len(self._buffer) and self._buffer[self._position] in _WHITESPACE:
+                self._position += 1
+            if self._position < len(self._buffer):
+                return self._buffer[self._position]
+            if not self._fill():
+                raise StreamingJsonError("Unexpected end of json body")
+
+    def expect(self, character: str):
+        if self.peek() != character:
+            found = self._buffer[self._position:self._position + 20]
+            raise StreamingJsonError(f"Expected {character!r} at {found!r}")
+        self._position += 1
+
+    def value(self):
+        """
+        Parses one complete value, reading more of the body until it is there
+        """
+        self.peek()
+        while True:
+            try:
+                value, end = _decoder.raw_decode(self._buffer, self._position)
+            except json.JSONDecodeError as error:
+                if self._fill():
+                    continue
+                raise StreamingJsonError(f"Invalid json body: {error}") from error
+            if end == len(self._buffer) or self._buffer[end] not in _DELIMITERS:
+                # a number cut by the chunk boundary, "2" of "2.5"
+                if self._fill():
+                    continue
+                if end < len(self._buffer):
+                    raise StreamingJsonError(f"Invalid json body at {self._buffer[end:end + 20]!r}")
+            self._position = end
+            return value
+
+
+class StreamedArray:
+    """
+    Iterator over the elements of an array in the body, each element is parsed when it is asked for
+    """
+    streamed = True
+
+    def __init__(self, reader: _Reader):
+        self._reader = reader
+        self._buffered = deque()
+        self._started = False
+        self._done = False
+
+    def _next_element(self):
+        reader = self._reader
+        if not self._started:
+            reader.expect("[")
+            self._started = True
+            if reader.peek() == "]":
+                reader.expect("]")
+                self._done = True
+                raise StopIteration
+        else:
+            separator = reader.peek()
+            reader.expect(separator if separator in ",]" else ",")
+            if separator == "]":
+                self._done = True
+                raise StopIteration
+        return reader.value()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self._buffered:
+            return self._buffered.popleft()
+        if self._done:
+            raise StopIteration
+        return self._next_element()
+
+    def finish(self):
+        """
+        Reads the rest of the array so the body can go on, unread elements are kept for the iterator
+        """
+        while not self._done:
+            try:
+                self._buffered.append(self._next_element())
+            except StopIteration:
+                break
+
+
+class StreamingJsonObject(Mapping):
+    """
+    Read only mapping over an object in the body.
+    Arrays under stream_keys become StreamedArray, objects under stream_keys are streamed the same way.
+    """
+    streamed = True
+
+    def __init__(self, chunks=None, stream_keys: tuple = ("data",), reader: _Reader = None):
+        self._reader = reader or _Reader(chunks)
+        self._stream_keys = stream_keys
+        self._values = {}
+        self._open_value = None
+        self._done = False
+        self._reader.expect("{")
+        if self._reader.peek() == "}":
+            self._reader.expect("}")
+            self._done = True
+
+    def _read_next(self) -> bool:
+        if self._done:
+            return False
+        reader = self._reader
+        if self._open_value is not None:
+            # a streamed value has to be read to its end before the next key
+            self._open_value.finish()
+            self._open_value = None
+            separator = reader.peek()
+            reader.expect(separator if separator in ",}" else ",")
+            if separator == "}":
+                self._done = True
+                return False
+        key = reader.value()
+        if not isinstance(key, str):
+            raise StreamingJsonError(f"Object key {key!r} is not a string")
+        reader.expect(":")
+        next_character = reader.peek()
+        if key in self._stream_keys and next_character in "[{":
+            value = StreamedArray(reader) if next_character == "[" else \
+                StreamingJsonObject(stream_keys=self._stream_keys, reader=reader)
+            self._values[key] = value
+            self._open_value = value
+            return True
+        self._values[key] = reader.value()
+        separator = reader.peek()
+        reader.expect(separator if separator in ",}" else ",")
+        if separator == "}":
+            self._done = True
+        return True
+
+    def finish(self):
+        while self._read_next():
+            pass
+
+    def __getitem__(self, key):
+        while key not in self._values:
+            if not self._read_next():
+                raise KeyError(key)
+        return self._values[key]
+
+    def __iter__(self):
+        self.finish()
+        return iter(self._values)
+
+    def __len__(self):
+        self.finish()
+        return len(self._values)
+
+    def __bool__(self):
+        # without parsing the whole object for a truth test
+        return not self._done or bool(self._values)
+
+
+def is_streamed(value) -> bool:
+    return getattr(value, "streamed", False)
+
+
+def materialize(value):
+    """
+    Reads streamed values to the end and returns them as plain lists and dicts
+    """
+    if isinstance(value, StreamedArray):
+        return [materialize(item) for item in value]
+    if isinstance(value, StreamingJsonObject):
+        return {key: materialize(item) for key, item in value.items()}
+    return value
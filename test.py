@@ -1,10 +1,72 @@
 import json
+import threading
 import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from lambda_function import map_chargemod_to_electrolite_structure, call_handle_chargemod_exception, third_party_caller, \
-    parse_sns_message_process, lambda_handler
+    parse_sns_message_process, lambda_handler, action_registry, group_chargemod_charging_pins
 import data_schemas
+import connection_pool
+import batch_processor
+import location_sync
+import incremental_sync
+import response_cache
+import fast_validation
+import bulk_mapping
+import metrics
+import io
+import resilience
+import single_flight
+import idempotency
+import station_index
+import activity_poller
+import json_codec
+import compression
+import write_sinks
+import streaming_json
+import lambda_function
+import asyncio
+import command_queue
+import worker
+import tracemalloc
+import zlib
+import gzip
+import urllib3
+import requests
+import random
+from unittest import mock
+import copy
+from pydantic import ValidationError
+import time
+import os
+import tempfile
+from benchmarks.synthetic_data import synthetic_stations
+from benchmarks.fake_chargemod import FakeChargeModServer
 from http import HTTPStatus
 
+
+class KeepAliveHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    wbufsize = 64 * 1024
+
+    def do_GET(self):
+        self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        body = json.dumps({"success": True, "message": "ok", "data": []}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_local_server(handler=KeepAliveHandler):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
 class MyTestCase(unittest.TestCase):
     charge_mod_data1 = {
         "id": 110,
@@ -122,6 +184,18 @@ class MyTestCase(unittest.TestCase):
         print(result)
         self.assertTrue(result)
 
+    def test_charging_pins_grouping(self):
+        total_charger_data, expanded_total_charger_data = \
+            group_chargemod_charging_pins(self.charge_mod_data1["charging_pins"])
+        self.assertEqual([c["charger_point_id"] for c in total_charger_data], [1, 2])
+        self.assertEqual(len(expanded_total_charger_data), 2)
+
+        repeated_pins = [dict(pin, id=7) for pin in self.charge_mod_data1["charging_pins"]]
+        total_charger_data, expanded_total_charger_data = group_chargemod_charging_pins(repeated_pins)
+        self.assertEqual(len(total_charger_data), 1)
+        self.assertEqual(len(total_charger_data[0]["connectors"]), 2)
+        self.assertEqual([c["charger_point_id"] for c in expanded_total_charger_data], [7, 7])
+
     def test_chargemod_location_url_sending(self):
         url_data = data_schemas.ChargeModLocationsUrls.parse_obj({"base_url": "https://apitest.chargemod.com"})
 
@@ -167,6 +241,1114 @@ class MyTestCase(unittest.TestCase):
         call_handle_chargemod_exception(url_data, request_params=None, header_data=self.header_data, path=1)
 
 
+class ConnectionPoolTestCase(unittest.TestCase):
+    def setUp(self) -> None:
+        self.server, self.base_url = start_local_server()
+        connection_pool.close_sessions()
+        connection_pool.reset_invocation_metrics()
+
+    def tearDown(self) -> None:
+        connection_pool.close_sessions()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_session_is_shared_per_origin(self):
+        self.assertIs(connection_pool.get_session(self.base_url + "/stations"),
+                      connection_pool.get_session(self.base_url + "/charging/start"))
+
+    def test_connection_is_reused_across_calls(self):
+        url_data = data_schemas.ChargeModLocationsUrls.parse_obj({"base_url": self.base_url})
+        for _ in range(3):
+            result = call_handle_chargemod_exception(url_data, {"q": "BB"}, {})
+            self.assertEqual(result["status_code"], HTTPStatus.OK)
+        metrics = connection_pool.get_invocation_metrics()
+        self.assertEqual(metrics["requests"], 3)
+        self.assertEqual(metrics["new_connections"], 1)
+        self.assertEqual(metrics["reused_connections"], 2)
+
+
+class BatchProcessorTestCase(unittest.TestCase):
+    def setUp(self) -> None:
+        self.server, self.base_url = start_local_server()
+
+    def tearDown(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+
+    def sns_record(self, message_id, message):
+        return {"Sns": {"MessageId": message_id, "Message": message}}
+
+    def test_every_record_of_the_batch_is_processed(self):
+        message = {"vendor_id": "chargemod", "action": "location", "write": False,
+                   "base_url": self.base_url, "params": {"q": "BB"},
+                   "header": {"Accept": "application/json", "key": "k", "Authorization": "Bearer t"}}
+        event = {"Records": [self.sns_record("first", json.dumps(message)),
+                             self.sns_record("broken", "not json"),
+                             self.sns_record("last", json.dumps(message))]}
+        result = lambda_handler(event, context={})
+        self.assertEqual(result["status_code"], HTTPStatus.MULTI_STATUS)
+        self.assertEqual([r["record_id"] for r in result["results"]], ["first", "broken", "last"])
+        self.assertEqual(result["failed_records"], ["broken"])
+        self.assertEqual(result["results"][2]["response"]["status_code"], HTTPStatus.OK)
+
+    def test_vendor_concurrency_is_bounded(self):
+        running = []
+        peak = []
+        lock = threading.Lock()
+
+        def process(message):
+            with lock:
+                running.append(1)
+                peak.append(len(running))
+            threading.Event().wait(0.01)
+            with lock:
+                running.pop()
+            return {"status_code": HTTPStatus.OK}
+
+        records = [(str(i), {"vendor_id": "chargemod"}, None) for i in range(20)]
+        result = batch_processor.process_batch(records, process, max_workers=16)
+        self.assertEqual(result["failed_records"], [])
+        self.assertLessEqual(max(peak), batch_processor.VENDOR_CONCURRENCY_LIMIT)
+
+
+class ActionRegistryTestCase(unittest.TestCase):
+    def test_registered_actions(self):
+        handler = action_registry.get("ChargeMod", "START_CHARGE")
+        self.assertIs(handler.params_model, data_schemas.ChargeModStartChargeParams)
+        self.assertEqual(handler.call_method, "POST")
+        self.assertEqual(handler.verb, "charging/start")
+        self.assertEqual(action_registry.get("chargemod", "activities").path_param, "id")
+
+    def test_unknown_action_is_not_dispatched(self):
+        self.assertIsNone(parse_sns_message_process({"vendor_id": "chargemod", "action": "reboot"}))
+
+    def test_handler_counts_calls_and_errors(self):
+        handler = action_registry.get("chargemod", "stop_charge")
+        before = handler.stats()
+        with self.assertRaises(Exception):
+            parse_sns_message_process({"vendor_id": "chargemod", "action": "stop_charge", "params": {}})
+        after = handler.stats()
+        self.assertEqual(after["calls"], before["calls"] + 1)
+        self.assertEqual(after["errors"], before["errors"] + 1)
+
+
+class LocationSyncTestCase(unittest.TestCase):
+    def setUp(self) -> None:
+        self.written_chunks = []
+        self.lock = threading.Lock()
+
+    def writer(self, chunk):
+        with self.lock:
+            self.written_chunks.append(chunk)
+        return True
+
+    def test_stations_are_written_in_bounded_chunks(self):
+        stations = synthetic_stations(25)
+        result = location_sync.sync_stations(stations, "chargemod", map_chargemod_to_electrolite_structure,
+                                             writer=self.writer, max_count=10)
+        self.assertEqual(result["status_code"], HTTPStatus.OK)
+        self.assertEqual(result["data"]["written"], 25)
+        self.assertEqual([len(chunk) for chunk in self.written_chunks], [10, 10, 5])
+
+    def test_chunks_are_bounded_by_bytes(self):
+        station_bytes = len(map_chargemod_to_electrolite_structure(synthetic_stations(1)[0]).json())
+        location_sync.sync_stations(synthetic_stations(6), "chargemod", map_chargemod_to_electrolite_structure,
+                                    writer=self.writer, max_bytes=station_bytes * 2 + 10)
+        self.assertEqual([len(chunk) for chunk in self.written_chunks], [2, 2, 2])
+
+    def test_bad_station_does_not_abort_the_write(self):
+        stations = synthetic_stations(5)
+        del stations[2]["latitude"]
+        result = location_sync.sync_stations(stations, "chargemod", map_chargemod_to_electrolite_structure,
+                                             writer=self.writer, parallel_chunks=3, max_count=1)
+        self.assertEqual(result["status_code"], HTTPStatus.MULTI_STATUS)
+        self.assertEqual(result["data"]["written"], 4)
+        self.assertEqual(result["data"]["failed"], 1)
+        self.assertEqual(len(self.written_chunks), 4)
+
+    def test_failed_chunk_is_reported(self):
+        result = location_sync.sync_stations(synthetic_stations(4), "chargemod",
+                                             map_chargemod_to_electrolite_structure,
+                                             writer=lambda chunk: False, max_count=2)
+        self.assertEqual(result["data"], {"written": 0, "unchanged": 0, "failed": 4,
+                                                 "chunks": 2, "failed_chunks": 2})
+
+
+class IncrementalSyncTestCase(unittest.TestCase):
+    def setUp(self) -> None:
+        self.written_chunks = []
+
+    def writer(self, chunk):
+        self.written_chunks.append(chunk)
+        return True
+
+    def sync(self, stations, hash_store):
+        return location_sync.sync_stations(stations, "chargemod", map_chargemod_to_electrolite_structure,
+                                           writer=self.writer, hash_store=hash_store)
+
+    def test_only_changed_stations_are_written(self):
+        hash_store = incremental_sync.InMemoryStationHashStore()
+        self.assertEqual(self.sync(synthetic_stations(5), hash_store)["data"]["written"], 5)
+
+        stations = synthetic_stations(6)
+        stations[0]["charging_pins"][0]["status"] = 2
+        result = self.sync(stations, hash_store)
+        self.assertEqual(result["data"]["written"], 2)
+        self.assertEqual(result["data"]["unchanged"], 4)
+
+    def test_failed_write_is_retried_on_next_sync(self):
+        hash_store = incremental_sync.InMemoryStationHashStore()
+        location_sync.sync_stations(synthetic_stations(3), "chargemod", map_chargemod_to_electrolite_structure,
+                                    writer=lambda chunk: False, hash_store=hash_store)
+        self.assertEqual(self.sync(synthetic_stations(3), hash_store)["data"]["written"], 3)
+
+    def test_file_store_survives_reload(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "hashes.json")
+            self.sync(synthetic_stations(3), incremental_sync.FileStationHashStore(path))
+            result = self.sync(synthetic_stations(3), incremental_sync.FileStationHashStore(path))
+            self.assertEqual(result["data"]["unchanged"], 3)
+
+    def test_pages_are_followed(self):
+        pages = {2: {"current_page": 2, "last_page": 3, "data": [{"id": 3}]},
+                 3: {"current_page": 3, "last_page": 3, "data": [{"id": 4}]}}
+        first_page = {"current_page": 1, "last_page": 3, "data": [{"id": 1}, {"id": 2}]}
+        stations = incremental_sync.iter_pages(first_page,
+                                               lambda page: {"status_code": HTTPStatus.OK, "data": pages[page]})
+        self.assertEqual([station["id"] for station in stations], [1, 2, 3, 4])
+        self.assertEqual(list(incremental_sync.iter_pages([{"id": 1}], None)), [{"id": 1}])
+
+    def test_failed_page_is_not_a_complete_sync(self):
+        first_page = {"current_page": 1, "last_page": 3, "data": synthetic_stations(2)}
+
+        def fetch_page(page):
+            if page == 3:
+                return {"status_code": HTTPStatus.INTERNAL_SERVER_ERROR, "message": "Unknown Error", "data": {}}
+            return {"status_code": HTTPStatus.OK, "data": {"current_page": 2, "last_page": 3,
+                                                           "data": synthetic_stations(3)[2:]}}
+
+        written = []
+        result = location_sync.sync_stations(incremental_sync.iter_pages(first_page, fetch_page), "chargemod",
+                                             map_chargemod_to_electrolite_structure,
+                                             writer=lambda chunk: written.extend(chunk) or True)
+        self.assertEqual(result["status_code"], HTTPStatus.BAD_GATEWAY)
+        self.assertEqual(result["data"]["written"], len(written))
+        response = {"status_code": HTTPStatus.OK, "message": "Stations",
+                    "data": incremental_sync.iter_pages(first_page, fetch_page)}
+        result = lambda_function.post_process_location({"write": False}, response)
+        self.assertEqual(result["status_code"], HTTPStatus.BAD_GATEWAY)
+
+
+class ResponseCacheTestCase(unittest.TestCase):
+    def setUp(self) -> None:
+        self.calls = []
+        self.location_urls = data_schemas.ChargeModLocationsUrls.parse_obj({"base_url": "https://vendor"})
+
+    def caller(self, url_data, request_params, header_data, path=None):
+        self.calls.append((url_data.verb, request_params, path))
+        return {"status_code": HTTPStatus.OK, "message": "ok", "data": [len(self.calls)]}
+
+    def test_identical_queries_hit_the_cache(self):
+        cache = response_cache.ResponseCache()
+        first = cache.call(self.caller, self.location_urls, {"q": "BB", "city": None}, {"key": "k"}, enabled=True)
+        second = cache.call(self.caller, self.location_urls, {"q": "BB"}, {"key": "k"}, enabled=True)
+        cache.call(self.caller, self.location_urls, {"q": "CC"}, {"key": "k"}, enabled=True)
+        self.assertEqual(first, second)
+        self.assertEqual(len(self.calls), 2)
+        self.assertEqual(cache.stats()["hits"], 1)
+        self.assertEqual(cache.stats()["misses"], 2)
+
+    def test_start_charge_is_never_cached(self):
+        cache = response_cache.ResponseCache()
+        url_data = data_schemas.ChargeModStartChargeUrls.parse_obj({"base_url": "https://vendor"})
+        for _ in range(2):
+            cache.call(self.caller, url_data, {"station_id": "1"}, {"key": "k"}, enabled=True)
+        self.assertEqual(len(self.calls), 2)
+        self.assertEqual(cache.stats()["bypassed"], 2)
+
+    def test_least_recently_used_entry_is_evicted(self):
+        cache = response_cache.ResponseCache(max_entries=2)
+        for query in ("a", "b", "a", "c", "a"):
+            cache.call(self.caller, self.location_urls, {"q": query}, {}, enabled=True)
+        self.assertEqual(len(self.calls), 3)
+        self.assertEqual(cache.stats()["evictions"], 1)
+
+    def test_stale_entry_is_served_while_refreshing(self):
+        cache = response_cache.ResponseCache(stale_seconds=60)
+        key = ("vendor",)
+        cache.get_or_fetch(key, 0, lambda: self.caller(self.location_urls, {}, {}))
+        stale = cache.get_or_fetch(key, 0, lambda: self.caller(self.location_urls, {}, {}))
+        self.assertEqual(stale["data"], [1])
+        for _ in range(100):
+            if len(self.calls) == 2:
+                break
+            time.sleep(0.01)
+        self.assertEqual(len(self.calls), 2)
+        self.assertEqual(cache.stats()["stale_hits"], 1)
+
+
+    def test_streamed_location_is_cached(self):
+        message = {"vendor_id": "chargemod", "action": "location", "write": False, "cache": True,
+                   "params": {"q": "cached-stream"},
+                   "header": {"Accept": "application/json", "key": "k", "Authorization": "Bearer t"}}
+        with FakeChargeModServer(stations=5) as fake, \
+                mock.patch.object(lambda_function, "STREAMED_VERBS", frozenset({"stations"})):
+            results = [lambda_handler(dict(message, base_url=fake.base_url), {}) for _ in range(3)]
+        self.assertEqual(fake.requests["GET /stations"], 1)
+        self.assertEqual([len(result["data"]) for result in results], [5, 5, 5])
+        self.assertEqual(results[0]["data"], results[2]["data"])
+
+    def test_cached_location_survives_a_sync(self):
+        message = {"vendor_id": "chargemod", "action": "location", "write": True, "cache": True,
+                   "params": {"q": "cached-sync"},
+                   "header": {"Accept": "application/json", "key": "k", "Authorization": "Bearer t"}}
+        with FakeChargeModServer(stations=5) as fake:
+            os.environ["DB_API"] = fake.db_api_url
+            message["base_url"] = fake.base_url
+            first_sync = lambda_handler(dict(message), {})
+            read = lambda_handler(dict(message, write=False), {})
+            second_sync = lambda_handler(dict(message), {})
+        self.assertEqual(fake.requests["GET /stations"], 1)
+        self.assertEqual(first_sync["data"]["written"], 5)
+        self.assertEqual(len(read["data"]), 5)
+        self.assertEqual(second_sync["data"]["written"], 5)
+
+    def test_broken_stream_is_not_cached(self):
+        cache = response_cache.ResponseCache()
+        broken = lambda: {"status_code": HTTPStatus.OK, "message": "",
+                          "data": streaming_json.StreamingJsonObject([b'{"data": [1, 2'])["data"]}
+        result = cache.get_or_fetch(("vendor",), 30, broken)
+        self.assertEqual(result["status_code"], HTTPStatus.BAD_GATEWAY)
+        self.assertEqual(cache.stats()["entries"], 0)
+
+
+class FastValidationTestCase(unittest.TestCase):
+    cases = [
+        {"station_id": 113, "reference_transaction_id": 404112718119, "user_id": 12, "relay_switch_number": 111,
+         "max_energy_consumption": 10},
+        {"station_id": "1", "reference_transaction_id": 1.5, "user_id": True, "relay_switch_number": "2",
+         "name": None, "unknown": {"ignored": 1}},
+        {"station_id": "1", "reference_transaction_id": "2", "user_id": "3"},
+        {"station_id": None, "reference_transaction_id": "2", "user_id": "3", "relay_switch_number": "4"},
+        {"station_id": ["1"], "reference_transaction_id": "2", "user_id": "3", "relay_switch_number": "4"},
+        {"station_id": b"1", "reference_transaction_id": "2", "user_id": "3", "relay_switch_number": "4"},
+        "not a dict",
+    ]
+
+    def test_same_result_as_pydantic(self):
+        validator = fast_validation.compile_validator(data_schemas.ChargeModStartChargeParams)
+        self.assertTrue(validator.compiled)
+        for case in self.cases:
+            try:
+                expected = dict(data_schemas.ChargeModStartChargeParams.parse_obj(case))
+            except ValidationError as error:
+                with self.assertRaises(ValidationError) as raised:
+                    validator(case)
+                self.assertEqual(raised.exception.errors(), error.errors())
+            else:
+                self.assertEqual(validator(case), expected)
+
+    def test_models_with_non_str_fields_use_pydantic(self):
+        validator = fast_validation.compile_validator(data_schemas.ChargeModLocationsParams)
+        self.assertFalse(validator.compiled)
+        self.assertEqual(validator({"q": "BB", "device_status": "healthy"}),
+                         dict(data_schemas.ChargeModLocationsParams.parse_obj({"q": "BB",
+                                                                                "device_status": "healthy"})))
+
+    def test_url_data_matches_parsed_model(self):
+        for url_model in (data_schemas.ChargeModStartChargeUrls, data_schemas.ChargeModChargingActivityUrls):
+            self.assertEqual(fast_validation.construct_url_data(url_model, "https://apitest.chargemod.com"),
+                             url_model.parse_obj({"base_url": "https://apitest.chargemod.com"}))
+
+
+class BulkMappingTestCase(unittest.TestCase):
+    def stations(self):
+        stations = synthetic_stations(10) + [copy.deepcopy(MyTestCase.charge_mod_data1)]
+        stations[1]["latitude"] = "8.5"
+        stations[2]["longitude"] = 77
+        stations[3]["zip"] = 411014
+        stations[4]["image"] = None
+        return stations
+
+    def test_same_json_as_the_model(self):
+        mapper = bulk_mapping.BulkStationMapper()
+        for station in self.stations():
+            self.assertEqual(mapper(copy.deepcopy(station)).json(),
+                             map_chargemod_to_electrolite_structure(copy.deepcopy(station)).json())
+        self.assertEqual(mapper.slow_path, 0)
+
+    def test_invalid_station_raises_like_the_model(self):
+        station = synthetic_stations(1)[0]
+        station["device_status"] = "exploded"
+        with self.assertRaises(ValidationError):
+            bulk_mapping.BulkStationMapper().map_station(station)
+        failed = []
+        mapped = list(bulk_mapping.BulkStationMapper().map_stations([station] + synthetic_stations(2), failed))
+        self.assertEqual(len(mapped), 2)
+        self.assertEqual(failed, [1])
+
+    def test_compact_outputs(self):
+        mapped = list(bulk_mapping.BulkStationMapper().map_stations(synthetic_stations(3)))
+        lines = list(bulk_mapping.to_ndjson(mapped))
+        self.assertEqual([json.loads(line)["station_id"] for line in lines], ["1", "2", "3"])
+        columns = bulk_mapping.to_columns(mapped)
+        self.assertEqual(tuple(columns), bulk_mapping.STATION_FIELDS)
+        self.assertEqual(columns["station_id"], ["1", "2", "3"])
+
+
+class FakeChargeModTestCase(unittest.TestCase):
+    def message(self, base_url, action, params, write=False):
+        return {"vendor_id": "chargemod", "action": action, "write": write, "base_url": base_url,
+                "params": params,
+                "header": {"Accept": "application/json", "key": "k", "Authorization": "Bearer t"}}
+
+    def test_paginated_location_sync_is_written_to_db_api(self):
+        with FakeChargeModServer(stations=25, page_size=10) as fake:
+            os.environ["DB_API"] = fake.db_api_url
+            result = lambda_handler(self.message(fake.base_url, "location", {"q": "BB"}, write=True), {})
+        self.assertEqual(result["data"]["written"], 25)
+        self.assertEqual(fake.written_stations, 25)
+        self.assertEqual(fake.requests["GET /stations"], 3)
+        # stations arrive as objects, not json strings
+        self.assertEqual(fake.last_written_station["station_id"], "25")
+
+    def test_charging_actions_offline(self):
+        with FakeChargeModServer() as fake:
+            start = lambda_handler(self.message(fake.base_url, "start_charge",
+                                                {"station_id": 1, "reference_transaction_id": 1, "user_id": 1,
+                                                 "relay_switch_number": 1}), {})
+            activity = lambda_handler(self.message(fake.base_url, "activities", {"id": 7}), {})
+        self.assertEqual(start["status_code"], HTTPStatus.OK)
+        self.assertEqual(activity["data"]["id"], "7")
+
+    def test_vendor_errors(self):
+        with FakeChargeModServer(error_rate=1.0) as fake:
+            result = lambda_handler(self.message(fake.base_url, "stop_charge", {"reference_transaction_id": 1}), {})
+        self.assertEqual(result["status_code"], HTTPStatus.SERVICE_UNAVAILABLE)
+
+
+class MetricsTestCase(unittest.TestCase):
+    def test_invocation_emits_stage_spans_and_counters(self):
+        stream = io.StringIO()
+        with FakeChargeModServer(stations=5) as fake:
+            os.environ["DB_API"] = fake.db_api_url
+            message = {"vendor_id": "chargemod", "action": "location", "write": True, "base_url": fake.base_url,
+                       "params": {"q": "BB"},
+                       "header": {"Accept": "application/json", "key": "k", "Authorization": "Bearer t"}}
+            lambda_handler(message, {})
+        state = metrics.snapshot()
+        for stage in ("validation", "url_build", "vendor_round_trip", "json_decode", "mapping", "db_write"):
+            self.assertIn(stage, state["spans"])
+        self.assertEqual(state["spans"]["mapping"]["count"], 5)
+        self.assertEqual(state["counters"], {("chargemod", "location", 200): 1})
+
+        metrics.flush({"requests": 2}, stream=stream)
+        records = [json.loads(line) for line in stream.getvalue().splitlines()]
+        self.assertEqual(records[0]["_aws"]["CloudWatchMetrics"][0]["Namespace"], metrics.METRICS_NAMESPACE)
+        self.assertIn("vendor_round_trip", records[0])
+        self.assertEqual(records[0]["requests"], 2)
+        self.assertEqual(records[1]["action"], "location")
+        self.assertEqual(records[1]["requests"], 1)
+
+    def test_credentials_are_redacted(self):
+        logged = str(metrics.Redacted({"params": {"q": "BB"},
+                                       "header": {"key": "secret", "Authorization": "Bearer secret"}}))
+        self.assertNotIn("secret", logged)
+        self.assertIn("BB", logged)
+        command = json.dumps({"vendor_id": "nobody", "action": "none", "params": {"q": "BB"},
+                              "header": {"key": "secret", "Authorization": "Bearer secret"}})
+        logged = str(metrics.Redacted({"Records": [{"Sns": {"Message": command}}]}))
+        self.assertNotIn("secret", logged)
+        self.assertIn("BB", logged)
+        with self.assertLogs(level="WARNING") as logs:
+            self.assertIsNone(action_registry.dispatch(json.loads(command)))
+        self.assertNotIn("secret", "".join(logs.output))
+
+
+class ResilienceTestCase(unittest.TestCase):
+    header = {"Accept": "application/json", "key": "k", "Authorization": "Bearer t"}
+
+    def setUp(self) -> None:
+        patcher = mock.patch.multiple(resilience, RETRY_BASE_DELAY=0.001, RETRY_MAX_DELAY=0.002)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def message(self, base_url, action, params):
+        return {"vendor_id": "chargemod", "action": action, "write": False, "base_url": base_url,
+                "params": params, "header": self.header}
+
+    def test_only_gets_are_retried(self):
+        with FakeChargeModServer(error_rate=1.0) as fake:
+            lambda_handler(self.message(fake.base_url, "activities", {"id": 1}), {})
+            lambda_handler(self.message(fake.base_url, "stop_charge", {"reference_transaction_id": 1}), {})
+        self.assertEqual(fake.requests["GET /charging/activities/{id}"], resilience.RETRY_MAX_ATTEMPTS)
+        self.assertEqual(fake.requests["POST /charging/stop"], 1)
+
+    def test_read_timeout(self):
+        with mock.patch.dict(resilience.ACTION_READ_TIMEOUTS, {"charging/start": 0.05}), \
+                FakeChargeModServer(latency=0.5) as fake:
+            result = lambda_handler(self.message(fake.base_url, "start_charge",
+                                                 {"station_id": 1, "reference_transaction_id": "timeout-1",
+                                                  "user_id": 1, "relay_switch_number": 1}), {})
+        self.assertEqual(result["status_code"], HTTPStatus.INTERNAL_SERVER_ERROR)
+        self.assertEqual(fake.requests["POST /charging/start"], 1)
+
+    def test_first_attempt_gets_the_full_read_timeout(self):
+        url = "https://slow-stations-vendor/stations"
+        responses = [mock.Mock(status_code=503), mock.Mock(status_code=200)]
+        with mock.patch.object(connection_pool, "send_request", side_effect=responses) as send:
+            resilience.send_request("GET", url, timeout=resilience.timeout_for("stations"))
+        timeouts = [call.kwargs["timeout"] for call in send.call_args_list]
+        self.assertEqual(timeouts[0], resilience.timeout_for("stations"))
+        self.assertEqual(timeouts[0][1], resilience.ACTION_READ_TIMEOUTS["stations"])
+        self.assertLessEqual(timeouts[1][1], resilience.RETRY_BUDGET_SECONDS)
+
+    def test_open_circuit_fails_fast(self):
+        with FakeChargeModServer(error_rate=1.0) as fake:
+            for _ in range(resilience.CIRCUIT_FAILURE_THRESHOLD):
+                lambda_handler(self.message(fake.base_url, "stop_charge", {"reference_transaction_id": 1}), {})
+            result = lambda_handler(self.message(fake.base_url, "stop_charge", {"reference_transaction_id": 1}), {})
+        self.assertEqual(result["status_code"], HTTPStatus.SERVICE_UNAVAILABLE)
+        self.assertEqual(result["data"], {})
+        self.assertEqual(fake.requests["POST /charging/stop"], resilience.CIRCUIT_FAILURE_THRESHOLD)
+
+    def test_half_open_circuit_closes_after_success(self):
+        breaker = resilience.CircuitBreaker(failure_threshold=1, reset_seconds=0)
+        breaker.record_failure()
+        self.assertEqual(breaker.state, breaker.OPEN)
+        breaker.before_call()
+        self.assertEqual(breaker.state, breaker.HALF_OPEN)
+        with self.assertRaises(resilience.CircuitOpenError):
+            breaker.before_call()
+        breaker.record_success()
+        self.assertEqual(breaker.state, breaker.CLOSED)
+
+    def test_failed_trial_call_reopens_the_circuit(self):
+        url = "https://redirecting-vendor"
+        breaker = resilience.circuit_breaker(url)
+        breaker.state, breaker.opened_at = breaker.OPEN, time.monotonic() - breaker.reset_seconds
+        with mock.patch.object(connection_pool, "send_request", side_effect=requests.TooManyRedirects()):
+            with self.assertRaises(requests.TooManyRedirects):
+                resilience.send_request("GET", url, timeout=(1, 1))
+        self.assertEqual(breaker.state, breaker.OPEN)
+        breaker.opened_at = time.monotonic() - breaker.reset_seconds
+        with mock.patch.object(connection_pool, "send_request", return_value=mock.Mock(status_code=200)):
+            resilience.send_request("GET", url, timeout=(1, 1))
+        self.assertEqual(breaker.state, breaker.CLOSED)
+
+
+class SingleFlightTestCase(unittest.TestCase):
+    def run_concurrently(self, flight, key, function, callers=8):
+        results = []
+        barrier = threading.Barrier(callers)
+
+        def call():
+            barrier.wait()
+            results.append(flight.do(key, function))
+
+        threads = [threading.Thread(target=call) for _ in range(callers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results
+
+    def slow_call(self, calls):
+        def function():
+            calls.append(1)
+            time.sleep(0.2)
+            return {"status_code": HTTPStatus.OK, "data": [1]}
+        return function
+
+    def test_identical_calls_share_one_upstream_call(self):
+        calls = []
+        flight = single_flight.SingleFlight()
+        results = self.run_concurrently(flight, ("location", ("q", "BB")), self.slow_call(calls))
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(len(results), 8)
+        self.assertEqual(flight.stats()["coalesced"], 7)
+
+    def test_store_coalesces_across_processes(self):
+        calls = []
+        store = single_flight.InMemorySingleFlightStore()
+        # two flights stand for two lambda containers sharing the store
+        flights = [single_flight.SingleFlight(store), single_flight.SingleFlight(store)]
+        barrier = threading.Barrier(2)
+        results = []
+
+        def call(flight):
+            barrier.wait()
+            results.append(flight.do("key", self.slow_call(calls)))
+
+        threads = [threading.Thread(target=call, args=(flight,)) for flight in flights]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results[0], results[1])
+
+    def test_identical_location_writes_are_written_once(self):
+        with FakeChargeModServer(stations=10, latency=0.2) as fake:
+            os.environ["DB_API"] = fake.db_api_url
+            message = {"vendor_id": "chargemod", "action": "location", "write": True, "base_url": fake.base_url,
+                       "params": {"q": "BB"},
+                       "header": {"Accept": "application/json", "key": "k", "Authorization": "Bearer t"}}
+            event = {"Records": [{"Sns": {"MessageId": str(i), "Message": json.dumps(message)}} for i in range(4)]}
+            result = lambda_handler(event, {})
+        self.assertEqual(result["failed_records"], [])
+        self.assertEqual(fake.requests["GET /stations"], 1)
+        self.assertEqual(fake.written_stations, 10)
+
+
+class IdempotencyTestCase(unittest.TestCase):
+    def vendor_call(self, calls, status_code=HTTPStatus.OK):
+        def function():
+            calls.append(1)
+            time.sleep(0.1)
+            return {"status_code": status_code, "message": "ok", "data": {"transaction_id": len(calls)}}
+        return function
+
+    def check_store(self, store):
+        calls = []
+        guard = idempotency.IdempotencyGuard(store)
+        first = guard.run("chargemod:start_charge:1", self.vendor_call(calls))
+        duplicate = guard.run("chargemod:start_charge:1", self.vendor_call(calls))
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(duplicate, first)
+        self.assertIsInstance(duplicate["status_code"], HTTPStatus)
+        self.assertEqual(guard.stats(), {"executed": 1, "duplicates": 1})
+
+        refused = guard.run("chargemod:start_charge:2", self.vendor_call(calls, HTTPStatus.SERVICE_UNAVAILABLE))
+        self.assertEqual(refused["status_code"], HTTPStatus.SERVICE_UNAVAILABLE)
+        guard.run("chargemod:start_charge:2", self.vendor_call(calls))
+        self.assertEqual(len(calls), 3)
+
+    def test_in_memory_store(self):
+        self.check_store(idempotency.InMemoryIdempotencyStore())
+
+    def test_sqlite_store(self):
+        with tempfile.TemporaryDirectory() as directory:
+            self.check_store(idempotency.SqliteIdempotencyStore(os.path.join(directory, "idempotency.db")))
+
+    def test_concurrent_duplicates_collapse(self):
+        calls = []
+        guard = idempotency.IdempotencyGuard(idempotency.InMemoryIdempotencyStore())
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(guard.run("key", self.vendor_call(calls))))
+                   for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(len({result["data"]["transaction_id"] for result in results}), 1)
+
+    def test_redelivered_start_charge_calls_the_vendor_once(self):
+        with FakeChargeModServer() as fake:
+            message = {"vendor_id": "chargemod", "action": "start_charge", "write": False,
+                       "base_url": fake.base_url,
+                       "params": {"station_id": 1, "reference_transaction_id": "redelivered-1", "user_id": 1,
+                                  "relay_switch_number": 1},
+                       "header": {"Accept": "application/json", "key": "k", "Authorization": "Bearer t"}}
+            first = lambda_handler(message, {})
+            second = lambda_handler({"Records": [{"Sns": {"Message": json.dumps(message)}}]}, {})
+        self.assertEqual(fake.requests["POST /charging/start"], 1)
+        self.assertEqual(first, second)
+
+
+class StationIndexTestCase(unittest.TestCase):
+    @staticmethod
+    def record(station_id, latitude, longitude, station_status="healthy", available_connectors=1):
+        return {"station_id": str(station_id), "name": f"Station {station_id}", "latitude": latitude,
+                "longitude": longitude, "station_status": station_status,
+                "available_connectors": available_connectors}
+
+    def test_nearest_and_radius_match_a_full_scan(self):
+        generator = random.Random(7)
+        index = station_index.StationIndex(cell_degrees=0.05)
+        records = [self.record(station_id, 18 + generator.random(), 73 + generator.random(),
+                               available_connectors=station_id % 3) for station_id in range(500)]
+        for record in records:
+            index.upsert(record)
+        for _ in range(20):
+            latitude, longitude = 18 + generator.random(), 73 + generator.random()
+            by_distance = sorted(records, key=lambda record: station_index.haversine_km(
+                latitude, longitude, record["latitude"], record["longitude"]))
+            nearest = index.nearest(latitude, longitude, 5)
+            self.assertEqual([record["station_id"] for record in nearest],
+                             [record["station_id"] for record in by_distance[:5]])
+            within = index.within_radius(latitude, longitude, 8, available_only=True)
+            expected = [record["station_id"] for record in by_distance if record["available_connectors"] and
+                        station_index.haversine_km(latitude, longitude, record["latitude"],
+                                                   record["longitude"]) <= 8]
+            self.assertEqual([record["station_id"] for record in within], expected)
+
+    def test_updates_filters_and_snapshot(self):
+        index = station_index.StationIndex()
+        index.upsert(self.record(1, 18.5, 73.8))
+        index.upsert(self.record(2, 18.51, 73.8, station_status="power_failed"))
+        index.upsert(self.record(1, 19.5, 73.8))
+        self.assertEqual([record["station_id"] for record in index.within_radius(18.5, 73.8, 5)], ["2"])
+        self.assertEqual(index.nearest(18.5, 73.8, 1, station_status="healthy")[0]["station_id"], "1")
+        index.remove("2")
+        self.assertEqual(index.within_radius(18.5, 73.8, 5), [])
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "index.json")
+            index.save(path)
+            loaded = station_index.StationIndex.load(path)
+        self.assertEqual(len(loaded), 1)
+        self.assertEqual(loaded.nearest(18.5, 73.8, 1), index.nearest(18.5, 73.8, 1))
+
+    def test_sync_feeds_the_index(self):
+        for mapper in (map_chargemod_to_electrolite_structure, bulk_mapping.station_mapper):
+            index = station_index.StationIndex()
+            stations = synthetic_stations(10)
+            location_sync.sync_stations(stations, "chargemod", mapper, writer=lambda chunk: True,
+                                        station_index=index)
+            self.assertEqual(len(index), 10)
+            nearest = index.nearest(stations[0]["latitude"], stations[0]["longitude"], 1)[0]
+            self.assertEqual(nearest["station_id"], "1")
+            self.assertEqual(nearest["station_status"], "healthy")
+            # two chargers with one available connector each
+            self.assertEqual(nearest["available_connectors"], 2)
+
+    def test_nearby_action_is_served_from_the_index(self):
+        index = station_index.StationIndex()
+        index.upsert(self.record(1, 18.5, 73.8))
+        with mock.patch.object(station_index, "station_index", index):
+            result = lambda_handler({"vendor_id": "chargemod", "action": "nearby",
+                                     "params": {"latitude": 18.5001, "longitude": 73.8, "k": 3}}, {})
+        self.assertEqual(result["status_code"], HTTPStatus.OK)
+        self.assertEqual([station["station_id"] for station in result["data"]], ["1"])
+
+
+class ActivityPollerTestCase(unittest.TestCase):
+    def setUp(self) -> None:
+        self.now = 0.0
+        self.statuses = {}
+        self.fetched = []
+        self.poller = activity_poller.ActivityPoller(self.fetch, max_workers=4, min_interval=5, max_interval=40,
+                                                     backoff=2, clock=lambda: self.now)
+
+    def fetch(self, session_id, context):
+        self.fetched.append(session_id)
+        status = self.statuses.get(session_id, "charging")
+        if status is None:
+            return {"status_code": HTTPStatus.SERVICE_UNAVAILABLE, "message": "down", "data": {}}
+        return {"status_code": HTTPStatus.OK, "data": {"id": session_id, "status": status}}
+
+    def poll_at(self, now):
+        self.now = now
+        self.fetched = []
+        return self.poller.poll_once()
+
+    def test_only_transitions_are_emitted_and_intervals_adapt(self):
+        self.poller.track(["1", "2"])
+        self.assertEqual(len(self.poll_at(0)), 2)
+        # unchanged sessions back off 5, 10, 20 seconds
+        self.assertEqual(self.poll_at(5), [])
+        self.assertEqual(sorted(self.fetched), ["1", "2"])
+        self.assertEqual(self.poll_at(10), [])
+        self.assertEqual(self.fetched, [])
+        self.statuses["1"] = "suspended"
+        transitions = self.poll_at(15)
+        self.assertEqual([(transition["id"], transition["previous"]["status"], transition["current"]["status"])
+                          for transition in transitions], [("1", "charging", "suspended")])
+        # the changed session is polled soon again, the quiet one keeps its longer interval
+        self.poll_at(20)
+        self.assertEqual(self.fetched, ["1"])
+
+    def test_terminal_sessions_stop_being_polled_and_errors_are_not_transitions(self):
+        self.poller.track(["1", "2"])
+        self.poll_at(0)
+        self.statuses["1"] = "completed"
+        self.statuses["2"] = None
+        transitions = self.poll_at(5)
+        self.assertEqual([(transition["id"], transition["terminal"]) for transition in transitions], [("1", True)])
+        self.assertEqual(len(self.poller), 1)
+        self.assertEqual(self.poller.stats()["errors"], 1)
+
+    def test_polls_run_on_a_bounded_pool(self):
+        active = []
+        peak = []
+        lock = threading.Lock()
+
+        def slow_fetch(session_id, context):
+            with lock:
+                active.append(session_id)
+                peak.append(len(active))
+            time.sleep(0.02)
+            with lock:
+                active.remove(session_id)
+            return {"status_code": HTTPStatus.OK, "data": {"status": "charging"}}
+
+        poller = activity_poller.ActivityPoller(slow_fetch, max_workers=3)
+        poller.track(range(12))
+        self.assertEqual(len(poller.poll_once()), 12)
+        poller.close()
+        self.assertEqual(max(peak), 3)
+
+    def test_concurrent_rounds_poll_a_session_once(self):
+        started = threading.Barrier(2, timeout=5)
+        fetched = []
+
+        def slow_fetch(session_id, context):
+            fetched.append(session_id)
+            if session_id == "a":
+                # the second round starts while this session is being fetched
+                started.wait()
+            time.sleep(0.05)
+            return {"status_code": HTTPStatus.OK, "data": {"status": "charging"}}
+
+        poller = activity_poller.ActivityPoller(slow_fetch, max_workers=2)
+        poller.track(["a"])
+        rounds = []
+        first = threading.Thread(target=lambda: rounds.append(poller.poll_once()))
+        first.start()
+        poller.track(["b"])
+        started.wait()
+        rounds.append(poller.poll_once())
+        first.join()
+        poller.close()
+        self.assertEqual(sorted(fetched), ["a", "b"])
+        self.assertEqual(sorted(transition["id"] for transitions in rounds for transition in transitions), ["a", "b"])
+
+    def test_poll_activities_action(self):
+        with FakeChargeModServer() as fake:
+            message = {"vendor_id": "chargemod", "action": "poll_activities", "base_url": fake.base_url,
+                       "header": {"Accept": "application/json", "key": "k", "Authorization": "Bearer t"},
+                       "params": {"ids": ["poll-1", "poll-2"]}}
+            first = lambda_handler(message, {})
+            fake.activity_statuses["poll-1"] = "completed"
+            handler = action_registry.get("chargemod", "poll_activities")
+            for session in handler.poller._sessions.values():
+                session.next_poll_at = 0
+            second = lambda_handler(dict(message, params={}), {})
+        self.assertEqual(len(first["data"]["transitions"]), 2)
+        self.assertEqual([transition["id"] for transition in second["data"]["transitions"]], ["poll-1"])
+        self.assertEqual(second["data"]["tracked"], 1)
+        self.assertEqual(fake.requests["GET /charging/activities/{id}"], 4)
+
+
+class JsonCodecTestCase(unittest.TestCase):
+    def tearDown(self) -> None:
+        json_codec.use(json_codec.JSON_CODEC)
+
+    def test_backends_encode_stations_alike(self):
+        station = synthetic_stations(1)[0]
+        encoded = {}
+        for backend in ("stdlib", "orjson"):
+            if json_codec.use(backend).name != backend:
+                continue
+            encoded[backend] = map_chargemod_to_electrolite_structure(copy.deepcopy(station)).json()
+            self.assertEqual(encoded[backend], bulk_mapping.serialize_station(
+                bulk_mapping.BulkStationMapper().map_station(copy.deepcopy(station))))
+            self.assertEqual(json_codec.loads(json_codec.dumps({"big": 2 ** 70})), {"big": 2 ** 70})
+        decoded = {json.dumps(json_codec.loads(value), sort_keys=True) for value in encoded.values()}
+        self.assertEqual(len(decoded), 1)
+
+    def test_serialized_items_are_embedded_once(self):
+        items = [json_codec.dumps({"station_id": str(station_id)}) for station_id in range(3)]
+        body = json_codec.object_with_raw_array({"write_vendor_data_to_location_table": True}, "data_to_write",
+                                                items)
+        self.assertEqual(json.loads(body), {"write_vendor_data_to_location_table": True,
+                                            "data_to_write": [{"station_id": "0"}, {"station_id": "1"},
+                                                              {"station_id": "2"}]})
+        self.assertEqual(json.loads(json_codec.object_with_raw_array({}, "data", [])), {"data": []})
+
+
+class CompressionTestCase(unittest.TestCase):
+    @staticmethod
+    def response(body: bytes, content_encoding: str = None):
+        response = requests.Response()
+        response.headers = requests.structures.CaseInsensitiveDict(
+            {"Content-Encoding": content_encoding} if content_encoding else {})
+        response.raw = urllib3.HTTPResponse(body=io.BytesIO(body), headers=response.headers, preload_content=False)
+        return response
+
+    def test_bodies_are_decompressed_in_bounded_steps(self):
+        body = json.dumps(synthetic_stations(50)).encode()
+        raw_deflate = zlib.compressobj(wbits=-zlib.MAX_WBITS)
+        encodings = {"gzip": gzip.compress(body), "deflate": zlib.compress(body),
+                     None: body}
+        for content_encoding, encoded in encodings.items():
+            chunks = list(compression.iter_body(self.response(encoded, content_encoding), chunk_bytes=4096))
+            self.assertEqual(b"".join(chunks), body)
+            self.assertLessEqual(max(len(chunk) for chunk in chunks), 4096)
+        raw = raw_deflate.compress(body) + raw_deflate.flush()
+        self.assertEqual(compression.read_body(self.response(raw, "deflate")), body)
+        with self.assertRaises(compression.BodyTooLargeError):
+            compression.read_body(self.response(gzip.compress(b"0" * 100000), "gzip"), max_bytes=1000)
+
+    def test_vendor_and_db_api_traffic_is_compressed(self):
+        compression.reset_invocation_metrics()
+        with FakeChargeModServer(stations=30) as fake, \
+                mock.patch.multiple(compression, DB_API_COMPRESSION="gzip", DB_API_COMPRESSION_MIN_BYTES=1024):
+            os.environ["DB_API"] = fake.db_api_url
+            result = lambda_handler({"vendor_id": "chargemod", "action": "location", "write": True,
+                                     "base_url": fake.base_url, "params": {"q": "gzip"},
+                                     "header": {"Accept": "application/json", "key": "k",
+                                                "Authorization": "Bearer t"}}, {})
+        transfer = compression.get_invocation_metrics()
+        self.assertEqual(result["data"]["written"], 30)
+        self.assertEqual(fake.written_stations, 30)
+        self.assertEqual(fake.compressed_requests, 1)
+        self.assertLess(transfer["response_wire_bytes"] * 5, transfer["response_bytes"])
+        self.assertLess(transfer["request_wire_bytes"] * 5, transfer["request_bytes"])
+        self.assertGreater(transfer["bytes_saved"], 0)
+
+    def test_small_bodies_are_sent_as_they_are(self):
+        body, headers = compression.compress_body(b"{}", {"Content-Type": "application/json"}, encoding="gzip")
+        self.assertEqual(body, b"{}")
+        self.assertNotIn("Content-Encoding", headers)
+
+
+class WriteSinkTestCase(unittest.TestCase):
+    def setUp(self) -> None:
+        patcher = mock.patch.multiple(write_sinks, DYNAMODB_WRITE_BASE_DELAY=0.001, DYNAMODB_WRITE_MAX_DELAY=0.002)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_dynamodb_sink_writes_batches_of_25_and_retries_unprocessed_items(self):
+        client = write_sinks.StubDynamoDbClient(unprocessed_attempts=3)
+        sink = write_sinks.DynamoDbSink("stations", client=client, max_workers=3)
+        chunk = [map_chargemod_to_electrolite_structure(station).json() for station in synthetic_stations(60)]
+        self.assertTrue(sink(chunk + chunk[:5]))
+        self.assertEqual(sink.stats()["batches"], 3)
+        self.assertEqual(sink.stats()["retries"], 3)
+        table = client.tables["stations"]
+        self.assertEqual(len(table), 60)
+        self.assertEqual(table[("1", "chargemod")]["latitude"], {"N": "18.5001"})
+
+    def test_sink_gives_up_after_max_attempts(self):
+        sink = write_sinks.DynamoDbSink("stations", client=write_sinks.StubDynamoDbClient(unprocessed_attempts=10),
+                                        max_attempts=2)
+        chunk = [map_chargemod_to_electrolite_structure(station).json() for station in synthetic_stations(4)]
+        self.assertFalse(sink(chunk))
+
+    def test_location_sync_writes_to_the_configured_sink(self):
+        sink = write_sinks.sink_from_env("stub")
+        with FakeChargeModServer(stations=30) as fake, mock.patch.object(write_sinks, "location_sink", sink):
+            os.environ["DB_API"] = fake.db_api_url
+            result = lambda_handler({"vendor_id": "chargemod", "action": "location", "write": True,
+                                     "base_url": fake.base_url, "params": {"q": "sink"},
+                                     "header": {"Accept": "application/json", "key": "k",
+                                                "Authorization": "Bearer t"}}, {})
+        self.assertEqual(result["data"]["written"], 30)
+        self.assertEqual(fake.db_writes, 0)
+        self.assertEqual(len(sink._client.tables["stations"]), 30)
+
+
+def iter_failing(items):
+    for item in items:
+        if isinstance(item, Exception):
+            raise item
+        yield item
+
+
+class StreamingJsonTestCase(unittest.TestCase):
+    @staticmethod
+    def chunks(value, size: int):
+        body = json.dumps(value, ensure_ascii=False).encode()
+        return [body[start:start + size] for start in range(0, len(body), size)]
+
+    def test_streamed_stations_match_a_full_parse(self):
+        stations = synthetic_stations(20)
+        stations[3]["name"] = "Stätion ⚡ 3"
+        for body in ({"success": True, "message": "Stations", "data": stations},
+                     {"success": True, "message": "Stations",
+                      "data": {"current_page": 1, "data": stations, "last_page": 2.0}}):
+            for size in (1, 7, 4096):
+                parsed = streaming_json.StreamingJsonObject(self.chunks(body, size))
+                self.assertTrue(parsed["success"])
+                data = parsed["data"]
+                if isinstance(body["data"], dict):
+                    self.assertEqual(list(data["data"]), stations)
+                    self.assertEqual(data["last_page"], 2.0)
+                else:
+                    self.assertEqual(list(data), stations)
+
+    def test_keys_after_the_array_buffer_it(self):
+        body = {"data": [{"id": 1}, {"id": 2}, {"id": 3}], "success": False, "message": "late"}
+        parsed = streaming_json.StreamingJsonObject(self.chunks(body, 5))
+        data = parsed["data"]
+        self.assertEqual(next(data), {"id": 1})
+        self.assertEqual(parsed["message"], "late")
+        self.assertEqual(list(data), [{"id": 2}, {"id": 3}])
+        self.assertEqual(dict(parsed)["success"], False)
+
+    def test_broken_bodies(self):
+        truncated = self.chunks({"success": True, "message": "", "data": synthetic_stations(3)}, 64)[:-2]
+        stations = streaming_json.StreamingJsonObject(truncated)["data"]
+        with self.assertRaises(streaming_json.StreamingJsonError):
+            list(stations)
+        with self.assertRaises(streaming_json.StreamingJsonError):
+            streaming_json.StreamingJsonObject([b"<html>busy</html>"])
+
+    def test_connection_dropped_mid_body(self):
+        with FakeChargeModServer(stations=200, gzip_responses=False) as fake:
+            fake.truncate_stations = True
+            os.environ["DB_API"] = fake.db_api_url
+            for write in (False, True):
+                result = lambda_handler({"vendor_id": "chargemod", "action": "location", "write": write,
+                                         "base_url": fake.base_url, "params": {"q": f"truncated-{write}"},
+                                         "header": {"Accept": "application/json", "key": "k",
+                                                    "Authorization": "Bearer t"}}, {})
+                self.assertEqual(result["status_code"], HTTPStatus.BAD_GATEWAY)
+        with self.assertRaises(streaming_json.StreamingJsonError):
+            list(streaming_json.StreamingJsonObject(iter_failing([b'{"data": [1, 2', zlib.error("bad")]))["data"])
+
+    def test_streamed_sync_peaks_far_below_a_full_parse(self):
+        peaks = {}
+        with FakeChargeModServer(stations=1000, chargers=4) as fake:
+            os.environ["DB_API"] = fake.db_api_url
+            requests.get(fake.base_url + "/stations", headers={"Accept-Encoding": "gzip"})
+            for streamed_verbs in (frozenset({"stations"}), frozenset()):
+                with mock.patch.object(lambda_function, "STREAMED_VERBS", streamed_verbs):
+                    tracemalloc.start()
+                    try:
+                        result = lambda_handler({"vendor_id": "chargemod", "action": "location", "write": True,
+                                                 "base_url": fake.base_url, "params": {"q": str(streamed_verbs)},
+                                                 "header": {"Accept": "application/json", "key": "k",
+                                                            "Authorization": "Bearer t"}}, {})
+                        peaks[streamed_verbs] = tracemalloc.get_traced_memory()[1]
+                    finally:
+                        tracemalloc.stop()
+                self.assertEqual(result["data"]["written"], 1000)
+        self.assertLess(peaks[frozenset({"stations"})] * 3, peaks[frozenset()])
+
+
+class WorkerTestCase(unittest.TestCase):
+    @staticmethod
+    def command(key="k", action="start_charge", **params):
+        return json.dumps({"vendor_id": "chargemod", "action": action, "params": params,
+                           "header": {"Accept": "application/json", "key": key, "Authorization": "Bearer t"}})
+
+    def test_token_bucket(self):
+        now = [0.0]
+        bucket = worker.TokenBucket(rate=2, burst=2, clock=lambda: now[0])
+        self.assertEqual([bucket.reserve() for _ in range(4)], [0.0, 0.0, 0.5, 1.0])
+        now[0] = 10
+        self.assertEqual(bucket.reserve(), 0.0)
+
+    def test_commands_are_rate_limited_per_key_and_bounded(self):
+        queue = command_queue.InMemoryCommandQueue()
+        for index in range(10):
+            queue.send(self.command("slow", index=index))
+            queue.send(self.command("fast", index=index))
+        finished = {}
+        running = []
+        peak = []
+        lock = threading.Lock()
+
+        def process(message):
+            with lock:
+                running.append(1)
+                peak.append(len(running))
+            time.sleep(0.01)
+            with lock:
+                running.pop()
+                finished[(message["header"]["key"], message["params"]["index"])] = time.monotonic()
+            return {"status_code": HTTPStatus.OK}
+
+        command_worker = worker.Worker(queue, process, concurrency=4,
+                                       rate_limiter=worker.KeyRateLimiter(rate=20, burst=1))
+        start = time.monotonic()
+        with mock.patch.object(worker, "WORKER_RECEIVE_WAIT_SECONDS", 0.05):
+            asyncio.run(command_worker.run(stop_when_empty=True))
+        self.assertEqual(len(finished), 20)
+        self.assertEqual(len(queue), 0)
+        self.assertLessEqual(max(peak), 4)
+        # 10 commands at 20 per second on one key take at least 9 intervals
+        self.assertGreaterEqual(finished[("slow", 9)] - start, 0.4)
+
+    def test_server_failures_are_retried_then_dropped(self):
+        queue = command_queue.InMemoryCommandQueue()
+        queue.send(self.command(action="activities", index=1))
+        queue.send(self.command(action="activities", index=2))
+        queue.send(self.command(index=3))
+        queue.send("not json")
+        queue.send(json.dumps({"vendor_id": "nobody", "action": "start_charge", "params": {}, "header": {}}))
+        attempts = {}
+
+        def process(message):
+            if message["vendor_id"] == "nobody":
+                attempts["unknown"] = attempts.get("unknown", 0) + 1
+                return None
+            index = message["params"]["index"]
+            attempts[index] = attempts.get(index, 0) + 1
+            if index == 3 or index == 1 and attempts[index] < 2:
+                return {"status_code": HTTPStatus.SERVICE_UNAVAILABLE}
+            if index == 2:
+                raise RuntimeError("vendor down")
+            return {"status_code": HTTPStatus.OK}
+
+        command_worker = worker.Worker(queue, process, max_attempts=3)
+        with mock.patch.object(worker, "WORKER_RECEIVE_WAIT_SECONDS", 0.05):
+            asyncio.run(command_worker.run(stop_when_empty=True))
+        # the failed start_charge is not sent to the vendor a second time
+        self.assertEqual(attempts, {1: 2, 2: 3, 3: 1, "unknown": 1})
+        self.assertEqual(command_worker.stats()["dropped"], 4)
+        self.assertEqual(len(queue), 0)
+
+    def test_stop_drains_running_commands(self):
+        queue = command_queue.InMemoryCommandQueue()
+        for index in range(4):
+            queue.send(self.command(index=index))
+
+        def process(message):
+            time.sleep(0.2 if message["params"]["index"] < 3 else 2)
+            return {"status_code": HTTPStatus.OK}
+
+        command_worker = worker.Worker(queue, process, concurrency=4)
+
+        async def run_and_stop():
+            runner = asyncio.get_running_loop().create_task(command_worker.run())
+            await asyncio.sleep(0.1)
+            command_worker.request_stop()
+            await runner
+
+        with mock.patch.object(worker, "WORKER_DRAIN_SECONDS", 0.5):
+            asyncio.run(run_and_stop())
+        # three finished while draining, the slow one went back to the queue
+        self.assertEqual(command_worker.stats()["processed"], 3)
+        self.assertEqual([message.body for message in queue.receive(10, 0)], [self.command(index=3)])
+
+    def test_file_queue(self):
+        with tempfile.TemporaryDirectory() as directory:
+            queue = command_queue.FileCommandQueue(directory)
+            first = queue.send("first")
+            queue.send("second")
+            received = queue.receive(1, 0)
+            self.assertEqual([(message.body, message.attempts) for message in received], [("first", 1)])
+            queue.nack(first)
+            self.assertEqual([message.body for message in queue.receive(5, 0)], ["first", "second"])
+            restarted = command_queue.FileCommandQueue(directory)
+            restarted.recover()
+            messages = restarted.receive(5, 0)
+            self.assertEqual([(message.body, message.attempts) for message in messages], [("first", 3), ("second", 2)])
+            for message in messages:
+                restarted.ack(message.message_id)
+            self.assertEqual(restarted.receive(5, 0), [])
+
+    def test_worker_runs_vendor_commands(self):
+        queue = command_queue.InMemoryCommandQueue()
+        with FakeChargeModServer() as fake:
+            for index in range(5):
+                queue.send(json.dumps({"vendor_id": "chargemod", "action": "start_charge", "write": False,
+                                       "base_url": fake.base_url,
+                                       "params": {"station_id": 1, "reference_transaction_id": f"worker-{index}",
+                                                  "user_id": 1, "relay_switch_number": 1},
+                                       "header": {"Accept": "application/json", "key": "k",
+                                                  "Authorization": "Bearer t"}}))
+            results = []
+            command_worker = worker.Worker(queue, on_result=lambda queued, message, response: results.append(response))
+            with mock.patch.object(worker, "WORKER_RECEIVE_WAIT_SECONDS", 0.05):
+                asyncio.run(command_worker.run(stop_when_empty=True))
+        self.assertEqual([result["status_code"] for result in results], [HTTPStatus.OK] * 5)
+        self.assertEqual(fake.requests["POST /charging/start"], 5)
+
 
 if __name__ == '__main__':
     unittest.main()
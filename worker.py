@@ -0,0 +1,256 @@
+import os
+import time
+import signal
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
+import json_codec
+import metrics
+import connection_pool
+import compression
+import command_queue
+from lambda_function import parse_sns_message_process, action_registry
+
+'''
+Long running worker mode.
+Commands (the same messages the lambda gets from SNS) are taken from a queue and run through the same
+action registry on an asyncio loop, up to WORKER_CONCURRENCY at a time on a thread pool. Http sessions,
+caches and stores stay warm for the life of the process. Every ChargeModHeader.key has a token bucket
+so commands for one vendor account stay under its quota. On SIGTERM/SIGINT the worker stops receiving,
+lets running commands finish for up to WORKER_DRAIN_SECONDS and hands back whatever is left.
+Run with: python worker.py
+'''
+
+WORKER_CONCURRENCY = int(os.environ.get("WORKER_CONCURRENCY", 16))
+WORKER_RECEIVE_BATCH = int(os.environ.get("WORKER_RECEIVE_BATCH", 10))
+WORKER_RECEIVE_WAIT_SECONDS = float(os.environ.get("WORKER_RECEIVE_WAIT_SECONDS", 1))
+WORKER_MAX_ATTEMPTS = int(os.environ.get("WORKER_MAX_ATTEMPTS", 3))
+WORKER_DRAIN_SECONDS = float(os.environ.get("WORKER_DRAIN_SECONDS", 30))
+WORKER_METRICS_SECONDS = float(os.environ.get("WORKER_METRICS_SECONDS", 60))
+VENDOR_KEY_RATE_PER_SECOND = float(os.environ.get("VENDOR_KEY_RATE_PER_SECOND", 10))
+VENDOR_KEY_BURST = float(os.environ.get("VENDOR_KEY_BURST", 20))
+
+
+class TokenBucket:
+    """
+    Callers reserve a token and wait until it is theirs, so waiting callers are served in order
+    """
+
+    def __init__(self, rate: float, burst: float, clock=time.monotonic):
+        self.rate = rate
+        self.burst = burst
+        self.clock = clock
+        self.tokens = burst
+        self.updated_at = clock()
+
+    def reserve(self) -> float:
+        """
+        Takes a token and returns the seconds to wait before using it
+        """
+        now = self.clock()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+        self.tokens -= 1
+        return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+
+class KeyRateLimiter:
+    """
+    One token bucket per vendor api key, used from the event loop only
+    """
+
+    def __init__(self, rate: float = None, burst: float = None, clock=time.monotonic):
+        self.rate = rate or VENDOR_KEY_RATE_PER_SECOND
+        self.burst = burst or VENDOR_KEY_BURST
+        self.clock = clock
+        self.waited = 0.0
+        self._buckets = {}
+
+    async def acquire(self, key):
+        if key is None:
+            return
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = TokenBucket(self.rate, self.burst, self.clock)
+        delay = bucket.reserve()
+        if delay > 0:
+            self.waited += delay
+            await asyncio.sleep(delay)
+
+
+def rate_limit_key(message: dict):
+    header = message.get("header")
+    return header.get("key") if isinstance(header, dict) else None
+
+
+def is_failure(response) -> bool:
+    """
+    Server side failures are retried, answers like CONFLICT or BAD_REQUEST are final
+    """
+    return isinstance(response, dict) and response.get("status_code", HTTPStatus.OK) >= HTTPStatus.INTERNAL_SERVER_ERROR
+
+
+def is_retryable(message) -> bool:
+    return isinstance(message, dict) and action_registry.is_retryable(str(message.get("vendor_id")), str(message.get("action")))
+
+
+class Worker:
+    def __init__(self, queue: command_queue.CommandQueue, process=parse_sns_message_process, concurrency: int = None,
+                 rate_limiter: KeyRateLimiter = None, max_attempts: int = None, on_result=None,
+                 retryable=is_retryable):
+        self.queue = queue
+        self.process = process
+        self.concurrency = concurrency or WORKER_CONCURRENCY
+        self.rate_limiter = rate_limiter or KeyRateLimiter()
+        self.max_attempts = max_attempts or WORKER_MAX_ATTEMPTS
+        self.on_result = on_result
+        self.retryable = retryable
+        self.processed = 0
+        self.failed = 0
+        self.dropped = 0
+        self._executor = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="worker")
+        self._tasks = {}
+        self._abandoned = set()
+        self._stopping = None
+        if connection_pool.POOL_MAXSIZE < self.concurrency:
+            logging.warning(f"HTTP_POOL_MAXSIZE {connection_pool.POOL_MAXSIZE} is below WORKER_CONCURRENCY "
+                            f"{self.concurrency}, connections will be opened and closed under load")
+
+    def stats(self) -> dict:
+        return {"processed": self.processed, "failed": self.failed, "dropped": self.dropped,
+                "in_flight": len(self._tasks), "rate_limited_seconds": self.rate_limiter.waited}
+
+    def request_stop(self):
+        if self._stopping is not None:
+            self._stopping.set()
+
+    def _settle(self, queued: command_queue.QueuedMessage, failed: bool, retryable: bool):
+        if queued.message_id in self._abandoned:
+            # handed back during drain, another receive owns it now
+            return
+        if not failed:
+            self.queue.ack(queued.message_id)
+        elif not retryable:
+            # the vendor may have taken a start or stop that failed on the way back, never send it twice
+            logging.error(f"Dropping command {queued.message_id}, it failed and is not safe to retry")
+            self.dropped += 1
+            self.queue.ack(queued.message_id)
+        elif queued.attempts >= self.max_attempts:
+            logging.error(f"Dropping command {queued.message_id} after {queued.attempts} attempts")
+            self.dropped += 1
+            self.queue.ack(queued.message_id)
+        else:
+            self.queue.nack(queued.message_id)
+
+    async def _handle(self, queued: command_queue.QueuedMessage):
+        loop = asyncio.get_running_loop()
+        try:
+            message = json_codec.loads(queued.body)
+        except ValueError:
+            logging.exception(f"Dropping command {queued.message_id}, it is not json")
+            self.dropped += 1
+            await loop.run_in_executor(None, self.queue.ack, queued.message_id)
+            return
+        response = None
+        try:
+            await self.rate_limiter.acquire(rate_limit_key(message))
+            response = await loop.run_in_executor(self._executor, self.process, message)
+            failed = is_failure(response)
+        except Exception:
+            logging.exception(f"Command {queued.message_id} failed")
+            failed = True
+        else:
+            if response is None:
+                # no handler for this vendor and action, a retry cannot change that
+                logging.error(f"Dropping command {queued.message_id}, nothing handles it")
+                self.processed += 1
+                self.dropped += 1
+                await loop.run_in_executor(None, self.queue.ack, queued.message_id)
+                return
+        self.processed += 1
+        self.failed += int(failed)
+        if self.on_result is not None:
+            self.on_result(queued, message, response)
+        retryable = failed and self.retryable(message)
+        await loop.run_in_executor(None, self._settle, queued, failed, retryable)
+
+    def _start(self, queued: command_queue.QueuedMessage):
+        task = asyncio.get_running_loop().create_task(self._handle(queued))
+        self._tasks[queued.message_id] = (queued, task)
+        task.add_done_callback(lambda done: self._forget(queued.message_id, done))
+
+    def _forget(self, message_id: str, task):
+        # a nacked message can already be running again under the same id
+        if message_id in self._tasks and self._tasks[message_id][1] is task:
+            del self._tasks[message_id]
+
+    async def _flush_metrics(self):
+        while not self._stopping.is_set():
+            try:
+                await asyncio.wait_for(self._stopping.wait(), WORKER_METRICS_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+            metrics.flush({**connection_pool.get_invocation_metrics(), **compression.get_invocation_metrics(),
+                           **{f"worker_{name}": value for name, value in self.stats().items()}})
+            metrics.reset()
+            connection_pool.reset_invocation_metrics()
+            compression.reset_invocation_metrics()
+
+    async def run(self, stop_when_empty: bool = False):
+        """
+        Consumes until request_stop, or with stop_when_empty until the queue has nothing more to give
+        """
+        loop = asyncio.get_running_loop()
+        self._stopping = asyncio.Event()
+        metrics_task = loop.create_task(self._flush_metrics())
+        try:
+            while not self._stopping.is_set():
+                free = self.concurrency - len(self._tasks)
+                if free <= 0:
+                    # back pressure, only take what can be started
+                    await asyncio.wait([task for _, task in self._tasks.values()],
+                                       return_when=asyncio.FIRST_COMPLETED)
+                    continue
+                received = await loop.run_in_executor(None, self.queue.receive, min(free, WORKER_RECEIVE_BATCH),
+                                                      WORKER_RECEIVE_WAIT_SECONDS)
+                for queued in received:
+                    self._start(queued)
+                if stop_when_empty and not received and not self._tasks:
+                    break
+            await self.drain()
+        finally:
+            self._stopping.set()
+            await metrics_task
+            self._executor.shutdown(wait=False)
+
+    async def drain(self, timeout: float = None):
+        """
+        Waits for running commands, the ones still running after the timeout go back to the queue
+        """
+        timeout = WORKER_DRAIN_SECONDS if timeout is None else timeout
+        if self._tasks:
+            logging.info(f"Draining {len(self._tasks)} running commands")
+            await asyncio.wait([task for _, task in self._tasks.values()], timeout=timeout)
+        for message_id, (queued, task) in list(self._tasks.items()):
+            logging.warning(f"Command {message_id} did not finish in time, handing it back")
+            self._abandoned.add(message_id)
+            self.queue.nack(message_id)
+
+
+def main():
+    worker = Worker(command_queue.queue_from_env())
+
+    async def serve():
+        loop = asyncio.get_running_loop()
+        for stop_signal in (signal.SIGTERM, signal.SIGINT):
+            loop.add_signal_handler(stop_signal, worker.request_stop)
+        logging.info(f"Worker consuming with concurrency {worker.concurrency}")
+        await worker.run()
+        logging.info(f"Worker stopped {worker.stats()}")
+
+    asyncio.run(serve())
+
+
+if __name__ == '__main__':
+    main()
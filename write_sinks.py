@@ -0,0 +1,154 @@
+import os
+import time
+import random
+import logging
+import threading
+from decimal import Decimal
+from concurrent.futures import ThreadPoolExecutor
+import json_codec
+from location_sync import post_chunk_to_db_api
+
+'''
+Where the location sync writes its chunks of serialized stations.
+LOCATION_WRITE_SINK is "db_api" (default, POST to DB_API), "dynamodb:<table name>" to write straight to the
+location table with BatchWriteItem, or "stub" for a DynamoDB sink on an in memory table for local runs and tests.
+The DynamoDB sink splits a chunk in batches of 25 items, writes them in parallel and retries UnprocessedItems
+with jittered exponential backoff. boto3 is only imported when the DynamoDB sink is used.
+'''
+
+LOCATION_WRITE_SINK = os.environ.get("LOCATION_WRITE_SINK", "db_api")
+DYNAMODB_BATCH_SIZE = 25
+DYNAMODB_WRITE_PARALLEL = int(os.environ.get("DYNAMODB_WRITE_PARALLEL", 4))
+DYNAMODB_WRITE_MAX_ATTEMPTS = int(os.environ.get("DYNAMODB_WRITE_MAX_ATTEMPTS", 8))
+DYNAMODB_WRITE_BASE_DELAY = float(os.environ.get("DYNAMODB_WRITE_BASE_DELAY", 0.05))
+DYNAMODB_WRITE_MAX_DELAY = float(os.environ.get("DYNAMODB_WRITE_MAX_DELAY", 2.0))
+STATION_KEY_FIELDS = ("station_id", "vendor_id")
+
+
+def _to_dynamodb(value):
+    # DynamoDB numbers are Decimals, floats are refused by the type serializer
+    if isinstance(value, float):
+        return Decimal(repr(value))
+    if isinstance(value, dict):
+        return {name: _to_dynamodb(item) for name, item in value.items()}
+    if isinstance(value, list):
+        return [_to_dynamodb(item) for item in value]
+    return value
+
+
+class DynamoDbSink:
+    def __init__(self, table_name: str, client=None, max_workers: int = None, max_attempts: int = None):
+        self.table_name = table_name
+        self.max_workers = max_workers or DYNAMODB_WRITE_PARALLEL
+        self.max_attempts = max_attempts or DYNAMODB_WRITE_MAX_ATTEMPTS
+        self._client = client
+        self._serializer = None
+        self._executor = None
+        self._lock = threading.Lock()
+        self.batches = 0
+        self.retries = 0
+
+    def _setup(self):
+        with self._lock:
+            if self._serializer is None:
+                # boto3 is heavy on cold start, only load it for this sink
+                from boto3.dynamodb.types import TypeSerializer
+                self._serializer = TypeSerializer()
+            if self._client is None:
+                import boto3
+                from botocore.config import Config
+                self._client = boto3.client("dynamodb",
+                                            config=Config(max_pool_connections=max(10, self.max_workers * 2)))
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="dynamodb-write")
+
+    def _put_requests(self, chunk) -> list:
+        requests_by_key = {}
+        for serialized_station in chunk:
+            station = _to_dynamodb(json_codec.loads(serialized_station))
+            item = {name: self._serializer.serialize(value) for name, value in station.items()}
+            # a batch may not hold the same key twice, the last version wins
+            key = tuple(station.get(field) for field in STATION_KEY_FIELDS)
+            requests_by_key[key] = {"PutRequest": {"Item": item}}
+        return list(requests_by_key.values())
+
+    @staticmethod
+    def backoff_delay(attempt: int) -> float:
+        return random.uniform(0, min(DYNAMODB_WRITE_MAX_DELAY, DYNAMODB_WRITE_BASE_DELAY * 2 ** attempt))
+
+    def write_batch(self, write_requests: list) -> bool:
+        for attempt in range(self.max_attempts):
+            try:
+                response = self._client.batch_write_item(RequestItems={self.table_name: write_requests})
+            except Exception:
+                logging.exception(f"BatchWriteItem of {len(write_requests)} stations to {self.table_name} failed")
+                return False
+            write_requests = response.get("UnprocessedItems", {}).get(self.table_name, [])
+            if not write_requests:
+                return True
+            with self._lock:
+                self.retries += 1
+            time.sleep(self.backoff_delay(attempt))
+        logging.error(f"{len(write_requests)} stations still unprocessed by {self.table_name} "
+                      f"after {self.max_attempts} attempts")
+        return False
+
+    def __call__(self, chunk) -> bool:
+        self._setup()
+        try:
+            write_requests = self._put_requests(chunk)
+        except (TypeError, ValueError):
+            logging.exception(f"Could not convert chunk of {len(chunk)} stations to DynamoDB items")
+            return False
+        batches = [write_requests[start:start + DYNAMODB_BATCH_SIZE]
+                   for start in range(0, len(write_requests), DYNAMODB_BATCH_SIZE)]
+        with self._lock:
+            self.batches += len(batches)
+        return all(list(self._executor.map(self.write_batch, batches)))
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"batches": self.batches, "retries": self.retries}
+
+
+class StubDynamoDbClient:
+    """
+    In memory stand in for the BatchWriteItem call of the DynamoDB client.
+    The first unprocessed_attempts calls leave the second half of their items unprocessed, like throttling does.
+    """
+
+    def __init__(self, unprocessed_attempts: int = 0):
+        self.unprocessed_attempts = unprocessed_attempts
+        self.tables = {}
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def batch_write_item(self, RequestItems: dict) -> dict:
+        unprocessed = {}
+        with self._lock:
+            self.calls += 1
+            throttled = self.unprocessed_attempts > 0
+            self.unprocessed_attempts -= int(throttled)
+            for table_name, write_requests in RequestItems.items():
+                if len(write_requests) > DYNAMODB_BATCH_SIZE:
+                    raise ValueError("Too many items requested for the BatchWriteItem call")
+                processed = write_requests[:len(write_requests) // 2] if throttled else write_requests
+                table = self.tables.setdefault(table_name, {})
+                for write_request in processed:
+                    item = write_request["PutRequest"]["Item"]
+                    table[tuple(item[field]["S"] for field in STATION_KEY_FIELDS)] = item
+                if len(processed) < len(write_requests):
+                    unprocessed[table_name] = write_requests[len(processed):]
+        return {"UnprocessedItems": unprocessed}
+
+
+def sink_from_env(sink: str = None):
+    sink = sink or LOCATION_WRITE_SINK
+    if sink.startswith("dynamodb:"):
+        return DynamoDbSink(sink[len("dynamodb:"):])
+    if sink == "stub":
+        return DynamoDbSink("stations", client=StubDynamoDbClient())
+    return post_chunk_to_db_api
+
+
+location_sink = sink_from_env()